@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+Local fake of the mail.tm API and its Mercure hub.
+
+Lets the backend run and be exercised fully offline:
+
+    python fake_mailtm.py --port 9100
+    MAILTM_BASE_URL=http://127.0.0.1:9100 \
+    MERCURE_HUB_URL=http://127.0.0.1:9100/.well-known/mercure \
+    uvicorn server:app --port 8001
+
+Messages are injected with `POST /_fake/accounts/{account_id}/messages`
+(JSON body with optional `from`, `subject`, `text`, `html`, `count` and
+`attachments`, a list of `{filename, contentType, content}` with base64
+content); subscribers of the account's Mercure topic are notified immediately.
+
+For benchmarks the fake can add latency (`--latency`, `--jitter`), fail a
+share of requests with 500 (`--error-rate`), answer 429 with Retry-After
+above a request rate (`--rate-limit`) and seed every new account with
+`--inbox-size` messages. Request counts are served at `GET /_fake/stats`,
+existing account ids at `GET /_fake/accounts`.
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import random
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from aiohttp import web
+
+FAKE_DOMAIN = "fake-mail.test"
+PAGE_SIZE = 30
+TOKEN_TTL = 3600
+
+
+class FakeMailTm:
+    """In-memory accounts, messages and Mercure subscribers"""
+
+    def __init__(self, domain: str = FAKE_DOMAIN, token_ttl: float = TOKEN_TTL,
+                 latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 rate_limit: float = 0.0, inbox_size: int = 0):
+        self.domain = domain
+        self.token_ttl = token_ttl
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.inbox_size = inbox_size
+        self._window_start = 0.0
+        self._window_count = 0
+        self.accounts: Dict[str, Dict[str, Any]] = {}
+        self.tokens: Dict[str, Tuple[str, float]] = {}
+        self.messages: Dict[str, List[Dict[str, Any]]] = {}
+        self.subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self.attachment_bodies: Dict[Tuple[str, str], bytes] = {}
+        self.calls: Dict[str, int] = {}
+        self._event_seq = 0
+
+    def count(self, name: str):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def throttled(self) -> bool:
+        """Fixed one-second window; True once the window's budget is spent"""
+        if self.rate_limit <= 0:
+            return False
+        now = time.monotonic()
+        if now - self._window_start >= 1.0:
+            self._window_start = now
+            self._window_count = 0
+        self._window_count += 1
+        return self._window_count > self.rate_limit
+
+    def account_for(self, request: web.Request) -> str:
+        auth = request.headers.get("Authorization", "")
+        account_id, expires_at = self.tokens.get(auth[len("Bearer "):], (None, 0.0)) if auth.startswith("Bearer ") else (None, 0.0)
+        if account_id is None or expires_at < time.time():
+            raise web.HTTPUnauthorized(text=json.dumps({"message": "Invalid JWT Token"}),
+                                       content_type="application/json")
+        return account_id
+
+    def issue_token(self, account_id: str) -> str:
+        """A JWT-shaped (unsigned) token whose payload carries `exp` like mail.tm's"""
+        expires_at = time.time() + self.token_ttl
+        payload = {"id": account_id, "exp": int(expires_at), "jti": uuid.uuid4().hex}
+        parts = [{"alg": "none", "typ": "JWT"}, payload]
+        token = ".".join(
+            base64.urlsafe_b64encode(json.dumps(part).encode()).decode().rstrip("=") for part in parts
+        ) + ".fake"
+        self.tokens[token] = (account_id, expires_at)
+        return token
+
+    def add_message(self, account_id: str, sender: str = "sender@example.com",
+                    subject: str = "Test message", text: str = "Hello",
+                    html: Optional[List[str]] = None,
+                    attachments: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+        account = self.accounts[account_id]
+        message_id = uuid.uuid4().hex[:24]
+        attachment_meta = []
+        for index, attachment in enumerate(attachments or []):
+            attachment_id = f"ATTACH{index:06d}"
+            content = base64.b64decode(attachment.get("content", ""))
+            self.attachment_bodies[(message_id, attachment_id)] = content
+            attachment_meta.append({
+                "id": attachment_id,
+                "filename": attachment.get("filename", f"file{index}"),
+                "contentType": attachment.get("contentType", "application/octet-stream"),
+                "disposition": "attachment",
+                "transferEncoding": "base64",
+                "related": False,
+                "size": len(content),
+                "downloadUrl": f"/messages/{message_id}/attachment/{attachment_id}",
+            })
+        message = {
+            "@id": "",
+            "@type": "Message",
+            "id": message_id,
+            "accountId": f"/accounts/{account_id}",
+            "msgid": f"<{uuid.uuid4().hex}@example.com>",
+            "from": {"address": sender, "name": ""},
+            "to": [{"address": account["address"], "name": ""}],
+            "subject": subject,
+            "intro": text[:120],
+            "text": text,
+            "html": html if html is not None else [f"<p>{text}</p>"],
+            "seen": False,
+            "hasAttachments": bool(attachment_meta),
+            "attachments": attachment_meta,
+            "size": len(text) + sum(item["size"] for item in attachment_meta),
+            "createdAt": datetime.now(timezone.utc).isoformat(),
+        }
+        message["@id"] = f"/messages/{message['id']}"
+        self.messages[account_id].insert(0, message)
+        self.publish(account_id, message)
+        return message
+
+    def publish(self, account_id: str, message: Dict[str, Any]):
+        self._event_seq += 1
+        for queue in self.subscribers.get(account_id, set()):
+            queue.put_nowait((str(self._event_seq), summary(message)))
+
+
+def summary(message: Dict[str, Any]) -> Dict[str, Any]:
+    """The listing representation of a message (no bodies)"""
+    return {key: value for key, value in message.items() if key not in ("text", "html", "attachments")}
+
+
+def create_app(fake: Optional[FakeMailTm] = None) -> web.Application:
+    fake = fake or FakeMailTm()
+
+    @web.middleware
+    async def faults(request: web.Request, handler):
+        if request.path.startswith("/_fake/"):
+            return await handler(request)
+        delay = fake.latency + random.uniform(0, fake.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if fake.throttled():
+            fake.count("429")
+            return web.json_response({"detail": "Too Many Requests"}, status=429, headers={"Retry-After": "1"})
+        if fake.error_rate > 0 and random.random() < fake.error_rate:
+            fake.count("500")
+            return web.json_response({"detail": "Internal Server Error"}, status=500)
+        return await handler(request)
+
+    app = web.Application(middlewares=[faults])
+    app["fake"] = fake
+
+    async def domains(request: web.Request) -> web.Response:
+        fake.count("/domains")
+        return web.json_response({"hydra:member": [
+            {"id": "1", "domain": fake.domain, "isActive": True, "isPrivate": False}
+        ], "hydra:totalItems": 1})
+
+    async def create_account(request: web.Request) -> web.Response:
+        fake.count("/accounts")
+        data = await request.json()
+        address = data.get("address", "")
+        if not address.endswith(f"@{fake.domain}"):
+            return web.json_response({"detail": "Invalid domain"}, status=422)
+        if any(account["address"] == address for account in fake.accounts.values()):
+            return web.json_response({"detail": "Address already used"}, status=422)
+        account_id = uuid.uuid4().hex[:24]
+        fake.accounts[account_id] = {"id": account_id, "address": address, "password": data.get("password")}
+        fake.messages[account_id] = []
+        for index in range(fake.inbox_size):
+            fake.add_message(account_id, subject=f"Seeded message {index}", text=f"Seeded body {index}")
+        return web.json_response({"id": account_id, "address": address}, status=201)
+
+    async def delete_account(request: web.Request) -> web.Response:
+        fake.count("/accounts/{id}")
+        account_id = request.match_info["account_id"]
+        if account_id not in fake.accounts:
+            return web.json_response({"detail": "Not Found"}, status=404)
+        if fake.account_for(request) != account_id:
+            return web.json_response({"detail": "Access Denied."}, status=403)
+        del fake.accounts[account_id]
+        for message in fake.messages.pop(account_id, []):
+            for attachment in message["attachments"]:
+                fake.attachment_bodies.pop((message["id"], attachment["id"]), None)
+        for token in [token for token, (owner, _) in fake.tokens.items() if owner == account_id]:
+            del fake.tokens[token]
+        return web.Response(status=204)
+
+    async def token(request: web.Request) -> web.Response:
+        fake.count("/token")
+        data = await request.json()
+        for account in fake.accounts.values():
+            if account["address"] == data.get("address") and account["password"] == data.get("password"):
+                return web.json_response({"id": account["id"], "token": fake.issue_token(account["id"])})
+        return web.json_response({"message": "Invalid credentials."}, status=401)
+
+    async def list_messages(request: web.Request) -> web.Response:
+        fake.count("/messages")
+        account_id = fake.account_for(request)
+        messages = fake.messages[account_id]
+        page = max(1, int(request.query.get("page", "1")))
+        page_items = messages[(page - 1) * PAGE_SIZE:page * PAGE_SIZE]
+        return web.json_response({"hydra:member": [summary(message) for message in page_items],
+                                  "hydra:totalItems": len(messages)})
+
+    async def get_message(request: web.Request) -> web.Response:
+        fake.count("/messages/{id}")
+        account_id = fake.account_for(request)
+        for message in fake.messages[account_id]:
+            if message["id"] == request.match_info["message_id"]:
+                return web.json_response(message)
+        return web.json_response({"detail": "Not Found"}, status=404)
+
+    async def get_attachment(request: web.Request) -> web.Response:
+        fake.count("/messages/{id}/attachment/{id}")
+        account_id = fake.account_for(request)
+        message_id = request.match_info["message_id"]
+        if not any(message["id"] == message_id for message in fake.messages[account_id]):
+            return web.json_response({"detail": "Not Found"}, status=404)
+        content = fake.attachment_bodies.get((message_id, request.match_info["attachment_id"]))
+        if content is None:
+            return web.json_response({"detail": "Not Found"}, status=404)
+        try:
+            byte_range = request.http_range
+        except ValueError:
+            byte_range = slice(None)
+        if byte_range.start is None and byte_range.stop is None:
+            return web.Response(body=content, content_type="application/octet-stream")
+        part = content[byte_range]
+        start = byte_range.start if byte_range.start is not None and byte_range.start >= 0 else len(content) - len(part)
+        return web.Response(body=part, status=206, content_type="application/octet-stream", headers={
+            "Content-Range": f"bytes {start}-{start + len(part) - 1}/{len(content)}",
+        })
+
+    async def mercure(request: web.Request) -> web.StreamResponse:
+        fake.count("/.well-known/mercure")
+        account_id = fake.account_for(request)
+        if request.query.get("topic") != f"/accounts/{account_id}":
+            raise web.HTTPForbidden()
+
+        queue: asyncio.Queue = asyncio.Queue()
+        fake.subscribers.setdefault(account_id, set()).add(queue)
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        try:
+            while True:
+                event_id, data = await queue.get()
+                await response.write(f"id: {event_id}\ndata: {json.dumps(data)}\n\n".encode())
+        finally:
+            fake.subscribers[account_id].discard(queue)
+        return response
+
+    async def inject(request: web.Request) -> web.Response:
+        account_id = request.match_info["account_id"]
+        if account_id not in fake.accounts:
+            return web.json_response({"detail": "Not Found"}, status=404)
+        data = await request.json() if request.can_read_body else {}
+        created = [
+            fake.add_message(account_id, sender=data.get("from", "sender@example.com"),
+                             subject=data.get("subject", "Test message"),
+                             text=data.get("text", "Hello"), html=data.get("html"),
+                             attachments=data.get("attachments"))
+            for _ in range(int(data.get("count", 1)))
+        ]
+        return web.json_response([message["id"] for message in created], status=201)
+
+    async def stats(request: web.Request) -> web.Response:
+        return web.json_response(fake.calls)
+
+    async def accounts(request: web.Request) -> web.Response:
+        return web.json_response(sorted(fake.accounts))
+
+    async def reset_stats(request: web.Request) -> web.Response:
+        fake.calls.clear()
+        return web.json_response({})
+
+    app.router.add_get("/domains", domains)
+    app.router.add_post("/accounts", create_account)
+    app.router.add_delete("/accounts/{account_id}", delete_account)
+    app.router.add_post("/token", token)
+    app.router.add_get("/messages", list_messages)
+    app.router.add_get("/messages/{message_id}", get_message)
+    app.router.add_get("/messages/{message_id}/attachment/{attachment_id}", get_attachment)
+    app.router.add_get("/.well-known/mercure", mercure)
+    app.router.add_post("/_fake/accounts/{account_id}/messages", inject)
+    app.router.add_get("/_fake/stats", stats)
+    app.router.add_delete("/_fake/stats", reset_stats)
+    app.router.add_get("/_fake/accounts", accounts)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake mail.tm API for offline development")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--token-ttl", type=float, default=TOKEN_TTL, help="token lifetime in seconds")
+    parser.add_argument("--latency", type=float, default=0.0, help="added delay per request in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random delay of up to this many seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 500")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="requests per second before answering 429")
+    parser.add_argument("--inbox-size", type=int, default=0, help="messages seeded into every new account")
+    args = parser.parse_args()
+    fake = FakeMailTm(token_ttl=args.token_ttl, latency=args.latency, jitter=args.jitter,
+                      error_rate=args.error_rate, rate_limit=args.rate_limit, inbox_size=args.inbox_size)
+    web.run_app(create_app(fake), host=args.host, port=args.port)
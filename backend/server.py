@@ -1,188 +1,3198 @@
 import os
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Header, Request, Response, WebSocket, Query
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, validator
-from typing import List, Optional, Dict, Any
+from starlette.datastructures import MutableHeaders
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from pydantic import BaseModel, Field, PrivateAttr, validator
+from typing import List, Optional, Dict, Any, Callable, Awaitable, Set, Tuple, Hashable, Union, AsyncIterator, NamedTuple, IO
 import asyncio
 import aiohttp
+import contextvars
 import json
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+import math
 import random
 import uuid
+import time
+import secrets
+import base64
+import sqlite3
+import gzip
+import threading
+import hashlib
+import html
+import re
+from html.parser import HTMLParser
+import tempfile
+from urllib.parse import quote
+from collections import OrderedDict, deque
+from email import message_from_bytes, policy as email_policy
+from email.utils import parsedate_to_datetime
+
+try:
+    from aiosmtpd.smtp import SMTP as SMTPServer
+except ImportError:  # optional, only needed for MAIL_PROVIDER=local
+    SMTPServer = None
+
+try:
+    import orjson
+except ImportError:  # optional, responses fall back to the stdlib encoder
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # optional, responses fall back to gzip
+    brotli = None
+
+try:
+    import regex
+except ImportError:  # optional, wait patterns then run on `re` without a time limit
+    regex = None
 
 # Configure logging
-logging.basicConfig(level=logging.INFO)
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
 logger = logging.getLogger(__name__)
 
-app = FastAPI(
-    title="Temporary Email Service",
-    description="Сервис для создания одноразовых email адресов",
-    version="1.0.0"
-)
+# Mail provider selection: "mailtm" (api.mail.tm) or "local" (in-process SMTP)
+MAIL_PROVIDER = os.environ.get("MAIL_PROVIDER", "mailtm").lower()
+
+# Metrics: Prometheus endpoint and optional per-request Server-Timing header
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() == "true"
+METRICS_TIMING_HEADER = os.environ.get("METRICS_TIMING_HEADER", "false").lower() == "true"
+
+# Response compression: brotli (when installed) or gzip for bodies of at least COMPRESSION_MIN_SIZE bytes
+COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", "1024"))  # 0 disables compression
+COMPRESSION_GZIP_LEVEL = int(os.environ.get("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get("COMPRESSION_BROTLI_QUALITY", "4"))
+COMPRESSION_THREAD_SIZE = int(os.environ.get("COMPRESSION_THREAD_SIZE", "262144"))
+COMPRESSION_CACHE_SIZE = int(os.environ.get("COMPRESSION_CACHE_SIZE", "1024"))  # compressed bodies kept by ETag
+
+# Upstream HTTP client configuration
+MAILTM_BASE_URL = os.environ.get("MAILTM_BASE_URL", "https://api.mail.tm")
+HTTP_POOL_LIMIT = int(os.environ.get("HTTP_POOL_LIMIT", "100"))
+HTTP_POOL_LIMIT_PER_HOST = int(os.environ.get("HTTP_POOL_LIMIT_PER_HOST", "50"))
+HTTP_DNS_CACHE_TTL = int(os.environ.get("HTTP_DNS_CACHE_TTL", "300"))
+HTTP_KEEPALIVE_TIMEOUT = float(os.environ.get("HTTP_KEEPALIVE_TIMEOUT", "30"))
+HTTP_TOTAL_TIMEOUT = float(os.environ.get("HTTP_TOTAL_TIMEOUT", "20"))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.environ.get("HTTP_READ_TIMEOUT", "10"))
+MESSAGE_FETCH_CONCURRENCY = int(os.environ.get("MESSAGE_FETCH_CONCURRENCY", "8"))
+MESSAGE_LIST_MAX_PAGES = int(os.environ.get("MESSAGE_LIST_MAX_PAGES", "10"))
+MESSAGE_PAGE_MAX_LIMIT = int(os.environ.get("MESSAGE_PAGE_MAX_LIMIT", "100"))
+
+# Upstream resilience: rate limiting, retries and circuit breaking
+UPSTREAM_RATE_LIMIT = float(os.environ.get("UPSTREAM_RATE_LIMIT", "8"))
+UPSTREAM_RATE_BURST = int(os.environ.get("UPSTREAM_RATE_BURST", "16"))
+HTTP_MAX_RETRIES = int(os.environ.get("HTTP_MAX_RETRIES", "2"))
+HTTP_RETRY_BASE_DELAY = float(os.environ.get("HTTP_RETRY_BASE_DELAY", "0.25"))
+HTTP_RETRY_MAX_DELAY = float(os.environ.get("HTTP_RETRY_MAX_DELAY", "4"))
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.environ.get("BREAKER_RESET_TIMEOUT", "30"))
+
+# Request coalescing
+COALESCE_RESULT_TTL = float(os.environ.get("COALESCE_RESULT_TTL", "1"))
+
+# Message rendering: HTML sanitization and previews
+# HTML_REMOTE_IMAGES: "block" (moved to data-remote-src) or "allow"
+HTML_REMOTE_IMAGES = os.environ.get("HTML_REMOTE_IMAGES", "block").lower()
+MESSAGE_SNIPPET_LENGTH = int(os.environ.get("MESSAGE_SNIPPET_LENGTH", "160"))
+RENDER_CACHE_SIZE = int(os.environ.get("RENDER_CACHE_SIZE", "10000"))
+
+# Message cache configuration
+MESSAGE_CACHE_MAX_INBOXES = int(os.environ.get("MESSAGE_CACHE_MAX_INBOXES", "10000"))
+MESSAGE_CACHE_MAX_MESSAGES = int(os.environ.get("MESSAGE_CACHE_MAX_MESSAGES", "100000"))
+MESSAGE_CACHE_TTL = float(os.environ.get("MESSAGE_CACHE_TTL", "3600"))
+DOMAIN_CACHE_TTL = float(os.environ.get("DOMAIN_CACHE_TTL", "3600"))
+DOMAIN_CACHE_RETRY_INTERVAL = float(os.environ.get("DOMAIN_CACHE_RETRY_INTERVAL", "30"))
+
+# Persistent inbox registry
+INBOX_STORE_PATH = os.environ.get(
+    "INBOX_STORE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "tempmail.db")
+)
+TOKEN_REFRESH_INTERVAL = float(os.environ.get("TOKEN_REFRESH_INTERVAL", "60"))
+TOKEN_REFRESH_MARGIN = float(os.environ.get("TOKEN_REFRESH_MARGIN", "600"))
+TOKEN_REFRESH_CONCURRENCY = int(os.environ.get("TOKEN_REFRESH_CONCURRENCY", "4"))
+# Only inboxes used within this many seconds are renewed ahead; idle ones on their next request
+TOKEN_REFRESH_ACTIVE_WINDOW = float(os.environ.get("TOKEN_REFRESH_ACTIVE_WINDOW", "1800"))
+TOKEN_LAZY_RENEW_MARGIN = float(os.environ.get("TOKEN_LAZY_RENEW_MARGIN", "30"))
+
+# Inbox lifecycle: accounts are deleted upstream INBOX_TTL seconds after creation (0 keeps them)
+INBOX_TTL = float(os.environ.get("INBOX_TTL", "86400"))
+INBOX_REAPER_INTERVAL = float(os.environ.get("INBOX_REAPER_INTERVAL", "60"))
+INBOX_REAPER_BATCH_SIZE = int(os.environ.get("INBOX_REAPER_BATCH_SIZE", "50"))
+INBOX_REAPER_CONCURRENCY = int(os.environ.get("INBOX_REAPER_CONCURRENCY", "4"))
+
+# Batch API
+BATCH_MAX_INBOXES = int(os.environ.get("BATCH_MAX_INBOXES", "100"))
+BATCH_CREATE_CONCURRENCY = int(os.environ.get("BATCH_CREATE_CONCURRENCY", "8"))
+BATCH_MESSAGES_CONCURRENCY = int(os.environ.get("BATCH_MESSAGES_CONCURRENCY", "16"))
+
+# Attachments
+ATTACHMENT_MAX_SIZE = int(os.environ.get("ATTACHMENT_MAX_SIZE", str(25 * 1024 * 1024)))
+ATTACHMENT_CHUNK_SIZE = int(os.environ.get("ATTACHMENT_CHUNK_SIZE", str(64 * 1024)))
+ATTACHMENT_CACHE_DIR = os.environ.get("ATTACHMENT_CACHE_DIR", "")
+ATTACHMENT_CACHE_MAX_BYTES = int(os.environ.get("ATTACHMENT_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+# Server push configuration
+STREAM_POLL_INTERVAL = float(os.environ.get("STREAM_POLL_INTERVAL", "5"))
+STREAM_KEEPALIVE_INTERVAL = float(os.environ.get("STREAM_KEEPALIVE_INTERVAL", "15"))
+STREAM_MAX_BACKOFF = float(os.environ.get("STREAM_MAX_BACKOFF", "60"))
+
+# Long-poll waits
+WAIT_DEFAULT_TIMEOUT = float(os.environ.get("WAIT_DEFAULT_TIMEOUT", "30"))
+WAIT_MAX_TIMEOUT = float(os.environ.get("WAIT_MAX_TIMEOUT", "120"))
+WAIT_REGEX_MAX_LENGTH = int(os.environ.get("WAIT_REGEX_MAX_LENGTH", "256"))
+WAIT_REGEX_MAX_TEXT = int(os.environ.get("WAIT_REGEX_MAX_TEXT", "65536"))
+WAIT_REGEX_TIMEOUT = float(os.environ.get("WAIT_REGEX_TIMEOUT", "0.1"))
+
+# Local SMTP provider
+LOCAL_SMTP_HOST = os.environ.get("LOCAL_SMTP_HOST", "0.0.0.0")
+LOCAL_SMTP_PORT = int(os.environ.get("LOCAL_SMTP_PORT", "2525"))
+LOCAL_MAIL_DOMAINS = [
+    domain.strip() for domain in os.environ.get("LOCAL_MAIL_DOMAINS", "localhost").split(",") if domain.strip()
+]
+LOCAL_MAX_MESSAGES_PER_INBOX = int(os.environ.get("LOCAL_MAX_MESSAGES_PER_INBOX", "200"))
+LOCAL_MAX_MESSAGE_SIZE = int(os.environ.get("LOCAL_MAX_MESSAGE_SIZE", str(10 * 1024 * 1024)))
+
+# Pre-provisioned inbox pool
+INBOX_POOL_ENABLED = os.environ.get("INBOX_POOL_ENABLED", "true").lower() in ("1", "true", "yes")
+INBOX_POOL_LOW_WATERMARK = int(os.environ.get("INBOX_POOL_LOW_WATERMARK", "5"))
+INBOX_POOL_HIGH_WATERMARK = int(os.environ.get("INBOX_POOL_HIGH_WATERMARK", "20"))
+INBOX_POOL_REFILL_CONCURRENCY = int(os.environ.get("INBOX_POOL_REFILL_CONCURRENCY", "4"))
+INBOX_POOL_MAX_AGE = float(os.environ.get("INBOX_POOL_MAX_AGE", "1800"))
+INBOX_POOL_RETRY_DELAY = float(os.environ.get("INBOX_POOL_RETRY_DELAY", "30"))
+
+# Upstream Mercure event ingestion
+MERCURE_ENABLED = os.environ.get("MERCURE_ENABLED", "true").lower() in ("1", "true", "yes")
+MERCURE_HUB_URL = os.environ.get("MERCURE_HUB_URL", "https://mercure.mail.tm/.well-known/mercure")
+MERCURE_IDLE_TIMEOUT = float(os.environ.get("MERCURE_IDLE_TIMEOUT", "300"))
+MERCURE_MIN_BACKOFF = float(os.environ.get("MERCURE_MIN_BACKOFF", "1"))
+MERCURE_MAX_BACKOFF = float(os.environ.get("MERCURE_MAX_BACKOFF", "60"))
+
+# JSON encoding
+def _json_dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+class FastJSONResponse(JSONResponse):
+    """JSON response encoded with orjson when available; bytes are sent as already encoded JSON"""
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return _json_dumps(content)
+
+app = FastAPI(
+    title="Temporary Email Service",
+    description="Сервис для создания одноразовых email адресов",
+    version="1.0.0",
+    default_response_class=FastJSONResponse,
+)
+
+# CORS configuration
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+    expose_headers=["X-Total-Count", "X-Domains-Stale", "Content-Range", "Content-Disposition", "Server-Timing", "ETag"],
+)
+
+# Response compression
+COMPRESSIBLE_TYPES = ("application/json", "text/")
+
+def _accepted_encoding(accept_encoding: str) -> Optional[str]:
+    """The preferred supported content coding for an Accept-Encoding header"""
+    accepted = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    for coding in ("br", "gzip") if brotli is not None else ("gzip",):
+        if accepted.get(coding, accepted.get("*", 0.0)) > 0:
+            return coding
+    return None
+
+def _compress(body: bytes, coding: str) -> bytes:
+    if coding == "br":
+        return brotli.compress(body, quality=COMPRESSION_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=COMPRESSION_GZIP_LEVEL, mtime=0)
+
+class CompressionMiddleware:
+    """
+    Plain ASGI middleware compressing complete responses of at least
+    `minimum_size` bytes. Streaming responses (no Content-Length: SSE,
+    attachments) pass through untouched so events are never buffered.
+    Strong ETags get the coding appended, as the compressed bytes differ;
+    they also key a small cache so unchanged bodies are compressed once.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE, cache_size: int = COMPRESSION_CACHE_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[Tuple[str, str], bytes]" = OrderedDict()
+
+    async def _compressed(self, body: bytes, coding: str, etag: Optional[str]) -> bytes:
+        key = (etag, coding)
+        if etag is not None:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                return cached
+        if len(body) >= COMPRESSION_THREAD_SIZE:
+            compressed = await asyncio.to_thread(_compress, body, coding)
+        else:
+            compressed = _compress(body, coding)
+        if etag is not None and self.cache_size > 0:
+            self._cache[key] = compressed
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return compressed
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.minimum_size <= 0:
+            await self.app(scope, receive, send)
+            return
+        
+        accept_encoding = b""
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                accept_encoding = value
+                break
+        coding = _accepted_encoding(accept_encoding.decode("latin-1"))
+        start_message = None
+        
+        async def send_compressed(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                compressible = (
+                    "content-length" in headers
+                    and "content-encoding" not in headers
+                    and headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)
+                )
+                if not compressible:
+                    await send(message)
+                    return
+                headers.add_vary_header("Accept-Encoding")
+                if coding is None:
+                    await send(message)
+                    return
+                # Hold the headers until the body shows whether compression is worth it
+                start_message = message
+                return
+            
+            if start_message is None or message["type"] != "http.response.body":
+                await send(message)
+                return
+            start, start_message = start_message, None
+            body = message.get("body", b"")
+            if len(body) >= self.minimum_size and not message.get("more_body", False):
+                headers = MutableHeaders(scope=start)
+                etag = headers.get("etag")
+                strong = etag is not None and etag.startswith('"')
+                body = await self._compressed(body, coding, etag if strong else None)
+                headers["Content-Encoding"] = coding
+                headers["Content-Length"] = str(len(body))
+                if strong:
+                    headers["ETag"] = f'{etag[:-1]}-{coding}"'
+                message = {**message, "body": body}
+            await send(start)
+            await send(message)
+        
+        await self.app(scope, receive, send_compressed)
+
+# Added before the metrics middleware so request timings include compression
+app.add_middleware(CompressionMiddleware)
+
+# Metrics
+HTTP_REQUESTS = Counter("tempmail_http_requests_total", "API requests", ["method", "route", "status"])
+HTTP_LATENCY = Histogram("tempmail_http_request_duration_seconds", "API request latency until the response starts",
+                         ["method", "route"])
+HTTP_IN_PROGRESS = Gauge("tempmail_http_requests_in_progress", "API requests being handled", ["method"])
+UPSTREAM_REQUESTS = Counter("tempmail_upstream_requests_total", "Mail.tm requests", ["method", "endpoint", "status"])
+UPSTREAM_LATENCY = Histogram("tempmail_upstream_request_duration_seconds", "Mail.tm request latency",
+                             ["method", "endpoint"])
+UPSTREAM_IN_PROGRESS = Gauge("tempmail_upstream_requests_in_progress", "Mail.tm requests in flight", ["endpoint"])
+UPSTREAM_PHASE = Histogram("tempmail_upstream_phase_duration_seconds",
+                           "Time spent waiting for a pooled connection, resolving DNS and connecting (TCP+TLS)",
+                           ["phase"])
+
+_ENDPOINT_ID_RE = re.compile(r"/(accounts|messages|attachment)/[^/?]+")
+
+def _endpoint_label(endpoint: str) -> str:
+    """Collapse ids so that e.g. /messages/abc becomes /messages/{id}"""
+    return _ENDPOINT_ID_RE.sub(lambda match: f"/{match.group(1)}/{{id}}", endpoint.split("?", 1)[0])
+
+class RequestTiming:
+    """Where the time of one API request went, rendered as a Server-Timing header"""
+
+    __slots__ = ("started", "upstream", "upstream_calls", "phases")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.upstream = 0.0
+        self.upstream_calls = 0
+        self.phases: Dict[str, float] = {}
+
+    def add_phase(self, phase: str, seconds: float):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def header(self) -> str:
+        # Upstream calls may overlap, so their sum can exceed the total
+        parts = [f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}"]
+        if self.upstream_calls:
+            parts.append(f'upstream;dur={self.upstream * 1000:.1f};desc="{self.upstream_calls} calls"')
+        parts.extend(f"{phase};dur={seconds * 1000:.1f}" for phase, seconds in self.phases.items())
+        return ", ".join(parts)
+
+_request_timing: contextvars.ContextVar[Optional[RequestTiming]] = contextvars.ContextVar("request_timing", default=None)
+
+class UpstreamTimer:
+    """Records one mail.tm request in the upstream metrics and the current request's timing"""
+
+    __slots__ = ("method", "endpoint", "status", "_started")
+
+    def __init__(self, method: str, endpoint: str):
+        self.method = method
+        self.endpoint = _endpoint_label(endpoint)
+        self.status = "error"
+
+    def __enter__(self) -> "UpstreamTimer":
+        UPSTREAM_IN_PROGRESS.labels(self.endpoint).inc()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self._started
+        UPSTREAM_IN_PROGRESS.labels(self.endpoint).dec()
+        UPSTREAM_LATENCY.labels(self.method, self.endpoint).observe(elapsed)
+        UPSTREAM_REQUESTS.labels(self.method, self.endpoint, self.status).inc()
+        timing = _request_timing.get()
+        if timing is not None:
+            timing.upstream += elapsed
+            timing.upstream_calls += 1
+
+def _upstream_trace_config() -> aiohttp.TraceConfig:
+    """aiohttp hooks that split upstream latency into pool wait, DNS and connect time"""
+    trace_config = aiohttp.TraceConfig()
+
+    def phase(name: str):
+        async def on_start(session, context, params):
+            setattr(context, name, time.perf_counter())
+
+        async def on_end(session, context, params):
+            started = getattr(context, name, None)
+            if started is None:
+                return
+            elapsed = time.perf_counter() - started
+            UPSTREAM_PHASE.labels(name).observe(elapsed)
+            timing = _request_timing.get()
+            if timing is not None:
+                timing.add_phase(name, elapsed)
+        return on_start, on_end
+
+    for name, start_signal, end_signal in (
+        ("queued", trace_config.on_connection_queued_start, trace_config.on_connection_queued_end),
+        ("dns", trace_config.on_dns_resolvehost_start, trace_config.on_dns_resolvehost_end),
+        ("connect", trace_config.on_connection_create_start, trace_config.on_connection_create_end),
+    ):
+        on_start, on_end = phase(name)
+        start_signal.append(on_start)
+        end_signal.append(on_end)
+    return trace_config
+
+class MetricsMiddleware:
+    """
+    Plain ASGI middleware (streaming responses pass through untouched)
+    recording per-route request metrics and, optionally, a Server-Timing header
+    """
+
+    def __init__(self, app, timing_header: bool = METRICS_TIMING_HEADER):
+        self.app = app
+        self.timing_header = timing_header
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        method = scope["method"]
+        timing = RequestTiming()
+        context_token = _request_timing.set(timing)
+        status = 500
+        observed = False
+        
+        def observe():
+            # Once per request, even if the app fails after the response started
+            nonlocal observed
+            if observed:
+                return
+            observed = True
+            route = scope.get("route")
+            route_path = route.path if route is not None else "unmatched"
+            HTTP_LATENCY.labels(method, route_path).observe(time.perf_counter() - timing.started)
+            HTTP_REQUESTS.labels(method, route_path, str(status)).inc()
+        
+        async def send_with_metrics(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.timing_header:
+                    MutableHeaders(scope=message).append("Server-Timing", timing.header())
+                observe()
+            await send(message)
+        
+        HTTP_IN_PROGRESS.labels(method).inc()
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        except Exception:
+            observe()
+            raise
+        finally:
+            HTTP_IN_PROGRESS.labels(method).dec()
+            _request_timing.reset(context_token)
+
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
+# Pydantic models
+class EmailAddress(BaseModel):
+    id: str
+    email: str
+    domain: str
+    password: str
+    created_at: datetime
+    token: Optional[str] = None
+    expires_at: Optional[datetime] = None
+
+class CachedJSONModel(BaseModel):
+    """
+    Model serialized at most once. Instances must not be mutated after their
+    first serialization; copies start without the cached JSON.
+    """
+
+    _json: Optional[bytes] = PrivateAttr(default=None)
+    _digest: Optional[bytes] = PrivateAttr(default=None)
+
+    def json_bytes(self) -> bytes:
+        # Private attributes are read through pydantic's slow __getattr__; use their storage directly
+        private = self.__pydantic_private__
+        if private["_json"] is None:
+            private["_json"] = self.model_dump_json().encode("utf-8")
+        return private["_json"]
+
+    def digest(self) -> bytes:
+        """Short hash of the cached JSON, the building block of list ETags"""
+        private = self.__pydantic_private__
+        if private["_digest"] is None:
+            private["_digest"] = hashlib.blake2b(self.json_bytes(), digest_size=8).digest()
+        return private["_digest"]
+
+    def model_copy(self, *, update: Optional[Dict[str, Any]] = None, deep: bool = False):
+        copy = super().model_copy(update=update, deep=deep)
+        for name, private in self.__private_attributes__.items():
+            setattr(copy, name, private.get_default())
+        return copy
+
+def _json_list(items: List[CachedJSONModel]) -> bytes:
+    """Splice the cached JSON of each item into a JSON array"""
+    return b"[" + b",".join(item.json_bytes() for item in items) + b"]"
+
+def _etag(parts: List[bytes]) -> str:
+    """Strong entity tag over the given parts"""
+    return '"' + hashlib.blake2b(b"\0".join(parts), digest_size=16).hexdigest() + '"'
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak If-None-Match comparison, ignoring the coding suffix added by compression"""
+    if not if_none_match:
+        return False
+    opaque = etag.strip('"')
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        candidate = candidate.removeprefix("W/").strip('"')
+        for coding in ("-br", "-gzip"):
+            candidate = candidate.removesuffix(coding)
+        if candidate == opaque:
+            return True
+    return False
+
+class EmailMessage(CachedJSONModel):
+    id: str
+    from_address: str
+    to_address: str
+    subject: str
+    body: str
+    html_body: Optional[str] = None
+    snippet: str = ""
+    received_at: datetime
+    attachments: List[Dict[str, Any]] = []
+
+    _summary: Optional["EmailMessageSummary"] = PrivateAttr(default=None)
+
+    def summary(self) -> "EmailMessageSummary":
+        """The headers-only view of this message, built once"""
+        private = self.__pydantic_private__
+        if private["_summary"] is None:
+            private["_summary"] = EmailMessageSummary.from_message(self)
+        return private["_summary"]
+
+class EmailMessageSummary(CachedJSONModel):
+    id: str
+    from_address: str
+    to_address: str
+    subject: str
+    snippet: str = ""
+    received_at: datetime
+    has_attachments: bool = False
+
+    @classmethod
+    def from_message(cls, message: EmailMessage) -> "EmailMessageSummary":
+        return cls(
+            id=message.id,
+            from_address=message.from_address,
+            to_address=message.to_address,
+            subject=message.subject,
+            snippet=message.snippet or _snippet(message.body),
+            received_at=message.received_at,
+            has_attachments=bool(message.attachments),
+        )
+
+class InboxRecord(BaseModel):
+    id: str
+    email: str
+    domain: str
+    password: str
+    created_at: datetime
+    # The token handed to the client; it stays valid as its credential
+    access_token: Optional[str] = None
+    # The current upstream token, renewed before it expires
+    token: Optional[str] = None
+    token_expires_at: Optional[datetime] = None
+    # When the account is deleted upstream; None keeps it
+    expires_at: Optional[datetime] = None
+
+    @classmethod
+    def from_inbox(cls, inbox: EmailAddress) -> "InboxRecord":
+        return cls(
+            id=inbox.id,
+            email=inbox.email,
+            domain=inbox.domain,
+            password=inbox.password,
+            created_at=inbox.created_at,
+            access_token=inbox.token,
+            token=inbox.token,
+            token_expires_at=_token_expiry(inbox.token),
+            expires_at=inbox.expires_at,
+        )
+
+class CreateEmailRequest(BaseModel):
+    custom_name: Optional[str] = None
+
+class EmailInboxResponse(BaseModel):
+    inbox: EmailAddress
+    messages: List[EmailMessage] = []
+    message_count: int = 0
+
+class WaitResponse(BaseModel):
+    matched: bool
+    message: Optional[EmailMessage] = None
+    code: Optional[str] = None
+    link: Optional[str] = None
+
+class BatchCreateRequest(BaseModel):
+    count: int = Field(..., ge=1, le=BATCH_MAX_INBOXES)
+    name_prefix: Optional[str] = None
+
+class BatchItemError(BaseModel):
+    index: int
+    status_code: int
+    detail: str
+
+class BatchCreateResponse(BaseModel):
+    inboxes: List[EmailAddress] = []
+    errors: List[BatchItemError] = []
+
+class BatchMessagesItem(BaseModel):
+    inbox_id: str
+    token: str
+    # Only messages newer than this message id or timestamp
+    since: Optional[str] = None
+
+class BatchMessagesRequest(BaseModel):
+    items: List[BatchMessagesItem] = Field(..., min_length=1, max_length=BATCH_MAX_INBOXES)
+    fields: str = Field("full", pattern="^(full|summary)$")
+
+class BatchMessagesResult(BaseModel):
+    inbox_id: str
+    messages: List[Union[EmailMessage, EmailMessageSummary]] = []
+    message_count: int = 0
+    error: Optional[BatchItemError] = None
+
+class BatchMessagesResponse(BaseModel):
+    results: List[BatchMessagesResult]
+
+# Mail provider interface
+class MailProvider:
+    """
+    Backend that owns inboxes and their messages. Routes only talk to the
+    module-level `mail_service`, which is one of the providers below.
+    Optional capabilities (inbox pool, upstream event ingestion) default to
+    None and are checked by callers.
+    """
+
+    inbox_pool: Optional["InboxPool"] = None
+    ingestor: Optional["MercureIngestor"] = None
+    inbox_store: Optional["InboxStore"] = None
+
+    def __init__(self):
+        self._listeners: List[Callable[[str], None]] = []
+
+    async def start(self):
+        """Acquire resources (called on app startup)"""
+
+    async def close(self):
+        """Release resources (called on app shutdown)"""
+
+    @property
+    def domains_stale(self) -> bool:
+        return False
+
+    def health_info(self) -> Dict[str, Any]:
+        """Provider-specific details reported by /api/health"""
+        return {}
+
+    def add_listener(self, listener: Callable[[str], None]):
+        """Register a callback invoked with the token whenever an inbox changes"""
+        self._listeners.append(listener)
+
+    def _notify(self, token: str):
+        for listener in self._listeners:
+            listener(token)
+
+    async def create_inbox(self, name: Optional[str] = None) -> EmailAddress:
+        raise NotImplementedError
+
+    async def get_messages(self, token: str) -> List[EmailMessage]:
+        raise NotImplementedError
+
+    async def list_messages(self, token: str) -> List[EmailMessageSummary]:
+        """Headers-only listing, newest first"""
+        return [message.summary() for message in await self.get_messages(token)]
+
+    async def get_message(self, token: str, message_id: str) -> EmailMessage:
+        for message in await self.get_messages(token):
+            if message.id == message_id:
+                return message
+        raise HTTPException(status_code=404, detail="Message not found")
+
+    async def get_domains(self) -> List[str]:
+        raise NotImplementedError
+
+    async def renew_token(self, record: "InboxRecord") -> Optional[str]:
+        """Issue a fresh token for a stored inbox; None if tokens never expire"""
+        return None
+
+    async def delete_inbox(self, record: "InboxRecord"):
+        """Delete the account and drop everything cached for it; a missing account is not an error"""
+        pass
+
+    async def open_attachment(self, token: str, message_id: str, attachment: Dict[str, Any],
+                              range_header: Optional[str] = None) -> "AttachmentStream":
+        raise HTTPException(status_code=404, detail="Attachment not found")
+
+def _token_expiry(token: Optional[str]) -> Optional[datetime]:
+    """Read the `exp` claim of a JWT without verifying it"""
+    if not token:
+        return None
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        exp = json.loads(base64.urlsafe_b64decode(payload))['exp']
+        return datetime.fromtimestamp(exp, timezone.utc)
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+def _parse_timestamp(value: Optional[str]) -> datetime:
+    if not value:
+        return datetime.now(timezone.utc)
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+def _as_utc(value: datetime) -> datetime:
+    return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+
+def _generate_address_name(name: Optional[str] = None) -> str:
+    # Timestamp plus a random suffix wide enough for bursts of creations within one second
+    if not name:
+        return f"user{int(datetime.now().timestamp())}{random.randint(100000, 999999)}"
+    return f"{name}{int(datetime.now().timestamp())}{random.randint(1000, 9999)}"
+
+# Message rendering
+class RenderedBody(NamedTuple):
+    html: Optional[str]
+    text: str
+    snippet: str
+
+def _snippet(text: str, length: int = MESSAGE_SNIPPET_LENGTH) -> str:
+    """Whitespace-collapsed start of a text, cut at a word boundary"""
+    text = " ".join(text.split())
+    if len(text) <= length:
+        return text
+    cut = text.rfind(" ", 0, length)
+    return text[:cut if cut > length // 2 else length].rstrip() + "…"
+
+class HTMLSanitizer(HTMLParser):
+    """
+    Allowlist HTML sanitizer for untrusted mail bodies. Scripts, styles,
+    frames and event handlers are dropped, links open in a new tab without a
+    referrer, tracking pixels are removed and remote images are either kept
+    (without a referrer) or parked in data-remote-src. Unknown tags are
+    unwrapped and open tags are always closed, so the output cannot break
+    the page it is embedded into. Plain text is collected in the same pass.
+    """
+
+    ALLOWED_TAGS = {
+        "a", "abbr", "b", "blockquote", "br", "caption", "center", "code", "col", "colgroup", "dd", "div",
+        "dl", "dt", "em", "font", "h1", "h2", "h3", "h4", "h5", "h6", "hr", "i", "img", "li", "ol", "p",
+        "pre", "s", "small", "span", "strike", "strong", "sub", "sup", "table", "tbody", "td", "tfoot",
+        "th", "thead", "tr", "u", "ul",
+    }
+    # Dropped together with everything inside them
+    DROPPED_TAGS = {
+        "script", "style", "head", "title", "iframe", "frame", "frameset", "object", "embed", "applet",
+        "noscript", "template", "svg", "math", "textarea", "select",
+    }
+    # Dropped tags without an end tag: dropping them must not swallow what follows
+    DROPPED_VOID_TAGS = {"embed", "frame", "param", "source", "track", "link", "meta", "base", "input"}
+    VOID_TAGS = {"br", "hr", "img", "col"}
+    BLOCK_TAGS = {
+        "blockquote", "br", "center", "dd", "div", "dl", "dt", "h1", "h2", "h3", "h4", "h5", "h6", "hr",
+        "li", "ol", "p", "pre", "table", "tr", "ul",
+    }
+    ALLOWED_ATTRIBUTES = {
+        "align", "alt", "bgcolor", "border", "cellpadding", "cellspacing", "color", "colspan", "dir",
+        "face", "height", "rowspan", "size", "style", "title", "valign", "width",
+    }
+    UNSAFE_STYLE = re.compile(
+        r"url\s*\(|image(-set)?\s*\(|cross-fade\s*\(|src\s*\(|expression\s*\(|javascript:|@import|behavior|-moz-binding",
+        re.IGNORECASE,
+    )
+    UNSAFE_STYLE_PROPERTIES = {"position", "behavior", "-moz-binding"}
+
+    def __init__(self, remote_images: str = HTML_REMOTE_IMAGES):
+        super().__init__(convert_charrefs=True)
+        self.remote_images = remote_images
+        self._out: List[str] = []
+        self._text: List[str] = []
+        self._open: List[str] = []
+        self._dropping = 0
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]):
+        if tag in self.DROPPED_VOID_TAGS:
+            return
+        if tag in self.DROPPED_TAGS:
+            self._dropping += 1
+            return
+        if self._dropping:
+            return
+        if tag in self.BLOCK_TAGS:
+            self._text.append("\n")
+        if tag not in self.ALLOWED_TAGS:
+            return
+        safe_attrs = self._filter_attributes(tag, attrs)
+        if safe_attrs is None:
+            return
+        rendered = "".join(f' {name}="{html.escape(value, quote=True)}"' for name, value in safe_attrs)
+        self._out.append(f"<{tag}{rendered}>")
+        if tag not in self.VOID_TAGS:
+            self._open.append(tag)
+
+    def handle_startendtag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]):
+        if tag in self.DROPPED_TAGS or tag in self.DROPPED_VOID_TAGS:
+            return
+        self.handle_starttag(tag, attrs)
+        if tag not in self.VOID_TAGS and self._open and self._open[-1] == tag:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag: str):
+        if tag in self.DROPPED_VOID_TAGS:
+            return
+        if tag in self.DROPPED_TAGS:
+            self._dropping = max(0, self._dropping - 1)
+            return
+        if self._dropping:
+            return
+        if tag in self.BLOCK_TAGS:
+            self._text.append("\n")
+        if tag not in self._open:
+            return
+        # Close anything left open inside this element
+        while self._open:
+            open_tag = self._open.pop()
+            self._out.append(f"</{open_tag}>")
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data: str):
+        if self._dropping:
+            return
+        self._out.append(html.escape(data, quote=False))
+        self._text.append(data)
+
+    def _filter_attributes(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> Optional[List[Tuple[str, str]]]:
+        """Safe attributes of a tag, or None when the whole tag should go"""
+        values = {name: value or "" for name, value in attrs}
+        safe = []
+        for name, value in values.items():
+            if name == "style":
+                value = self._clean_style(value)
+                if value:
+                    safe.append((name, value))
+            elif name in self.ALLOWED_ATTRIBUTES:
+                safe.append((name, value))
+        
+        if tag == "a":
+            href = values.get("href", "").strip()
+            if href.lower().startswith(("http://", "https://", "mailto:")):
+                safe += [("href", href), ("target", "_blank"), ("rel", "noopener noreferrer nofollow")]
+        elif tag == "img":
+            # data-remote-src is accepted back so that re-rendering our own output is stable
+            src = (values.get("src") or values.get("data-remote-src", "")).strip()
+            if self._is_tracker(values):
+                return None
+            if src.lower().startswith(("http://", "https://")):
+                if self.remote_images == "allow":
+                    safe += [("src", src), ("referrerpolicy", "no-referrer"), ("loading", "lazy")]
+                else:
+                    safe.append(("data-remote-src", src))
+            elif src.lower().startswith("data:image/"):
+                safe.append(("src", src))
+        return safe
+
+    @staticmethod
+    def _is_tracker(values: Dict[str, str]) -> bool:
+        style = values.get("style", "").replace(" ", "").lower()
+        if "display:none" in style or "visibility:hidden" in style:
+            return True
+        dimensions = [values.get("width", ""), values.get("height", "")]
+        for declaration in style.split(";"):
+            name, _, value = declaration.partition(":")
+            if name in ("width", "height", "max-width", "max-height"):
+                dimensions.append(value.removesuffix("!important"))
+        for value in dimensions:
+            match = re.fullmatch(r"(\d+(?:\.\d*)?)(?:px)?", value.strip().lower())
+            if match and float(match.group(1)) <= 1:
+                return True
+        return False
+
+    def _clean_style(self, style: str) -> str:
+        declarations = []
+        for declaration in style.split(";"):
+            name, _, value = declaration.partition(":")
+            # CSS escapes and comments can spell out url( and friends: drop any declaration using them
+            if "\\" in declaration or "/*" in declaration:
+                continue
+            if not value.strip() or name.strip().lower() in self.UNSAFE_STYLE_PROPERTIES or self.UNSAFE_STYLE.search(value):
+                continue
+            declarations.append(f"{name.strip()}: {value.strip()}")
+        return "; ".join(declarations)
+
+    def result(self) -> Tuple[str, str]:
+        self.close()
+        self._out.extend(f"</{tag}>" for tag in reversed(self._open))
+        self._open.clear()
+        lines = (" ".join(line.split()) for line in "".join(self._text).splitlines())
+        text = re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+        return "".join(self._out), text
+
+class MessageRenderer:
+    """
+    Renders message bodies once: sanitized HTML, plain text (derived from
+    the HTML when the message has none) and a snippet. Results are kept in
+    an LRU keyed by message id and content, so repeated polls, the store and
+    every viewer of a message reuse the same rendering.
+    """
+
+    def __init__(self, max_entries: int = RENDER_CACHE_SIZE, remote_images: str = HTML_REMOTE_IMAGES):
+        self.max_entries = max_entries
+        self.remote_images = remote_images
+        self._rendered: "OrderedDict[Tuple[str, int], RenderedBody]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, message_id: str, text: str, html_body: Optional[str]) -> RenderedBody:
+        key = (message_id, hash((text, html_body)))
+        rendered = self._rendered.get(key)
+        if rendered is not None:
+            self._rendered.move_to_end(key)
+            self.hits += 1
+            return rendered
+        
+        self.misses += 1
+        sanitized_html, html_text = None, ""
+        if html_body:
+            sanitizer = HTMLSanitizer(self.remote_images)
+            sanitizer.feed(html_body)
+            sanitized_html, html_text = sanitizer.result()
+        plain_text = text if text.strip() else html_text
+        rendered = RenderedBody(sanitized_html or None, plain_text, _snippet(plain_text))
+        self._rendered[key] = rendered
+        while len(self._rendered) > self.max_entries:
+            self._rendered.popitem(last=False)
+        return rendered
+
+    def render_message(self, message: EmailMessage) -> EmailMessage:
+        rendered = self.render(message.id, message.body, message.html_body)
+        if (rendered.html, rendered.text, rendered.snippet) == (message.html_body, message.body, message.snippet):
+            return message
+        return message.model_copy(update={"html_body": rendered.html, "body": rendered.text, "snippet": rendered.snippet})
+
+message_renderer = MessageRenderer()
+
+# Upstream resilience
+class TokenBucket:
+    """
+    Shared token-bucket limiter for upstream requests. `penalize` blocks
+    every caller for the given time, e.g. to honour a 429 Retry-After.
+    A non-positive rate disables limiting.
+    """
+
+    def __init__(self, rate: float = UPSTREAM_RATE_LIMIT, burst: int = UPSTREAM_RATE_BURST):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0 and self._blocked_until <= time.monotonic():
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    await asyncio.sleep(self._blocked_until - now)
+                    continue
+                if self.rate <= 0:
+                    return
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def penalize(self, delay: float):
+        self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "blocked_for": round(max(0.0, self._blocked_until - time.monotonic()), 3),
+        }
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive upstream failures and fails
+    fast until `reset_timeout` has passed; then a single probe request is
+    let through (half-open) and its outcome closes or re-opens the circuit.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+    def allow(self) -> bool:
+        if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def release(self):
+        """End a probe without a verdict (throttled or cancelled); the next call probes again"""
+        self._probe_in_flight = False
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def record_status(self, status_code: int):
+        """Verdict for an upstream error status: 5xx fail, 429 is undecided, 4xx answered fine"""
+        if status_code >= 500:
+            self.record_failure()
+        elif status_code == 429:
+            self.release()
+        else:
+            self.record_success()
+
+    def record_failure(self):
+        self.failures += 1
+        self._probe_in_flight = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning("Circuit breaker opened after %s upstream failures", self.failures)
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        info = {"state": self.state, "consecutive_failures": self.failures}
+        if self.state == self.OPEN:
+            info["retry_in"] = round(max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at)), 3)
+        return info
+
+def _retry_delay(attempt: int) -> float:
+    # Exponential backoff with full jitter
+    return random.uniform(0, min(HTTP_RETRY_MAX_DELAY, HTTP_RETRY_BASE_DELAY * 2 ** attempt))
+
+def _parse_retry_after(value: Optional[str], default: float = 1.0) -> float:
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        # HTTP-date form
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return default
+    return max(0.0, (retry_at - datetime.now(retry_at.tzinfo)).total_seconds())
+
+# Request coalescing
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls: callers using the same key await
+    one shared in-flight task. With a positive `result_ttl` a successful
+    result is also reused for that many seconds after it completes.
+    """
+
+    def __init__(self, result_ttl: float = 0.0):
+        self.result_ttl = result_ttl
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._results: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        self.calls += 1
+        cached = self._results.get(key)
+        if cached is not None and cached[0] > time.monotonic():
+            self.coalesced += 1
+            return cached[1]
+        
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._inflight[key] = asyncio.create_task(fn())
+            task.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            self.coalesced += 1
+        # A cancelled caller must not cancel the work shared with the others
+        return await asyncio.shield(task)
+
+    def forget(self, key: Hashable):
+        """Drop a reusable result so the next call goes upstream again"""
+        self._results.pop(key, None)
+
+    def _finish(self, key: Hashable, task: asyncio.Task):
+        self._inflight.pop(key, None)
+        now = time.monotonic()
+        while self._results and next(iter(self._results.values()))[0] <= now:
+            self._results.popitem(last=False)
+        if task.cancelled() or task.exception() is not None or self.result_ttl <= 0:
+            return
+        self._results.pop(key, None)
+        self._results[key] = (now + self.result_ttl, task.result())
+
+# Per-inbox message cache
+class MessageCache:
+    """
+    Parsed messages keyed by token and message id. Mail.tm message bodies
+    never change once delivered, so a cached body is reused until the
+    message disappears from the inbox listing. Inboxes are evicted in LRU
+    order once idle for longer than `ttl` or when the cache exceeds either
+    the inbox or the total message cap.
+    """
+
+    def __init__(self, max_inboxes: int = MESSAGE_CACHE_MAX_INBOXES,
+                 max_messages: int = MESSAGE_CACHE_MAX_MESSAGES,
+                 ttl: float = MESSAGE_CACHE_TTL):
+        self.max_inboxes = max_inboxes
+        self.max_messages = max_messages
+        self.ttl = ttl
+        self._inboxes: "OrderedDict[str, Dict[str, EmailMessage]]" = OrderedDict()
+        self._last_access: Dict[str, float] = {}
+        self._message_count = 0
+        # Summaries parsed from listings of messages whose body is not cached, with their update time
+        self._summaries: "OrderedDict[str, Tuple[float, Dict[str, EmailMessageSummary]]]" = OrderedDict()
+        # Message bodies reused from / missing in the cache while syncing inboxes
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._inboxes)
+
+    def __contains__(self, token: str) -> bool:
+        return token in self._inboxes
+
+    @property
+    def message_count(self) -> int:
+        return self._message_count
+
+    def get_inbox(self, token: str) -> Dict[str, EmailMessage]:
+        """Return the cached messages of an inbox, marking it as recently used"""
+        messages = self._inboxes.get(token)
+        if messages is None:
+            return {}
+        self._inboxes.move_to_end(token)
+        self._last_access[token] = time.monotonic()
+        return messages
+
+    def update_inbox(self, token: str, message_ids: List[str], new_messages: List[EmailMessage]):
+        """Store newly fetched messages and forget ids no longer listed upstream"""
+        current = self._inboxes.pop(token, {})
+        self._message_count -= len(current)
+        
+        listed = set(message_ids)
+        messages = {msg_id: msg for msg_id, msg in current.items() if msg_id in listed}
+        for message in new_messages:
+            messages[message.id] = message
+        
+        self._inboxes[token] = messages
+        self._last_access[token] = time.monotonic()
+        self._message_count += len(messages)
+        self._evict()
+
+    def add_message(self, token: str, message: EmailMessage):
+        """Store a single message delivered by an upstream event"""
+        messages = self._inboxes.get(token)
+        if messages is None:
+            messages = self._inboxes[token] = {}
+        if message.id not in messages:
+            self._message_count += 1
+        messages[message.id] = message
+        self._inboxes.move_to_end(token)
+        self._last_access[token] = time.monotonic()
+        self._evict()
+
+    def get_summaries(self, token: str) -> Dict[str, EmailMessageSummary]:
+        """Summaries parsed from the previous listing of an inbox, by message id"""
+        entry = self._summaries.get(token)
+        return entry[1] if entry is not None else {}
+
+    def update_summaries(self, token: str, summaries: Dict[str, EmailMessageSummary]):
+        """
+        Replace the parsed summaries of an inbox. Listing entries never change
+        for a message id, so reusing them keeps their cached JSON across polls.
+        """
+        self._summaries.pop(token, None)
+        now = time.monotonic()
+        if summaries:
+            self._summaries[token] = (now, summaries)
+        while self._summaries:
+            updated, _ = next(iter(self._summaries.values()))
+            if len(self._summaries) <= self.max_inboxes and updated >= now - self.ttl:
+                break
+            self._summaries.popitem(last=False)
+
+    def list_messages(self, token: str) -> List[EmailMessage]:
+        """Cached messages of an inbox, newest first"""
+        messages = self.get_inbox(token)
+        return sorted(messages.values(), key=lambda message: message.received_at, reverse=True)
+
+    def drop_inbox(self, token: str):
+        self._summaries.pop(token, None)
+        messages = self._inboxes.pop(token, None)
+        self._last_access.pop(token, None)
+        if messages is not None:
+            self._message_count -= len(messages)
+
+    def _evict(self):
+        deadline = time.monotonic() - self.ttl
+        while self._inboxes:
+            token = next(iter(self._inboxes))
+            over_cap = (len(self._inboxes) > self.max_inboxes
+                        or self._message_count > self.max_messages)
+            if not over_cap and self._last_access[token] >= deadline:
+                break
+            # Never evict the inbox that was just updated
+            if len(self._inboxes) == 1:
+                break
+            self.drop_inbox(token)
+
+# Persistent inbox registry
+class InboxStore:
+    """
+    Server-side registry of inboxes: credentials, the current upstream token
+    and its expiry, and the last known messages. Implementations must be
+    shareable between worker processes (SQLite file, Redis, ...).
+    """
+
+    async def init(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def save(self, record: InboxRecord):
+        raise NotImplementedError
+
+    async def get(self, inbox_id: str) -> Optional[InboxRecord]:
+        raise NotImplementedError
+
+    async def update_token(self, inbox_id: str, token: str, expires_at: Optional[datetime]):
+        raise NotImplementedError
+
+    async def claim_expiring(self, before: datetime, claim_for: float, limit: int = 100,
+                             seen_after: Optional[datetime] = None) -> List[InboxRecord]:
+        """
+        Atomically claim inboxes whose token expires before `before` (and,
+        with `seen_after`, that were used since then) so that only one worker
+        renews each of them
+        """
+        raise NotImplementedError
+
+    async def touch(self, inbox_id: str):
+        """Record that an inbox is in use; implementations may coalesce frequent calls"""
+        raise NotImplementedError
+
+    async def save_messages(self, token: str, messages: List[EmailMessage]):
+        raise NotImplementedError
+
+    async def load_messages(self, token: str) -> Optional[List[EmailMessage]]:
+        raise NotImplementedError
+
+    async def delete(self, inbox_id: str):
+        raise NotImplementedError
+
+    async def claim_expired(self, now: datetime, claim_for: float, limit: int = 100) -> List[InboxRecord]:
+        """Inboxes past their expiry, claimed for `claim_for` seconds so that one worker deletes each"""
+        raise NotImplementedError
+
+class SQLiteInboxStore(InboxStore):
+    """InboxStore on a local SQLite file in WAL mode, shared by all workers on the host"""
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS inboxes (
+            id TEXT PRIMARY KEY,
+            email TEXT NOT NULL,
+            domain TEXT NOT NULL,
+            password TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            access_token TEXT,
+            token TEXT,
+            token_expires_at REAL,
+            refresh_claimed_until REAL,
+            messages TEXT,
+            expires_at REAL,
+            delete_claimed_until REAL,
+            last_seen REAL
+        );
+    """
+    _INDEXES = """
+        CREATE INDEX IF NOT EXISTS inboxes_token ON inboxes (token);
+        CREATE INDEX IF NOT EXISTS inboxes_token_expires_at ON inboxes (token_expires_at);
+        CREATE INDEX IF NOT EXISTS inboxes_expires_at ON inboxes (expires_at);
+    """
+    # Columns added after the first release, for databases created before them
+    _ADDED_COLUMNS = {"expires_at": "REAL", "delete_claimed_until": "REAL", "last_seen": "REAL"}
+    _COLUMNS = "id, email, domain, password, created_at, access_token, token, token_expires_at, expires_at"
+
+    def __init__(self, path: str = INBOX_STORE_PATH, touch_interval: float = TOKEN_REFRESH_INTERVAL):
+        self.path = path
+        self.touch_interval = touch_interval
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        # When this worker last wrote last_seen, so that polls do not write on every request
+        self._touched: Dict[str, float] = {}
+
+    async def _run(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        def call():
+            with self._lock:
+                with self._conn:
+                    return fn(self._conn)
+        return await asyncio.to_thread(call)
+
+    async def init(self):
+        if self._conn is not None:
+            return
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        await self._run(self._migrate)
+
+    def _migrate(self, conn: sqlite3.Connection):
+        conn.executescript(self._SCHEMA)
+        existing = {row[1] for row in conn.execute("PRAGMA table_info(inboxes)")}
+        for column, column_type in self._ADDED_COLUMNS.items():
+            if column not in existing:
+                conn.execute(f"ALTER TABLE inboxes ADD COLUMN {column} {column_type}")
+        if "expires_at" not in existing and INBOX_TTL > 0:
+            # Inboxes recorded before expiry existed get a full TTL from now
+            conn.execute("UPDATE inboxes SET expires_at = ?", (time.time() + INBOX_TTL,))
+        conn.executescript(self._INDEXES)
+
+    async def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    @staticmethod
+    def _to_record(row: Tuple) -> InboxRecord:
+        return InboxRecord(
+            id=row[0], email=row[1], domain=row[2], password=row[3],
+            created_at=datetime.fromisoformat(row[4]), access_token=row[5], token=row[6],
+            token_expires_at=datetime.fromtimestamp(row[7], timezone.utc) if row[7] is not None else None,
+            expires_at=datetime.fromtimestamp(row[8], timezone.utc) if row[8] is not None else None,
+        )
+
+    async def save(self, record: InboxRecord):
+        token_expires_at = record.token_expires_at.timestamp() if record.token_expires_at else None
+        expires_at = record.expires_at.timestamp() if record.expires_at else None
+        await self._run(lambda conn: conn.execute(
+            f"INSERT OR REPLACE INTO inboxes ({self._COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (record.id, record.email, record.domain, record.password, record.created_at.isoformat(),
+             record.access_token, record.token, token_expires_at, expires_at),
+        ))
+
+    async def get(self, inbox_id: str) -> Optional[InboxRecord]:
+        row = await self._run(lambda conn: conn.execute(
+            f"SELECT {self._COLUMNS} FROM inboxes WHERE id = ?", (inbox_id,)
+        ).fetchone())
+        return self._to_record(row) if row else None
+
+    async def update_token(self, inbox_id: str, token: str, expires_at: Optional[datetime]):
+        await self._run(lambda conn: conn.execute(
+            "UPDATE inboxes SET token = ?, token_expires_at = ?, refresh_claimed_until = NULL WHERE id = ?",
+            (token, expires_at.timestamp() if expires_at else None, inbox_id),
+        ))
+
+    async def claim_expiring(self, before: datetime, claim_for: float, limit: int = 100,
+                             seen_after: Optional[datetime] = None) -> List[InboxRecord]:
+        def claim(conn: sqlite3.Connection) -> List[InboxRecord]:
+            now = time.time()
+            seen_filter = "AND last_seen >= ? " if seen_after is not None else ""
+            seen_args = (seen_after.timestamp(),) if seen_after is not None else ()
+            rows = conn.execute(
+                f"SELECT {self._COLUMNS} FROM inboxes WHERE token_expires_at < ? {seen_filter}"
+                "AND (refresh_claimed_until IS NULL OR refresh_claimed_until < ?) LIMIT ?",
+                (before.timestamp(), *seen_args, now, limit),
+            ).fetchall()
+            claimed = []
+            for row in rows:
+                # The guard makes the claim atomic across workers
+                cursor = conn.execute(
+                    "UPDATE inboxes SET refresh_claimed_until = ? WHERE id = ? "
+                    "AND (refresh_claimed_until IS NULL OR refresh_claimed_until < ?)",
+                    (now + claim_for, row[0], now),
+                )
+                if cursor.rowcount:
+                    claimed.append(self._to_record(row))
+            return claimed
+        return await self._run(claim)
+
+    async def claim_expired(self, now: datetime, claim_for: float, limit: int = 100) -> List[InboxRecord]:
+        def claim(conn: sqlite3.Connection) -> List[InboxRecord]:
+            claimed_at = time.time()
+            rows = conn.execute(
+                f"SELECT {self._COLUMNS} FROM inboxes WHERE expires_at < ? "
+                "AND (delete_claimed_until IS NULL OR delete_claimed_until < ?) LIMIT ?",
+                (now.timestamp(), claimed_at, limit),
+            ).fetchall()
+            claimed = []
+            for row in rows:
+                cursor = conn.execute(
+                    "UPDATE inboxes SET delete_claimed_until = ? WHERE id = ? "
+                    "AND (delete_claimed_until IS NULL OR delete_claimed_until < ?)",
+                    (claimed_at + claim_for, row[0], claimed_at),
+                )
+                if cursor.rowcount:
+                    claimed.append(self._to_record(row))
+            return claimed
+        return await self._run(claim)
+
+    async def touch(self, inbox_id: str):
+        now = time.time()
+        if now - self._touched.get(inbox_id, 0.0) < self.touch_interval:
+            return
+        if len(self._touched) >= 10000:
+            self._touched = {key: at for key, at in self._touched.items() if now - at < self.touch_interval}
+        self._touched[inbox_id] = now
+        await self._run(lambda conn: conn.execute("UPDATE inboxes SET last_seen = ? WHERE id = ?", (now, inbox_id)))
+
+    async def save_messages(self, token: str, messages: List[EmailMessage]):
+        payload = _json_list(messages).decode("utf-8")
+        await self._run(lambda conn: conn.execute(
+            "UPDATE inboxes SET messages = ? WHERE token = ?", (payload, token)
+        ))
+
+    async def load_messages(self, token: str) -> Optional[List[EmailMessage]]:
+        row = await self._run(lambda conn: conn.execute(
+            "SELECT messages FROM inboxes WHERE token = ?", (token,)
+        ).fetchone())
+        if not row or row[0] is None:
+            return None
+        return [EmailMessage.model_validate(item) for item in json.loads(row[0])]
+
+    async def delete(self, inbox_id: str):
+        await self._run(lambda conn: conn.execute("DELETE FROM inboxes WHERE id = ?", (inbox_id,)))
+
+class TokenRefresher:
+    """
+    Renews stored upstream tokens shortly before they expire, so polls never
+    pay for a re-login. Only inboxes used within `active_window` are renewed
+    ahead; idle ones are renewed on their next request instead of spending
+    the upstream budget. Each worker runs one; claims keep them from
+    renewing the same inbox twice.
+    """
+
+    def __init__(self, store: InboxStore, provider: "MailProvider",
+                 interval: float = TOKEN_REFRESH_INTERVAL, margin: float = TOKEN_REFRESH_MARGIN,
+                 concurrency: int = TOKEN_REFRESH_CONCURRENCY, active_window: float = TOKEN_REFRESH_ACTIVE_WINDOW):
+        self.store = store
+        self.provider = provider
+        self.interval = interval
+        self.margin = margin
+        self.active_window = active_window
+        self.concurrency = max(1, concurrency)
+        self._task: Optional[asyncio.Task] = None
+        self.refreshed = 0
+        self.failed = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh_due()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Token refresh sweep failed: %s", e)
+            await asyncio.sleep(self.interval)
+
+    async def refresh_due(self):
+        now = datetime.now(timezone.utc)
+        before = now + timedelta(seconds=self.margin + self.interval)
+        records = await self.store.claim_expiring(before, claim_for=self.interval * 2,
+                                                  seen_after=now - timedelta(seconds=self.active_window))
+        semaphore = asyncio.Semaphore(self.concurrency)
+        
+        async def refresh(record: InboxRecord):
+            async with semaphore:
+                try:
+                    token = await self.provider.renew_token(record)
+                except Exception as e:
+                    self.failed += 1
+                    logger.error("Failed to renew token for inbox %s: %s", record.id, e)
+                    return
+            if token:
+                await self.store.update_token(record.id, token, _token_expiry(token))
+                self.refreshed += 1
+        
+        await asyncio.gather(*(refresh(record) for record in records))
+
+class InboxReaper:
+    """
+    Deletes inboxes whose TTL has passed, in batches of `batch_size` with at
+    most `concurrency` deletions in flight. A failed deletion stays claimed
+    for a few intervals and is retried by a later sweep.
+    """
+
+    def __init__(self, store: InboxStore, release: Callable[[InboxRecord], Awaitable[None]],
+                 interval: float = INBOX_REAPER_INTERVAL, batch_size: int = INBOX_REAPER_BATCH_SIZE,
+                 concurrency: int = INBOX_REAPER_CONCURRENCY):
+        self.store = store
+        self._release = release
+        self.interval = interval
+        self.batch_size = max(1, batch_size)
+        self.concurrency = max(1, concurrency)
+        self._task: Optional[asyncio.Task] = None
+        self.deleted = 0
+        self.failed = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                # Keep going while batches come back full
+                while await self.sweep() == self.batch_size:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Inbox expiry sweep failed: %s", e)
+            await asyncio.sleep(self.interval)
+
+    async def sweep(self) -> int:
+        """Delete one batch of expired inboxes; returns the batch size"""
+        records = await self.store.claim_expired(datetime.now(timezone.utc), claim_for=self.interval * 5,
+                                                 limit=self.batch_size)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        
+        async def release(record: InboxRecord):
+            async with semaphore:
+                try:
+                    await self._release(record)
+                    self.deleted += 1
+                except Exception as e:
+                    self.failed += 1
+                    logger.error("Failed to delete expired inbox %s: %s", record.id, e)
+        
+        await asyncio.gather(*(release(record) for record in records))
+        return len(records)
+
+# Attachments
+class AttachmentStream:
+    """An attachment body being streamed to the client chunk by chunk"""
+
+    def __init__(self, chunks: AsyncIterator[bytes], status_code: int = 200,
+                 headers: Optional[Dict[str, str]] = None):
+        self.chunks = chunks
+        self.status_code = status_code
+        self.headers = headers or {}
+
+def _parse_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Resolve a single `bytes=` range against `size` to inclusive (start, end).
+    None means the whole body; multi-range requests are served whole.
+    """
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    start_text, _, end_text = range_header[len("bytes="):].strip().partition("-")
+    try:
+        if not start_text:
+            length = int(end_text)
+            if length <= 0:
+                raise ValueError
+            start, end = max(0, size - length), size - 1
+        else:
+            start = int(start_text)
+            end = int(end_text) if end_text else size - 1
+            if end_text and end < start:
+                # Syntactically invalid (RFC 9110 14.1.1): ignore the header
+                return None
+            end = min(end, size - 1)
+    except ValueError:
+        return None
+    if start >= size:
+        raise HTTPException(status_code=416, detail="Requested range not satisfiable",
+                            headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+def _attachment_headers(attachment: Dict[str, Any]) -> Dict[str, str]:
+    filename = attachment.get("filename") or "attachment"
+    return {
+        "Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename)}",
+        "Accept-Ranges": "bytes",
+    }
+
+async def _limit_size(chunks: AsyncIterator[bytes], limit: int) -> AsyncIterator[bytes]:
+    sent = 0
+    async for chunk in chunks:
+        sent += len(chunk)
+        if sent > limit:
+            # Headers are already out; dropping the connection is all we can do
+            logger.error("Attachment exceeded the %s byte cap mid-stream", limit)
+            raise HTTPException(status_code=413, detail="Attachment too large")
+        yield chunk
+
+def _bytes_stream(content: bytes, attachment: Dict[str, Any], range_header: Optional[str]) -> AttachmentStream:
+    """Serve an in-memory attachment, honouring Range"""
+    headers = _attachment_headers(attachment)
+    byte_range = _parse_range(range_header, len(content))
+    start, end = byte_range or (0, len(content) - 1)
+    headers["Content-Length"] = str(max(0, end - start + 1))
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{len(content)}"
+    view = memoryview(content)[start:end + 1]
+    
+    async def chunks():
+        for offset in range(0, len(view), ATTACHMENT_CHUNK_SIZE):
+            yield bytes(view[offset:offset + ATTACHMENT_CHUNK_SIZE])
+    
+    return AttachmentStream(chunks(), 206 if byte_range else 200, headers)
+
+class AttachmentCache:
+    """
+    Optional on-disk, content-addressed attachment cache. Bodies are stored
+    once under their SHA-256 in `blobs/`; `index/` maps message and
+    attachment ids to a content hash. Bodies are written while they stream
+    to the first client and are only published once complete. Once the
+    blobs exceed `max_bytes` the least recently used ones are evicted.
+    """
+
+    def __init__(self, root: str, max_bytes: int = ATTACHMENT_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._blobs = os.path.join(root, "blobs")
+        self._index = os.path.join(root, "index")
+        os.makedirs(self._blobs, exist_ok=True)
+        os.makedirs(self._index, exist_ok=True)
+        # Blob hash -> size, least recently used first; hits touch the mtime
+        # so the order survives restarts
+        entries = sorted((entry for entry in os.scandir(self._blobs) if entry.is_file()),
+                         key=lambda entry: entry.stat().st_mtime)
+        self._lru: "OrderedDict[str, int]" = OrderedDict(
+            (entry.name, entry.stat().st_size) for entry in entries)
+        self.size = sum(self._lru.values())
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _index_path(self, message_id: str, attachment_id: str) -> str:
+        key = hashlib.sha1(f"{message_id}/{attachment_id}".encode()).hexdigest()
+        return os.path.join(self._index, key)
+
+    def lookup(self, message_id: str, attachment_id: str) -> Optional[str]:
+        index_path = self._index_path(message_id, attachment_id)
+        try:
+            with open(index_path) as index:
+                key = index.read().strip()
+        except OSError:
+            self.misses += 1
+            return None
+        path = os.path.join(self._blobs, key)
+        try:
+            os.utime(path)
+        except OSError:
+            # The blob was evicted; drop the dangling index entry too
+            self.misses += 1
+            self.forget(message_id, attachment_id)
+            return None
+        if key in self._lru:
+            self._lru.move_to_end(key)
+        self.hits += 1
+        return path
+
+    def forget(self, message_id: str, attachment_id: str):
+        try:
+            os.remove(self._index_path(message_id, attachment_id))
+        except OSError:
+            pass
+
+    async def tee(self, message_id: str, attachment_id: str, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        """Pass `chunks` through while storing them; publish only complete bodies"""
+        digest = hashlib.sha256()
+        fd, temp_path = tempfile.mkstemp(dir=self.root, suffix=".part")
+        temp: Optional[IO[bytes]] = os.fdopen(fd, "wb")
+        written = 0
+        try:
+            async for chunk in chunks:
+                if temp is not None:
+                    written += len(chunk)
+                    if written > self.max_bytes:
+                        # Larger than the whole cache: keep streaming, stop storing
+                        _discard_temp(temp, temp_path)
+                        temp = None
+                    else:
+                        await asyncio.to_thread(temp.write, chunk)
+                        digest.update(chunk)
+                yield chunk
+        except BaseException:
+            if temp is not None:
+                _discard_temp(temp, temp_path)
+            raise
+        if temp is None:
+            return
+        
+        key = digest.hexdigest()
+        stored = key in self._lru
+        await asyncio.to_thread(self._publish, temp, temp_path, key, stored,
+                                self._index_path(message_id, attachment_id))
+        if stored:
+            self._lru.move_to_end(key)
+        else:
+            self._lru[key] = written
+            self.size += written
+        victims = []
+        while self.size > self.max_bytes and self._lru:
+            victim, size = self._lru.popitem(last=False)
+            self.size -= size
+            self.evictions += 1
+            victims.append(os.path.join(self._blobs, victim))
+        if victims:
+            logger.info("Evicting %d attachment blobs to stay under %s bytes", len(victims), self.max_bytes)
+            await asyncio.to_thread(_remove_files, victims)
+
+    def _publish(self, temp: IO[bytes], temp_path: str, key: str, stored: bool, index_path: str):
+        temp.close()
+        if stored:
+            os.remove(temp_path)
+        else:
+            os.replace(temp_path, os.path.join(self._blobs, key))
+        with open(index_path, "w") as index:
+            index.write(key)
+
+    def open(self, path: str, attachment: Dict[str, Any], range_header: Optional[str]) -> AttachmentStream:
+        """Raises FileNotFoundError if the blob was evicted since `lookup`"""
+        blob = open(path, "rb")
+        try:
+            size = os.fstat(blob.fileno()).st_size
+            byte_range = _parse_range(range_header, size)
+        except BaseException:
+            blob.close()
+            raise
+        headers = _attachment_headers(attachment)
+        start, end = byte_range or (0, size - 1)
+        headers["Content-Length"] = str(max(0, end - start + 1))
+        if byte_range:
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        
+        async def chunks():
+            with blob:
+                blob.seek(start)
+                remaining = end - start + 1
+                while remaining > 0:
+                    chunk = await asyncio.to_thread(blob.read, min(ATTACHMENT_CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    yield chunk
+        
+        return AttachmentStream(chunks(), 206 if byte_range else 200, headers)
+
+def _discard_temp(temp: IO[bytes], temp_path: str):
+    temp.close()
+    try:
+        os.remove(temp_path)
+    except OSError:
+        pass
+
+def _remove_files(paths: List[str]):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+# Domain list cache
+class DomainCache:
+    """
+    In-process TTL cache for the upstream domain list. Concurrent callers
+    share a single in-flight fetch. Once the TTL expires the cached list is
+    still served while a refresh runs in the background; if the refresh
+    fails the old list keeps being served with `refresh_failed` set and
+    the next refresh is only tried after `retry_interval`.
+    """
+
+    def __init__(self, fetch: Callable[[], Awaitable[List[str]]], ttl: float = DOMAIN_CACHE_TTL,
+                 retry_interval: float = DOMAIN_CACHE_RETRY_INTERVAL):
+        self._fetch = fetch
+        self.ttl = ttl
+        self.retry_interval = retry_interval
+        self._domains: Optional[List[str]] = None
+        self._fetched_at = 0.0
+        self._inflight: Optional[asyncio.Task] = None
+        self.refresh_failed = False
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def expired(self) -> bool:
+        return self._domains is not None and time.monotonic() - self._fetched_at > self.ttl
+
+    async def get(self) -> List[str]:
+        if self._domains is None:
+            self.misses += 1
+            return await self.refresh()
+        self.hits += 1
+        if self.expired:
+            self._start_refresh()
+        return self._domains
+
+    async def refresh(self) -> List[str]:
+        """Fetch the domain list, joining any fetch already in flight"""
+        return await asyncio.shield(self._start_refresh())
+
+    def _start_refresh(self) -> asyncio.Task:
+        if self._inflight is None:
+            self._inflight = asyncio.create_task(self._do_refresh())
+        return self._inflight
+
+    async def _do_refresh(self) -> List[str]:
+        try:
+            domains = await self._fetch()
+            if not domains:
+                raise HTTPException(status_code=503, detail="No domains available")
+            self._domains = domains
+            self._fetched_at = time.monotonic()
+            self.refresh_failed = False
+            return domains
+        except Exception as e:
+            logger.error("Failed to refresh domains: %s", e)
+            if self._domains is not None:
+                self.refresh_failed = True
+                # Back off: the old list counts as fresh until the next retry
+                self._fetched_at = time.monotonic() - self.ttl + self.retry_interval
+                return self._domains
+            raise
+        finally:
+            self._inflight = None
+
+# Pre-provisioned inbox pool
+class InboxPool:
+    """
+    Background-filled pool of ready-made random-name accounts with tokens
+    already issued. Whenever the pool drops below `low` it is refilled up to
+    `high` with at most `concurrency` accounts being created at once.
+    Entries older than `max_age` are discarded instead of handed out and,
+    like the entries left over at shutdown, released through `discard`.
+    """
+
+    def __init__(self, provision: Callable[[], Awaitable[EmailAddress]],
+                 low: int = INBOX_POOL_LOW_WATERMARK, high: int = INBOX_POOL_HIGH_WATERMARK,
+                 concurrency: int = INBOX_POOL_REFILL_CONCURRENCY, max_age: float = INBOX_POOL_MAX_AGE,
+                 discard: Optional[Callable[[EmailAddress], Awaitable[Any]]] = None):
+        self._provision = provision
+        self._discard = discard
+        self._discarding: Set[asyncio.Task] = set()
+        self.low = low
+        self.high = max(high, low)
+        self.concurrency = max(1, concurrency)
+        self.max_age = max_age
+        self._ready: "deque[Tuple[float, EmailAddress]]" = deque()
+        self._refill_needed = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+
+    def __len__(self) -> int:
+        return len(self._ready)
+
+    def stats(self) -> Dict[str, Any]:
+        requests = self.hits + self.misses
+        return {
+            "size": len(self._ready),
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "hit_ratio": self.hits / requests if requests else 0.0,
+        }
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def acquire(self) -> Optional[EmailAddress]:
+        """Take a ready inbox from the pool, or None when it is empty"""
+        self._prune()
+        if self._ready:
+            _, inbox = self._ready.popleft()
+            self.hits += 1
+        else:
+            inbox = None
+            self.misses += 1
+        if len(self._ready) < self.low:
+            self._refill_needed.set()
+        return inbox
+
+    def _prune(self):
+        deadline = time.monotonic() - self.max_age
+        while self._ready and self._ready[0][0] < deadline:
+            _, inbox = self._ready.popleft()
+            self.expired += 1
+            if self._discard is not None:
+                task = asyncio.create_task(self._release(inbox))
+                self._discarding.add(task)
+                task.add_done_callback(self._discarding.discard)
+
+    async def _release(self, inbox: EmailAddress):
+        try:
+            await self._discard(inbox)
+        except Exception as e:
+            logger.error("Failed to release pooled inbox %s: %s", inbox.id, e)
+
+    async def drain(self, timeout: float = 10):
+        """Release every ready inbox (on shutdown), waiting at most `timeout` seconds"""
+        if self._discard is None:
+            return
+        inboxes = [inbox for _, inbox in self._ready]
+        self._ready.clear()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        
+        async def release(inbox: EmailAddress):
+            async with semaphore:
+                await self._release(inbox)
+        
+        pending = [asyncio.create_task(release(inbox)) for inbox in inboxes] + list(self._discarding)
+        if pending:
+            await asyncio.wait(pending, timeout=timeout)
+
+    async def _run(self):
+        while True:
+            self._prune()
+            if len(self._ready) < self.low and not await self._fill():
+                # Upstream refused to provision; do not hammer it
+                await asyncio.sleep(INBOX_POOL_RETRY_DELAY)
+                continue
+            self._refill_needed.clear()
+            try:
+                # Wake up periodically to drop entries that aged out
+                await asyncio.wait_for(self._refill_needed.wait(), timeout=self.max_age / 2)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _fill(self) -> bool:
+        """Provision accounts up to the high watermark; False if any attempt failed"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        
+        async def provision_one():
+            async with semaphore:
+                inbox = await self._provision()
+            if not inbox.token:
+                raise HTTPException(status_code=502, detail="Provisioned inbox has no token")
+            self._ready.append((time.monotonic(), inbox))
+        
+        deficit = self.high - len(self._ready)
+        results = await asyncio.gather(*(provision_one() for _ in range(deficit)), return_exceptions=True)
+        failures = [result for result in results if isinstance(result, BaseException)]
+        for failure in failures[:1]:
+            logger.error("Inbox pool refill failed (%s of %s): %s", len(failures), deficit, failure)
+        return not failures
+
+# Upstream Mercure event ingestion
+class _AccountSubscription:
+    """A single upstream Mercure subscription shared by every local watcher of an account"""
+
+    def __init__(self, ingestor: "MercureIngestor", account_id: str, token: str):
+        self.ingestor = ingestor
+        self.account_id = account_id
+        self.token = token
+        self.refs = 0
+        self.live = False
+        # The hub refused the token; the next watch() starts a new subscription
+        self.rejected = False
+        self._last_event_id: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        self.live = False
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        delay = MERCURE_MIN_BACKOFF
+        while True:
+            try:
+                await self._listen()
+                delay = MERCURE_MIN_BACKOFF
+            except asyncio.CancelledError:
+                raise
+            except HTTPException as e:
+                if e.status_code in (401, 403):
+                    logger.error("Mercure subscription for %s rejected: %s", self.account_id, e.detail)
+                    self.rejected = True
+                    return
+                logger.error("Mercure subscription for %s failed: %s", self.account_id, e.detail)
+            except Exception as e:
+                logger.error("Mercure subscription for %s failed: %s", self.account_id, e)
+            finally:
+                self.live = False
+            # Exponential backoff with full jitter between reconnects
+            await asyncio.sleep(random.uniform(0, delay))
+            delay = min(delay * 2, MERCURE_MAX_BACKOFF)
+
+    async def _listen(self):
+        adapter = self.ingestor.adapter
+        session = self.ingestor.get_session()
+        headers = {'Authorization': f'Bearer {self.token}', 'Accept': 'text/event-stream'}
+        if self._last_event_id:
+            headers['Last-Event-ID'] = self._last_event_id
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=HTTP_CONNECT_TIMEOUT,
+                                        sock_read=MERCURE_IDLE_TIMEOUT)
+        params = {'topic': f'/accounts/{self.account_id}'}
+        
+        async with session.get(self.ingestor.hub_url, params=params, headers=headers,
+                               timeout=timeout) as response:
+            if response.status != 200:
+                raise HTTPException(status_code=response.status, detail=await response.text())
+            
+            # Catch up on anything delivered while we were not subscribed
+            await adapter._sync_messages(self.token)
+            self.live = True
+            self.ingestor._notify(self.token)
+            
+            event_id, data_lines = None, []
+            async for raw_line in response.content:
+                line = raw_line.decode('utf-8').rstrip('\r\n')
+                if line:
+                    field, _, value = line.partition(':')
+                    value = value[1:] if value.startswith(' ') else value
+                    if field == 'id':
+                        event_id = value
+                    elif field == 'data':
+                        data_lines.append(value)
+                    continue
+                if data_lines:
+                    await self._handle_event('\n'.join(data_lines))
+                if event_id:
+                    self._last_event_id = event_id
+                event_id, data_lines = None, []
+
+    async def _handle_event(self, data: str):
+        try:
+            payload = json.loads(data)
+        except ValueError:
+            logger.error("Ignoring malformed Mercure event for %s", self.account_id)
+            return
+        if payload.get('@type') != 'Message' or 'id' not in payload:
+            return
+        
+        adapter = self.ingestor.adapter
+        if payload['id'] in adapter.message_cache.get_inbox(self.token):
+            return
+        message = await adapter._get_full_message(self.token, payload['id'])
+        if message is not None:
+            adapter.message_cache.add_message(self.token, message)
+            # Any reused listing no longer includes this message
+            adapter.single_flight.forget(('messages', self.token))
+            self.ingestor._notify(self.token)
+
+class MercureIngestor:
+    """
+    Event-driven ingestion from the mail.tm Mercure hub. Each watched account
+    holds one upstream subscription; new-message events become targeted
+    /messages/{id} fetches that feed the message cache, so polls of a live
+    account are served locally.
+    """
+
+    def __init__(self, adapter: "MailTmAdapter", hub_url: str = MERCURE_HUB_URL):
+        self.adapter = adapter
+        self.hub_url = hub_url
+        self._subscriptions: Dict[str, _AccountSubscription] = {}
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def __len__(self) -> int:
+        return len(self._subscriptions)
+
+    def get_session(self) -> aiohttp.ClientSession:
+        # Streams stay open for as long as an account is watched: they get their own
+        # unbounded connector instead of holding connections of the API pool
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=0, ttl_dns_cache=HTTP_DNS_CACHE_TTL)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    def _notify(self, token: str):
+        self.adapter._notify(token)
 
-# CORS configuration
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+    def watch(self, account_id: str, token: str):
+        subscription = self._subscriptions.get(account_id)
+        if subscription is not None and (subscription.token != token or subscription.rejected):
+            # The account's token was renewed or refused; resubscribe with the current one
+            subscription.stop()
+            self._subscriptions[account_id] = _AccountSubscription(self, account_id, token)
+            self._subscriptions[account_id].refs = subscription.refs
+            self._subscriptions[account_id].start()
+            subscription = self._subscriptions[account_id]
+        if subscription is None:
+            subscription = self._subscriptions[account_id] = _AccountSubscription(self, account_id, token)
+            subscription.start()
+        subscription.refs += 1
 
-# Pydantic models
-class EmailAddress(BaseModel):
-    id: str
-    email: str
-    domain: str
-    password: str
-    created_at: datetime
-    token: Optional[str] = None
+    def unwatch(self, account_id: str):
+        subscription = self._subscriptions.get(account_id)
+        if subscription is None:
+            return
+        subscription.refs -= 1
+        if subscription.refs <= 0:
+            subscription.stop()
+            del self._subscriptions[account_id]
 
-class EmailMessage(BaseModel):
-    id: str
-    from_address: str
-    to_address: str
-    subject: str
-    body: str
-    html_body: Optional[str] = None
-    received_at: datetime
-    attachments: List[Dict[str, Any]] = []
+    def is_live(self, token: str) -> bool:
+        return any(sub.live and sub.token == token for sub in self._subscriptions.values())
 
-class CreateEmailRequest(BaseModel):
-    custom_name: Optional[str] = None
+    def stop_all(self):
+        for subscription in self._subscriptions.values():
+            subscription.stop()
+        self._subscriptions.clear()
 
-class EmailInboxResponse(BaseModel):
-    inbox: EmailAddress
-    messages: List[EmailMessage] = []
-    message_count: int = 0
+    async def close(self):
+        """Stop every subscription and close the stream session (called on app shutdown)"""
+        self.stop_all()
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
 
 # Mail.tm API integration
-class MailTmAdapter:
-    def __init__(self, base_url: str = "https://api.mail.tm"):
+class MailTmAdapter(MailProvider):
+    def __init__(self, base_url: str = MAILTM_BASE_URL):
+        super().__init__()
         self.base_url = base_url
-        self.sessions = {}
-        
-    async def _get_session(self):
-        session = aiohttp.ClientSession()
-        return session
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.rate_limiter = TokenBucket()
+        self.breaker = CircuitBreaker()
+        self.message_cache = MessageCache()
+        self.single_flight = SingleFlight(result_ttl=COALESCE_RESULT_TTL)
+        self.domain_cache = DomainCache(self._fetch_domains)
+        self.ingestor = MercureIngestor(self) if MERCURE_ENABLED else None
+        self.inbox_pool = InboxPool(self._provision_pooled_account, discard=self._delete_pooled_account) \
+            if INBOX_POOL_ENABLED else None
+
+    async def start(self):
+        """Open the shared keep-alive session (called on app startup)"""
+        if self._session is not None and not self._session.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_POOL_LIMIT,
+            limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+            ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+            keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=HTTP_TOTAL_TIMEOUT,
+            sock_connect=HTTP_CONNECT_TIMEOUT,
+            sock_read=HTTP_READ_TIMEOUT,
+        )
+        self._session = aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                              trace_configs=[_upstream_trace_config()])
+
+    async def close(self):
+        """Close the shared session (called on app shutdown)"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    @property
+    def domains_stale(self) -> bool:
+        return self.domain_cache.refresh_failed
+
+    def health_info(self) -> Dict[str, Any]:
+        info = {
+            "upstream": {
+                "circuit_breaker": self.breaker.stats(),
+                "rate_limiter": self.rate_limiter.stats(),
+            },
+            "coalescing": {
+                "calls": self.single_flight.calls,
+                "coalesced": self.single_flight.coalesced,
+            },
+        }
+        if self.inbox_pool is not None:
+            info["inbox_pool"] = self.inbox_pool.stats()
+        return info
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        # Lazily open the session when used outside of the app lifecycle
+        if self._session is None or self._session.closed:
+            await self.start()
+        return self._session
     
     async def _make_request(self, method: str, endpoint: str, token: str = None, **kwargs):
-        async with aiohttp.ClientSession() as session:
-            url = f"{self.base_url}{endpoint}"
-            
-            headers = kwargs.get('headers', {})
-            if token:
-                headers['Authorization'] = f'Bearer {token}'
-            kwargs['headers'] = headers
-            
+        """
+        Rate-limited upstream request. Idempotent GETs are retried with
+        jittered backoff on 429/5xx; everything fails fast while the circuit
+        breaker is open.
+        """
+        attempts = 1 + (HTTP_MAX_RETRIES if method == 'GET' else 0)
+        for attempt in range(attempts):
+            if not self.breaker.allow():
+                raise HTTPException(status_code=503, detail="Mail.tm is temporarily unavailable")
             try:
+                await self.rate_limiter.acquire()
+                result = await self._send_request(method, endpoint, token, **kwargs)
+            except HTTPException as e:
+                # The upstream answered; client errors say nothing about its health
+                self.breaker.record_status(e.status_code)
+                if (e.status_code != 429 and e.status_code < 500) or attempt == attempts - 1:
+                    raise
+                if e.status_code != 429:
+                    # 429s already wait for Retry-After in the rate limiter
+                    await asyncio.sleep(_retry_delay(attempt))
+                logger.warning("Retrying %s %s after %s (attempt %s/%s)", method, endpoint, e.status_code, attempt + 2, attempts)
+            except asyncio.CancelledError:
+                self.breaker.release()
+                raise
+            except BaseException:
+                # e.g. an unparseable 200 body: never leave a half-open probe in flight
+                self.breaker.record_failure()
+                raise
+            else:
+                self.breaker.record_success()
+                return result
+    
+    async def _send_request(self, method: str, endpoint: str, token: str = None, **kwargs):
+        session = await self._get_session()
+        url = f"{self.base_url}{endpoint}"
+        
+        headers = dict(kwargs.get('headers', {}))
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+        kwargs['headers'] = headers
+        
+        try:
+            with UpstreamTimer(method, endpoint) as timer:
                 async with session.request(method, url, **kwargs) as response:
+                    timer.status = str(response.status)
                     if response.status in [200, 201]:
                         return await response.json()
-                    elif response.status == 404:
+                    elif response.status in [204, 404]:
                         return None
+                    elif response.status == 429:
+                        retry_after = _parse_retry_after(response.headers.get('Retry-After'))
+                        self.rate_limiter.penalize(retry_after)
+                        logger.warning("Mail.tm throttled %s %s, backing off %ss", method, endpoint, retry_after)
+                        raise HTTPException(status_code=429, detail="Mail.tm rate limit exceeded",
+                                            headers={"Retry-After": str(int(retry_after + 0.999))})
                     else:
                         error_text = await response.text()
-                        logger.error(f"Mail.tm request failed: {response.status} - {error_text}")
+                        logger.error("Mail.tm request failed: %s - %s", response.status, error_text)
                         raise HTTPException(status_code=response.status, detail=error_text)
-            except aiohttp.ClientError as e:
-                logger.error(f"Mail.tm request failed: {e}")
-                raise HTTPException(status_code=500, detail=f"Request failed: {str(e)}")
+        except asyncio.TimeoutError:
+            logger.error("Mail.tm request timed out: %s %s", method, endpoint)
+            raise HTTPException(status_code=504, detail="Upstream request timed out")
+        except aiohttp.ClientError as e:
+            logger.error("Mail.tm request failed: %s", e)
+            raise HTTPException(status_code=500, detail=f"Request failed: {str(e)}")
+    
+    async def _fetch_domains(self) -> List[str]:
+        response = await self._make_request('GET', '/domains')
+        if response and 'hydra:member' in response:
+            return [domain['domain'] for domain in response['hydra:member']]
+        return []
     
     async def get_domains(self) -> List[str]:
-        try:
-            response = await self._make_request('GET', '/domains')
-            if response and 'hydra:member' in response:
-                domains = [domain['domain'] for domain in response['hydra:member']]
-                return domains if domains else ['1secmail.com']
-            return ['1secmail.com']
-        except Exception as e:
-            logger.error(f"Failed to get domains: {e}")
-            return ['1secmail.com']
+        return await self.domain_cache.get()
     
     async def create_inbox(self, name: Optional[str] = None) -> EmailAddress:
+        # Random-name inboxes are served from the pre-provisioned pool when possible
+        if not name and self.inbox_pool is not None:
+            inbox = self.inbox_pool.acquire()
+            if inbox is not None:
+                return inbox
+        
         try:
-            domains = await self.get_domains()
-            domain = domains[0]
-            
-            if not name:
-                name = f"user{int(datetime.now().timestamp())}{random.randint(100, 999)}"
-            else:
-                # Add timestamp to custom name to ensure uniqueness
-                name = f"{name}{int(datetime.now().timestamp())}{random.randint(10, 99)}"
-            
-            email_address = f"{name}@{domain}"
-            password = f"password{random.randint(10000, 99999)}"
-            
-            # Create account
-            account_data = {
-                "address": email_address,
-                "password": password
-            }
-            
-            account = await self._make_request('POST', '/accounts', json=account_data)
-            if not account:
-                raise HTTPException(status_code=500, detail="Failed to create account")
-            
-            # Login to get token
-            token_response = await self._make_request('POST', '/token', json=account_data)
-            token = None
-            if token_response and 'token' in token_response:
-                token = token_response['token']
-            
-            return EmailAddress(
-                id=account['id'],
-                email=email_address,
-                domain=domain,
-                password=password,
-                created_at=datetime.now(),
-                token=token
-            )
+            return await self._create_account(name)
         except Exception as e:
-            logger.error(f"Mail.tm inbox creation failed: {e}")
+            logger.error("Mail.tm inbox creation failed: %s", e)
             raise HTTPException(status_code=500, detail=f"Failed to create inbox: {str(e)}")
     
-    async def get_messages(self, token: str) -> List[EmailMessage]:
+    async def _create_account(self, name: Optional[str] = None) -> EmailAddress:
+        domains = await self.get_domains()
+        domain = domains[0]
+        
+        email_address = f"{_generate_address_name(name)}@{domain}"
+        password = f"password{random.randint(10000, 99999)}"
+        
+        # Create account
+        account_data = {
+            "address": email_address,
+            "password": password
+        }
+        
+        account = await self._make_request('POST', '/accounts', json=account_data)
+        if not account:
+            raise HTTPException(status_code=500, detail="Failed to create account")
+        
+        # Login to get token
+        token_response = await self._make_request('POST', '/token', json=account_data)
+        token = None
+        if token_response and 'token' in token_response:
+            token = token_response['token']
+        
+        return EmailAddress(
+            id=account['id'],
+            email=email_address,
+            domain=domain,
+            password=password,
+            created_at=datetime.now(),
+            token=token
+        )
+    
+    @staticmethod
+    def _parse_message(data: Dict[str, Any], body: Optional[str] = None) -> EmailMessage:
+        # Handle html_body properly - it can be a list or string
+        html_body = data.get('html', [])
+        if isinstance(html_body, list):
+            html_body = ' '.join(html_body) if html_body else None
+        elif not html_body:
+            html_body = None
+        
+        rendered = message_renderer.render(data['id'], data.get('text', '') if body is None else body, html_body)
+        return EmailMessage(
+            id=data['id'],
+            from_address=(data.get('from') or {}).get('address', ''),
+            to_address=(data.get('to') or [{}])[0].get('address', ''),
+            subject=data.get('subject', ''),
+            body=rendered.text,
+            html_body=rendered.html,
+            snippet=rendered.snippet,
+            received_at=_parse_timestamp(data.get('createdAt')),
+            attachments=[
+                {
+                    "id": attachment['id'],
+                    "filename": attachment.get('filename', ''),
+                    "contentType": attachment.get('contentType', 'application/octet-stream'),
+                    "size": attachment.get('size', 0),
+                    "downloadUrl": attachment.get('downloadUrl', f"/messages/{data['id']}/attachment/{attachment['id']}"),
+                }
+                for attachment in data.get('attachments') or []
+                if 'id' in attachment
+            ]
+        )
+    
+    @staticmethod
+    def _parse_summary(data: Dict[str, Any]) -> EmailMessageSummary:
+        return EmailMessageSummary(
+            id=data['id'],
+            from_address=(data.get('from') or {}).get('address', ''),
+            to_address=(data.get('to') or [{}])[0].get('address', ''),
+            subject=data.get('subject', ''),
+            snippet=_snippet(data.get('intro', '')),
+            received_at=_parse_timestamp(data.get('createdAt')),
+            has_attachments=data.get('hasAttachments', False),
+        )
+    
+    async def _fetch_full_messages(self, token: str, summaries: List[Dict[str, Any]],
+                                   concurrency: int = MESSAGE_FETCH_CONCURRENCY) -> Dict[str, EmailMessage]:
+        """Fetch full message bodies concurrently, returning the successful ones by id"""
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        
+        async def fetch(summary: Dict[str, Any]) -> Optional[EmailMessage]:
+            async with semaphore:
+                return await self._get_full_message(token, summary['id'])
+        
+        results = await asyncio.gather(*(fetch(summary) for summary in summaries), return_exceptions=True)
+        
+        messages = {}
+        for summary, result in zip(summaries, results):
+            if isinstance(result, EmailMessage):
+                messages[result.id] = result
+            elif isinstance(result, BaseException):
+                logger.error("Failed to fetch message %s: %s", summary.get('id'), result)
+        return messages
+    
+    def _summary_fallback(self, summary: Dict[str, Any]) -> Optional[EmailMessage]:
+        # Degrade a single entry to its list summary when its body is unavailable
         try:
-            response = await self._make_request('GET', '/messages', token=token)
-            if not response or 'hydra:member' not in response:
-                return []
-            
-            messages = []
-            for msg_data in response['hydra:member']:
-                # Get full message content
-                msg_id = msg_data['id']
-                full_message = await self._make_request('GET', f'/messages/{msg_id}', token=token)
-                
-                if full_message:
-                    # Handle html_body properly - it can be a list or string
-                    html_body = full_message.get('html', [])
-                    if isinstance(html_body, list):
-                        html_body = ' '.join(html_body) if html_body else None
-                    elif not html_body:
-                        html_body = None
-                    
-                    message = EmailMessage(
-                        id=full_message['id'],
-                        from_address=full_message.get('from', {}).get('address', ''),
-                        to_address=full_message.get('to', [{}])[0].get('address', ''),
-                        subject=full_message.get('subject', ''),
-                        body=full_message.get('text', ''),
-                        html_body=html_body,
-                        received_at=datetime.fromisoformat(
-                            full_message.get('createdAt', datetime.now().isoformat()).replace('Z', '+00:00')
-                        )
-                    )
-                    messages.append(message)
-            
-            return messages
+            return self._parse_message(summary, body=summary.get('intro', ''))
         except Exception as e:
-            logger.error(f"Mail.tm message retrieval failed: {e}")
+            logger.error("Failed to parse message summary %s: %s", summary.get('id'), e)
+            return None
+    
+    async def get_messages(self, token: str) -> List[EmailMessage]:
+        # Accounts with a live event subscription are served from the local store
+        if self.ingestor is not None and self.ingestor.is_live(token) and token in self.message_cache:
+            return self.message_cache.list_messages(token)
+        try:
+            return await self._sync_messages(token)
+        except HTTPException as e:
+            # Serve what we already have while upstream is throttling or down
+            if (e.status_code == 429 or e.status_code >= 500) and token in self.message_cache:
+                logger.warning("Serving cached messages after upstream error %s", e.status_code)
+                return self.message_cache.list_messages(token)
+            raise
+    
+    async def _get_full_message(self, token: str, message_id: str) -> Optional[EmailMessage]:
+        async def fetch() -> Optional[EmailMessage]:
+            full_message = await self._make_request('GET', f"/messages/{message_id}", token=token)
+            return self._parse_message(full_message) if full_message else None
+        
+        return await self.single_flight.do(('message', token, message_id), fetch)
+    
+    async def _sync_messages(self, token: str) -> List[EmailMessage]:
+        # Concurrent polls of the same inbox share one upstream fetch chain
+        return await self.single_flight.do(('messages', token), lambda: self._fetch_inbox(token))
+    
+    async def list_messages(self, token: str) -> List[EmailMessageSummary]:
+        if self.ingestor is not None and self.ingestor.is_live(token) and token in self.message_cache:
+            return [m.summary() for m in self.message_cache.list_messages(token)]
+        try:
+            summaries = await self._fetch_listing(token)
+        except HTTPException as e:
+            if (e.status_code == 429 or e.status_code >= 500) and token in self.message_cache:
+                logger.warning("Serving cached summaries after upstream error %s", e.status_code)
+                return [m.summary() for m in self.message_cache.list_messages(token)]
+            raise
+        
+        # Prefer the snippet rendered from an already fetched body over mail.tm's intro;
+        # otherwise reuse the summary parsed (and serialized) by an earlier poll
+        cached = self.message_cache.get_inbox(token)
+        parsed = self.message_cache.get_summaries(token)
+        result = []
+        listed: Dict[str, EmailMessageSummary] = {}
+        for summary in summaries:
+            try:
+                message = cached.get(summary['id'])
+                if message is not None:
+                    result.append(message.summary())
+                    continue
+                item = parsed.get(summary['id']) or self._parse_summary(summary)
+                listed[item.id] = item
+                result.append(item)
+            except Exception as e:
+                logger.error("Failed to parse message summary %s: %s", summary.get('id'), e)
+        self.message_cache.update_summaries(token, listed)
+        return result
+    
+    async def get_message(self, token: str, message_id: str) -> EmailMessage:
+        message = self.message_cache.get_inbox(token).get(message_id)
+        if message is None:
+            message = await self._get_full_message(token, message_id)
+        if message is None:
+            raise HTTPException(status_code=404, detail="Message not found")
+        return message
+    
+    async def _fetch_listing(self, token: str) -> List[Dict[str, Any]]:
+        return await self.single_flight.do(('listing', token), lambda: self._fetch_all_pages(token))
+    
+    async def _fetch_all_pages(self, token: str) -> List[Dict[str, Any]]:
+        """Read every page of /messages (up to MESSAGE_LIST_MAX_PAGES), newest first"""
+        first = await self._make_request('GET', '/messages', token=token, params={'page': 1})
+        if not first or 'hydra:member' not in first:
             return []
+        
+        pages = [first]
+        page_size = len(first['hydra:member'])
+        total = first.get('hydra:totalItems', page_size)
+        if page_size and total > page_size:
+            page_count = min(MESSAGE_LIST_MAX_PAGES, math.ceil(total / page_size))
+            pages.extend(await asyncio.gather(*(
+                self._make_request('GET', '/messages', token=token, params={'page': page})
+                for page in range(2, page_count + 1)
+            )))
+        
+        # Pages can shift while new mail arrives, so drop duplicates
+        seen, summaries = set(), []
+        for page in pages:
+            for summary in (page or {}).get('hydra:member', []):
+                if summary['id'] not in seen:
+                    seen.add(summary['id'])
+                    summaries.append(summary)
+        return summaries
+    
+    async def open_attachment(self, token: str, message_id: str, attachment: Dict[str, Any],
+                              range_header: Optional[str] = None) -> AttachmentStream:
+        """Stream an attachment straight from mail.tm without buffering it"""
+        if not self.breaker.allow():
+            raise HTTPException(status_code=503, detail="Mail.tm is temporarily unavailable")
+        # Same verdicts as _make_request, so a half-open probe is always settled
+        try:
+            await self.rate_limiter.acquire()
+            session = await self._get_session()
+            headers = {'Authorization': f'Bearer {token}'}
+            if range_header:
+                headers['Range'] = range_header
+            timeout = aiohttp.ClientTimeout(total=None, sock_connect=HTTP_CONNECT_TIMEOUT, sock_read=HTTP_READ_TIMEOUT)
+            url = f"{self.base_url}{attachment['downloadUrl']}"
+            try:
+                with UpstreamTimer('GET', attachment['downloadUrl']) as timer:
+                    response = await session.get(url, headers=headers, timeout=timeout)
+                    timer.status = str(response.status)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                raise HTTPException(status_code=502, detail=f"Attachment download failed: {e}")
+            
+            if response.status not in (200, 206):
+                try:
+                    error_text = await response.text()
+                finally:
+                    response.release()
+                raise HTTPException(status_code=response.status if response.status < 500 else 502, detail=error_text)
+        except HTTPException as e:
+            self.breaker.record_status(e.status_code)
+            raise
+        except asyncio.CancelledError:
+            self.breaker.release()
+            raise
+        except BaseException:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        
+        stream_headers = _attachment_headers(attachment)
+        for name in ('Content-Length', 'Content-Range'):
+            if name in response.headers:
+                stream_headers[name] = response.headers[name]
+        
+        async def chunks():
+            try:
+                async for chunk in response.content.iter_chunked(ATTACHMENT_CHUNK_SIZE):
+                    yield chunk
+            finally:
+                response.release()
+        
+        return AttachmentStream(_limit_size(chunks(), ATTACHMENT_MAX_SIZE), response.status, stream_headers)
+    
+    async def renew_token(self, record: InboxRecord) -> Optional[str]:
+        response = await self._make_request('POST', '/token', json={
+            "address": record.email,
+            "password": record.password,
+        })
+        if not response or 'token' not in response:
+            raise HTTPException(status_code=502, detail="Mail.tm did not issue a token")
+        return response['token']
+    
+    async def _delete_account(self, account_id: str, token: str):
+        # 404 means the account is already gone
+        await self._make_request('DELETE', f"/accounts/{account_id}", token=token)
+    
+    async def _provision_pooled_account(self) -> EmailAddress:
+        """
+        Create a pool entry and record it right away, expiring shortly after
+        it would age out of the pool: should the worker die without draining
+        its pool, the inbox reaper still deletes the account.
+        """
+        inbox = await self._create_account()
+        if self.inbox_store is not None:
+            max_age = self.inbox_pool.max_age if self.inbox_pool is not None else INBOX_POOL_MAX_AGE
+            expires_at = datetime.now(timezone.utc) + timedelta(seconds=max_age + INBOX_REAPER_INTERVAL)
+            await self.inbox_store.save(InboxRecord.from_inbox(inbox.model_copy(update={"expires_at": expires_at})))
+        return inbox
+    
+    async def _delete_pooled_account(self, inbox: EmailAddress):
+        await self._delete_account(inbox.id, inbox.token)
+        if self.inbox_store is not None:
+            await self.inbox_store.delete(inbox.id)
+    
+    async def delete_inbox(self, record: InboxRecord):
+        try:
+            await self._delete_account(record.id, record.token)
+        except HTTPException as e:
+            if e.status_code != 401:
+                raise
+            # The stored token lapsed; log in again to delete
+            try:
+                token = await self.renew_token(record)
+            except HTTPException as login_error:
+                if login_error.status_code != 401:
+                    raise
+                token = None  # the credentials no longer work: the account is gone
+            if token:
+                await self._delete_account(record.id, token)
+        for token in {record.token, record.access_token} - {None}:
+            self.message_cache.drop_inbox(token)
+            for kind in ('messages', 'listing'):
+                self.single_flight.forget((kind, token))
+    
+    async def _fetch_inbox(self, token: str) -> List[EmailMessage]:
+        summaries = await self._fetch_listing(token)
+        if token not in self.message_cache and self.inbox_store is not None:
+            # Warm up from the shared store (after a restart or on another worker)
+            stored = await self.inbox_store.load_messages(token)
+            if stored:
+                # Rendering is idempotent, so messages stored before sanitization are upgraded here
+                stored = [message_renderer.render_message(message) for message in stored]
+                self.message_cache.update_inbox(token, [summary['id'] for summary in summaries], stored)
+        cached = self.message_cache.get_inbox(token)
+        
+        # Only fetch bodies of messages we have not seen yet
+        missing = [summary for summary in summaries if summary['id'] not in cached]
+        self.message_cache.hits += len(summaries) - len(missing)
+        self.message_cache.misses += len(missing)
+        fetched = await self._fetch_full_messages(token, missing) if missing else {}
+        self.message_cache.update_inbox(
+            token, [summary['id'] for summary in summaries], list(fetched.values())
+        )
+        if fetched and self.inbox_store is not None:
+            await self.inbox_store.save_messages(token, self.message_cache.list_messages(token))
+        
+        messages = []
+        for summary in summaries:
+            message = cached.get(summary['id']) or fetched.get(summary['id'])
+            if message is None:
+                # Not cached, so the full body is retried on the next poll
+                message = self._summary_fallback(summary)
+            if message is not None:
+                messages.append(message)
+        return messages
+
+# Local in-process SMTP provider
+class _LocalInbox:
+    def __init__(self, address: EmailAddress):
+        self.address = address
+        self.messages: "deque[EmailMessage]" = deque(maxlen=LOCAL_MAX_MESSAGES_PER_INBOX)
+        self.attachments: Dict[str, List[bytes]] = {}
+
+    def add(self, message: EmailMessage, contents: List[bytes]):
+        if len(self.messages) == self.messages.maxlen:
+            self.attachments.pop(self.messages[-1].id, None)
+        self.messages.appendleft(message)
+        if contents:
+            self.attachments[message.id] = contents
+
+class LocalMailProvider(MailProvider):
+    """
+    Self-hosted provider: an asyncio SMTP receiver (aiosmtpd) accepts mail
+    for inboxes created here and keeps it in process memory. Inbox creation
+    is a local insert and message retrieval a local read. State is per
+    process, so run a single worker with this provider.
+    """
+
+    def __init__(self, host: str = LOCAL_SMTP_HOST, port: int = LOCAL_SMTP_PORT,
+                 domains: Optional[List[str]] = None):
+        super().__init__()
+        self.host = host
+        self.port = port
+        self.domains = domains or LOCAL_MAIL_DOMAINS
+        self._inboxes: Dict[str, _LocalInbox] = {}
+        self._by_token: Dict[str, _LocalInbox] = {}
+        self._by_address: Dict[str, _LocalInbox] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        if self._server is not None:
+            return
+        if SMTPServer is None:
+            raise RuntimeError("MAIL_PROVIDER=local requires the 'aiosmtpd' package")
+        loop = asyncio.get_running_loop()
+        self._server = await loop.create_server(
+            lambda: SMTPServer(self, data_size_limit=LOCAL_MAX_MESSAGE_SIZE, enable_SMTPUTF8=True),
+            host=self.host, port=self.port,
+        )
+        logger.info("Local SMTP receiver listening on %s:%s", self.host, self.port)
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def create_inbox(self, name: Optional[str] = None) -> EmailAddress:
+        domain = self.domains[0]
+        address = EmailAddress(
+            id=uuid.uuid4().hex,
+            email=f"{_generate_address_name(name)}@{domain}".lower(),
+            domain=domain,
+            password=secrets.token_urlsafe(12),
+            created_at=datetime.now(timezone.utc),
+            token=secrets.token_urlsafe(32),
+        )
+        inbox = _LocalInbox(address)
+        self._inboxes[address.id] = inbox
+        self._by_token[address.token] = inbox
+        self._by_address[address.email] = inbox
+        return address
+
+    async def delete_inbox(self, record: InboxRecord):
+        inbox = self._inboxes.pop(record.id, None)
+        if inbox is not None:
+            self._by_token.pop(inbox.address.token, None)
+            self._by_address.pop(inbox.address.email, None)
+
+    async def get_messages(self, token: str) -> List[EmailMessage]:
+        inbox = self._by_token.get(token)
+        if inbox is None:
+            raise HTTPException(status_code=401, detail="Invalid token")
+        return list(inbox.messages)
+
+    async def get_domains(self) -> List[str]:
+        return list(self.domains)
+
+    # aiosmtpd handler hooks
+    async def handle_RCPT(self, server, session, envelope, address: str, rcpt_options):
+        if address.lower() not in self._by_address:
+            return "550 5.1.1 Mailbox unavailable"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        parsed = message_from_bytes(envelope.content, policy=email_policy.default)
+        for recipient in envelope.rcpt_tos:
+            inbox = self._by_address.get(recipient.lower())
+            if inbox is None:
+                continue
+            inbox.add(*self._parse_message(parsed, envelope.mail_from, recipient))
+            self._notify(inbox.address.token)
+        return "250 Message accepted for delivery"
+
+    async def open_attachment(self, token: str, message_id: str, attachment: Dict[str, Any],
+                              range_header: Optional[str] = None) -> AttachmentStream:
+        inbox = self._by_token.get(token)
+        contents = inbox.attachments.get(message_id, []) if inbox is not None else []
+        index = int(attachment['id'])
+        if index >= len(contents):
+            raise HTTPException(status_code=404, detail="Attachment not found")
+        return _bytes_stream(contents[index], attachment, range_header)
+
+    @staticmethod
+    def _parse_message(parsed, mail_from: str, recipient: str) -> Tuple[EmailMessage, List[bytes]]:
+        text_part = parsed.get_body(preferencelist=('plain',))
+        html_part = parsed.get_body(preferencelist=('html',))
+        contents = [part.get_payload(decode=True) or b"" for part in parsed.iter_attachments()]
+        attachments = [
+            {
+                "id": str(index),
+                "filename": part.get_filename() or f"attachment-{index}",
+                "contentType": part.get_content_type(),
+                "size": len(contents[index]),
+            }
+            for index, part in enumerate(parsed.iter_attachments())
+        ]
+        sender = parsed.get('From')
+        message = message_renderer.render_message(EmailMessage(
+            id=uuid.uuid4().hex,
+            from_address=sender.addresses[0].addr_spec if sender and sender.addresses else mail_from,
+            to_address=recipient,
+            subject=str(parsed.get('Subject', '')),
+            body=text_part.get_content() if text_part is not None else '',
+            html_body=html_part.get_content() if html_part is not None else None,
+            received_at=datetime.now(timezone.utc),
+            attachments=attachments,
+        ))
+        return message, contents
 
 # Global service instance
-mail_service = MailTmAdapter()
+mail_service: MailProvider = LocalMailProvider() if MAIL_PROVIDER == "local" else MailTmAdapter()
+
+# Server push: one watcher per inbox, shared by all subscribers
+StreamEvent = Tuple[str, Any]
+
+class InboxWatcher:
+    """
+    Polls a single inbox on behalf of every subscriber and fans out only
+    new messages. A late subscriber first receives a snapshot of the
+    messages the watcher already knows about.
+    """
+
+    def __init__(self, token: str, fetch: Callable[[str], Awaitable[List[EmailMessage]]],
+                 interval: float = STREAM_POLL_INTERVAL):
+        self.token = token
+        self.interval = interval
+        self._fetch = fetch
+        self.messages: List[EmailMessage] = []
+        self._seen_ids: Set[str] = set()
+        self._synced = False
+        self.subscribers: Set[asyncio.Queue] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+
+    def subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue()
+        if self._synced:
+            queue.put_nowait(("snapshot", list(self.messages)))
+        self.subscribers.add(queue)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+
+    def wake(self):
+        """Re-read the inbox now instead of waiting for the next poll"""
+        self._wakeup.set()
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def close(self):
+        """Stop polling and end every subscription"""
+        self.stop()
+        self._broadcast(("close", None))
+
+    def _broadcast(self, event: StreamEvent):
+        for queue in self.subscribers:
+            queue.put_nowait(event)
+
+    def _publish(self, messages: List[EmailMessage]):
+        """Record a fresh listing and fan out the messages not seen before"""
+        new_messages = [message for message in messages if message.id not in self._seen_ids]
+        self.messages = messages
+        self._seen_ids = {message.id for message in messages}
+        if not self._synced:
+            self._synced = True
+            self._broadcast(("snapshot", list(messages)))
+        elif new_messages:
+            self._broadcast(("messages", new_messages))
+
+    async def _run(self):
+        delay = self.interval
+        while True:
+            try:
+                self._publish(await self._fetch(self.token))
+                delay = self.interval
+            except asyncio.CancelledError:
+                raise
+            except HTTPException as e:
+                if e.status_code in (401, 403):
+                    # The token is no longer valid; end every subscription
+                    self._broadcast(("error", {"status": e.status_code, "detail": e.detail}))
+                    self._broadcast(("close", None))
+                    return
+                logger.error("Inbox watcher poll failed: %s", e.detail)
+                delay = min(delay * 2, STREAM_MAX_BACKOFF)
+            except Exception as e:
+                logger.error("Inbox watcher poll failed: %s", e)
+                delay = min(delay * 2, STREAM_MAX_BACKOFF)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+class WatcherRegistry:
+    """Keeps exactly one InboxWatcher per token while it has subscribers"""
+
+    def __init__(self, fetch: Callable[[str], Awaitable[List[EmailMessage]]]):
+        self._fetch = fetch
+        self._watchers: Dict[str, InboxWatcher] = {}
+
+    def __len__(self) -> int:
+        return len(self._watchers)
+
+    def subscribe(self, token: str) -> asyncio.Queue:
+        watcher = self._watchers.get(token)
+        if watcher is None:
+            watcher = self._watchers[token] = InboxWatcher(token, self._fetch)
+        return watcher.subscribe()
+
+    def unsubscribe(self, token: str, queue: asyncio.Queue):
+        watcher = self._watchers.get(token)
+        if watcher is None:
+            return
+        watcher.unsubscribe(queue)
+        if not watcher.subscribers:
+            watcher.stop()
+            del self._watchers[token]
+
+    def wake(self, token: str):
+        watcher = self._watchers.get(token)
+        if watcher is not None:
+            watcher.wake()
+
+    def close(self, token: str):
+        """End every subscription of a token, e.g. once its inbox is deleted"""
+        watcher = self._watchers.pop(token, None)
+        if watcher is not None:
+            watcher.close()
+
+    def stop_all(self):
+        for watcher in self._watchers.values():
+            watcher.stop()
+        self._watchers.clear()
+
+def _event_payload(data: Any) -> str:
+    """JSON text of a stream event's data, reusing the messages' cached JSON"""
+    if isinstance(data, list):
+        return _json_list(data).decode("utf-8")
+    return _json_dumps(data).decode("utf-8")
+
+# Verification waits
+_TAG_RE = re.compile(r"<[^>]+>")
+_URL_RE = re.compile(r"""https?://[^\s"'<>]+""", re.IGNORECASE)
+_HREF_RE = re.compile(r"""href\s*=\s*["'](https?://[^"']+)["']""", re.IGNORECASE)
+_CODE_NEAR_KEYWORD_RE = re.compile(
+    r"(?:code|otp|pin|passcode|token|код|пароль)\D{0,30}?\b([A-Z0-9]{4,8})\b", re.IGNORECASE)
+_DIGIT_CODE_RE = re.compile(r"(?<![\d.:/-])\d{4,8}(?![\d.:/-])")
+_VERIFY_LINK_HINTS = ("verif", "confirm", "activat", "token", "code", "magic", "login", "signin", "reset")
+
+def _message_text(message: EmailMessage) -> str:
+    """Plain-text view of a message, falling back to the tag-stripped HTML body"""
+    if message.body.strip():
+        return message.body
+    return html.unescape(_TAG_RE.sub(" ", message.html_body or ""))
+
+class MessageMatcher:
+    """
+    Filters messages for a wait request and pulls verification codes and
+    links out of the matching one. Patterns are case-insensitive.
+    Patterns and message bodies both come from clients, so patterns are
+    length-limited, only the start of each text is searched and, with the
+    `regex` package installed, every search is cut off after a time limit.
+    """
+
+    def __init__(self, sender: Optional[str] = None, subject_regex: Optional[str] = None,
+                 body_regex: Optional[str] = None):
+        self.sender = sender.lower() if sender else None
+        self.subject_re = self._compile(subject_regex, re.IGNORECASE)
+        self.body_re = self._compile(body_regex, re.IGNORECASE | re.DOTALL)
+
+    @staticmethod
+    def _compile(pattern: Optional[str], flags: int):
+        if not pattern:
+            return None
+        if len(pattern) > WAIT_REGEX_MAX_LENGTH:
+            raise HTTPException(status_code=422,
+                                detail=f"Regular expression longer than {WAIT_REGEX_MAX_LENGTH} characters")
+        engine = regex or re
+        try:
+            return engine.compile(pattern, flags)
+        except engine.error as e:
+            raise HTTPException(status_code=422, detail=f"Invalid regular expression: {e}")
+
+    @staticmethod
+    def _search(pattern, text: str):
+        text = text[:WAIT_REGEX_MAX_TEXT]
+        if regex is None:
+            return pattern.search(text)
+        try:
+            return pattern.search(text, timeout=WAIT_REGEX_TIMEOUT)
+        except TimeoutError:
+            raise HTTPException(status_code=422, detail="Regular expression took too long to match")
+
+    def matches(self, message: EmailMessage) -> bool:
+        if self.sender and self.sender not in message.from_address.lower():
+            return False
+        if self.subject_re and not self._search(self.subject_re, message.subject):
+            return False
+        if self.body_re and not self._body_match(message):
+            return False
+        return True
+
+    def _body_match(self, message: EmailMessage):
+        return (self._search(self.body_re, _message_text(message))
+                or self._search(self.body_re, message.html_body or ""))
+
+    def extract_code(self, message: EmailMessage) -> Optional[str]:
+        # A capturing group in body_regex names the code explicitly
+        if self.body_re is not None and self.body_re.groups:
+            match = self._body_match(message)
+            if match and match.group(1):
+                return match.group(1)
+        for text in (message.subject, _message_text(message)):
+            match = _CODE_NEAR_KEYWORD_RE.search(text)
+            if match and any(char.isdigit() for char in match.group(1)):
+                return match.group(1)
+        for text in (message.subject, _message_text(message)):
+            match = _DIGIT_CODE_RE.search(text)
+            if match:
+                return match.group(0)
+        return None
+
+    @staticmethod
+    def extract_link(message: EmailMessage) -> Optional[str]:
+        links = _HREF_RE.findall(message.html_body or "") + _URL_RE.findall(message.body)
+        links = [html.unescape(link).rstrip(".,;)") for link in links]
+        links = [link for link in links if "unsubscribe" not in link.lower()]
+        for link in links:
+            if any(hint in link.lower() for hint in _VERIFY_LINK_HINTS):
+                return link
+        return links[0] if links else None
+
+watchers = WatcherRegistry(lambda token: mail_service.get_messages(token))
+mail_service.add_listener(watchers.wake)
+
+inbox_store: InboxStore = SQLiteInboxStore()
+mail_service.inbox_store = inbox_store
+token_refresher = TokenRefresher(inbox_store, mail_service)
+
+async def _register_inbox(inbox: EmailAddress) -> EmailAddress:
+    """Record a newly handed out inbox together with its expiry (replacing a pool entry's)"""
+    inbox.expires_at = datetime.now(timezone.utc) + timedelta(seconds=INBOX_TTL) if INBOX_TTL > 0 else None
+    await inbox_store.save(InboxRecord.from_inbox(inbox))
+    return inbox
+
+async def _release_inbox(record: InboxRecord):
+    """Delete an inbox upstream, end its streams and forget it"""
+    await mail_service.delete_inbox(record)
+    for token in {record.token, record.access_token} - {None}:
+        watchers.close(token)
+    await inbox_store.delete(record.id)
+
+inbox_reaper = InboxReaper(inbox_store, _release_inbox)
+attachment_cache: Optional[AttachmentCache] = AttachmentCache(ATTACHMENT_CACHE_DIR) if ATTACHMENT_CACHE_DIR else None
+
+class ServiceMetricsCollector:
+    """
+    Exports the counters the caches, the inbox pool, request coalescing and
+    the circuit breaker already keep, read at scrape time
+    """
+
+    def collect(self):
+        hits = CounterMetricFamily("tempmail_cache_hits", "Cache hits", labels=["cache"])
+        misses = CounterMetricFamily("tempmail_cache_misses", "Cache misses", labels=["cache"])
+        ratios = GaugeMetricFamily("tempmail_cache_hit_ratio", "Cache hit ratio since start", labels=["cache"])
+        caches = {
+            "messages": getattr(mail_service, "message_cache", None),
+            "domains": getattr(mail_service, "domain_cache", None),
+            "attachments": attachment_cache,
+            "rendered_bodies": message_renderer,
+            "inbox_pool": mail_service.inbox_pool,
+        }
+        for name, cache in caches.items():
+            if cache is None:
+                continue
+            total = cache.hits + cache.misses
+            hits.add_metric([name], cache.hits)
+            misses.add_metric([name], cache.misses)
+            ratios.add_metric([name], cache.hits / total if total else 0.0)
+        yield hits
+        yield misses
+        yield ratios
+        
+        if mail_service.inbox_pool is not None:
+            yield GaugeMetricFamily("tempmail_inbox_pool_size", "Ready inboxes in the pool",
+                                    value=len(mail_service.inbox_pool))
+        single_flight = getattr(mail_service, "single_flight", None)
+        if single_flight is not None:
+            yield CounterMetricFamily("tempmail_coalescing_calls", "Calls through request coalescing",
+                                      value=single_flight.calls)
+            yield CounterMetricFamily("tempmail_coalescing_joined", "Calls that joined an in-flight request",
+                                      value=single_flight.coalesced)
+        breaker = getattr(mail_service, "breaker", None)
+        if breaker is not None:
+            state = GaugeMetricFamily("tempmail_circuit_breaker_state", "Upstream circuit breaker state",
+                                      labels=["state"])
+            for name in (breaker.CLOSED, breaker.OPEN, breaker.HALF_OPEN):
+                state.add_metric([name], 1.0 if breaker.state == name else 0.0)
+            yield state
+        yield GaugeMetricFamily("tempmail_stream_watchers", "Inboxes watched for streams and waits",
+                                value=len(watchers))
+        refreshes = CounterMetricFamily("tempmail_token_refreshes", "Background token renewals",
+                                        labels=["result"])
+        refreshes.add_metric(["ok"], token_refresher.refreshed)
+        refreshes.add_metric(["failed"], token_refresher.failed)
+        yield refreshes
+        expired = CounterMetricFamily("tempmail_inboxes_expired", "Expired inboxes deleted by the reaper",
+                                      labels=["result"])
+        expired.add_metric(["ok"], inbox_reaper.deleted)
+        expired.add_metric(["failed"], inbox_reaper.failed)
+        yield expired
+
+if METRICS_ENABLED:
+    REGISTRY.register(ServiceMetricsCollector())
+
+token_renewals = SingleFlight()
+
+def _token_matches(token: str, known: Optional[str]) -> bool:
+    # compare_digest only accepts ASCII str, so compare the encoded bytes
+    return bool(known) and secrets.compare_digest(token.encode(), known.encode())
+
+async def _resolve_token(inbox_id: str, token: str) -> str:
+    """
+    Map the client's token to the current upstream token of a registered
+    inbox, marking it as in use and renewing a lapsed token on the spot;
+    unknown inboxes and other tokens are passed through unchanged
+    """
+    if not token.isascii():
+        # Neither ours nor mail.tm's (JWT) tokens can contain these
+        raise HTTPException(status_code=401, detail="Invalid token")
+    record = await inbox_store.get(inbox_id)
+    if record is None or not record.token or not _token_matches(token, record.access_token):
+        return token
+    await inbox_store.touch(record.id)
+    deadline = datetime.now(timezone.utc) + timedelta(seconds=TOKEN_LAZY_RENEW_MARGIN)
+    if record.token_expires_at is None or record.token_expires_at > deadline:
+        return record.token
+    
+    async def renew() -> str:
+        renewed = await mail_service.renew_token(record)
+        if not renewed:
+            return record.token
+        await inbox_store.update_token(record.id, renewed, _token_expiry(renewed))
+        return renewed
+    
+    try:
+        return await token_renewals.do(record.id, renew)
+    except HTTPException as e:
+        logger.error("Failed to renew token for inbox %s: %s", record.id, e.detail)
+        return record.token
+
+def _unwatch_inbox(inbox_id: str, token: str, queue: asyncio.Queue):
+    watchers.unsubscribe(token, queue)
+    if mail_service.ingestor is not None:
+        mail_service.ingestor.unwatch(inbox_id)
+
+async def _open_inbox_stream(inbox_id: str, token: str, timeout: float = STREAM_KEEPALIVE_INTERVAL
+                             ) -> Tuple[str, asyncio.Queue, Optional[StreamEvent]]:
+    """
+    Subscribe to an inbox and wait for its first event, so that invalid,
+    expired or deleted tokens are refused with their status instead of
+    a stream the client would reconnect to forever. A slow upstream
+    does not hold the response back longer than `timeout` (the first
+    event is then None).
+    """
+    token = await _resolve_token(inbox_id, token)
+    queue = watchers.subscribe(token)
+    try:
+        first = await asyncio.wait_for(queue.get(), timeout=timeout)
+    except asyncio.TimeoutError:
+        first = None
+    except BaseException:
+        watchers.unsubscribe(token, queue)
+        raise
+    if first is not None and first[0] in ("error", "close"):
+        watchers.unsubscribe(token, queue)
+        if first[0] == "close":
+            raise HTTPException(status_code=404, detail="Inbox not found")
+        raise HTTPException(status_code=first[1]["status"], detail=first[1]["detail"])
+    # Only validated inboxes get an upstream subscription
+    if mail_service.ingestor is not None:
+        mail_service.ingestor.watch(inbox_id, token)
+    return token, queue, first
+
+@app.on_event("startup")
+async def startup():
+    await inbox_store.init()
+    await mail_service.start()
+    token_refresher.start()
+    # Pool entries are recorded with an expiry even when handed out inboxes are kept
+    if INBOX_TTL > 0 or mail_service.inbox_pool is not None:
+        inbox_reaper.start()
+    if mail_service.inbox_pool is not None:
+        mail_service.inbox_pool.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    watchers.stop_all()
+    token_refresher.stop()
+    inbox_reaper.stop()
+    if mail_service.inbox_pool is not None:
+        mail_service.inbox_pool.stop()
+        await mail_service.inbox_pool.drain()
+    if mail_service.ingestor is not None:
+        await mail_service.ingestor.close()
+    await mail_service.close()
+    await inbox_store.close()
 
 # API Routes
 @app.post("/api/inbox/create", response_model=EmailInboxResponse)
@@ -191,50 +3201,352 @@ async def create_inbox(request: CreateEmailRequest):
     Создать новый временный email адрес
     """
     try:
-        logger.info(f"Creating inbox with custom name: {request.custom_name}")
-        inbox = await mail_service.create_inbox(name=request.custom_name)
+        logger.info("Creating inbox with custom name: %s", request.custom_name)
+        inbox = await _register_inbox(await mail_service.create_inbox(name=request.custom_name))
         
-        logger.info(f"Successfully created inbox: {inbox.email}")
+        logger.info("Successfully created inbox: %s", inbox.email)
         return EmailInboxResponse(inbox=inbox, messages=[], message_count=0)
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Unexpected error creating inbox: {e}")
+        logger.error("Unexpected error creating inbox: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error")
 
-@app.get("/api/inbox/{inbox_id}/messages", response_model=List[EmailMessage])
-async def get_inbox_messages(inbox_id: str, token: str):
+@app.delete("/api/inbox/{inbox_id}", status_code=204)
+async def delete_inbox(inbox_id: str, token: str):
+    """
+    Удалить временный email адрес досрочно
+    """
+    record = await inbox_store.get(inbox_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Inbox not found")
+    if not any(_token_matches(token, known) for known in (record.access_token, record.token)):
+        raise HTTPException(status_code=403, detail="Invalid token")
+    await _release_inbox(record)
+    logger.info("Deleted inbox %s", record.email)
+    return Response(status_code=204)
+
+def _batch_error(index: int, error: Exception) -> BatchItemError:
+    if isinstance(error, HTTPException):
+        return BatchItemError(index=index, status_code=error.status_code, detail=str(error.detail))
+    logger.error("Unexpected error in batch item %s: %s", index, error)
+    return BatchItemError(index=index, status_code=500, detail="Internal server error")
+
+@app.post("/api/inbox/batch-create", response_model=BatchCreateResponse)
+async def batch_create_inboxes(request: BatchCreateRequest):
+    """
+    Создать несколько временных email адресов за один запрос
+    """
+    semaphore = asyncio.Semaphore(BATCH_CREATE_CONCURRENCY)
+    
+    async def create_one(index: int) -> EmailAddress:
+        # The index keeps prefixed names created within the same second apart
+        name = f"{request.name_prefix}{index}" if request.name_prefix else None
+        async with semaphore:
+            inbox = await mail_service.create_inbox(name=name)
+        return await _register_inbox(inbox)
+    
+    results = await asyncio.gather(*(create_one(index) for index in range(request.count)), return_exceptions=True)
+    response = BatchCreateResponse()
+    for index, result in enumerate(results):
+        if isinstance(result, Exception):
+            response.errors.append(_batch_error(index, result))
+        else:
+            response.inboxes.append(result)
+    logger.info("Batch created %s of %s inboxes", len(response.inboxes), request.count)
+    return response
+
+_MESSAGE_ID_RE = re.compile(r"[\w-]{1,128}")
+
+def _messages_since(messages: List[Any], since: Optional[str]) -> List[Any]:
+    """
+    Messages newer than the `since` cursor (a message id or a timestamp), newest first.
+    An id that is no longer listed (deleted, or past MESSAGE_LIST_MAX_PAGES) is 410:
+    the client has to start over with a timestamp or without a cursor
+    """
+    if not since:
+        return messages
+    ids = [message.id for message in messages]
+    if since in ids:
+        return messages[:ids.index(since)]
+    try:
+        cursor = _as_utc(_parse_timestamp(since))
+    except ValueError:
+        if _MESSAGE_ID_RE.fullmatch(since):
+            raise HTTPException(status_code=410, detail="since refers to a message that is no longer listed")
+        raise HTTPException(status_code=422, detail="since must be a message id or an ISO timestamp")
+    return [message for message in messages if _as_utc(message.received_at) > cursor]
+
+@app.get("/api/inbox/{inbox_id}/messages", response_model=List[Union[EmailMessage, EmailMessageSummary]])
+async def get_inbox_messages(
+    inbox_id: str,
+    token: str,
+    page: int = Query(1, ge=1),
+    limit: Optional[int] = Query(None, ge=1, le=MESSAGE_PAGE_MAX_LIMIT),
+    since: Optional[str] = None,
+    fields: str = Query("full", pattern="^(full|summary)$"),
+    if_none_match: Optional[str] = Header(None),
+):
     """
-    Получить все сообщения из временного email адреса
+    Получить сообщения из временного email адреса.
+    page/limit - постраничный вывод, since - только сообщения новее указанного
+    (id сообщения или время), fields=summary - только заголовки без тела письма.
+    Ответ содержит ETag; при совпадении If-None-Match возвращается 304.
     """
     try:
-        logger.info(f"Retrieving messages for inbox {inbox_id}")
-        messages = await mail_service.get_messages(token)
+        logger.info("Retrieving messages for inbox %s", inbox_id)
+        token = await _resolve_token(inbox_id, token)
+        if fields == "summary":
+            messages = await mail_service.list_messages(token)
+        else:
+            messages = await mail_service.get_messages(token)
         
-        logger.info(f"Retrieved {len(messages)} messages")
-        return messages
+        messages = _messages_since(messages, since)
+        total = len(messages)
+        if limit is not None:
+            messages = messages[(page - 1) * limit:page * limit]
+        
+        logger.info("Retrieved %s of %s messages", len(messages), total)
+        # The tag covers each message's cached digest (not just its id: a summary's
+        # snippet changes once the body is cached) so unchanged polls skip the body
+        headers = {
+            "X-Total-Count": str(total),
+            "ETag": _etag([str(total).encode()] + [message.digest() for message in messages]),
+            "Cache-Control": "no-cache",
+        }
+        if _etag_matches(if_none_match, headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+        # Messages are built by the provider and trusted: skip response_model re-validation
+        # and reuse each message's cached JSON
+        return FastJSONResponse(content=_json_list(messages), headers=headers)
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Unexpected error retrieving messages: {e}")
+        logger.error("Unexpected error retrieving messages: %s", e)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@app.post("/api/inbox/batch-messages", response_model=BatchMessagesResponse)
+async def batch_get_messages(request: BatchMessagesRequest):
+    """
+    Получить новые сообщения сразу для нескольких email адресов
+    """
+    semaphore = asyncio.Semaphore(BATCH_MESSAGES_CONCURRENCY)
+    
+    async def fetch(index: int, item: BatchMessagesItem) -> BatchMessagesResult:
+        try:
+            async with semaphore:
+                token = await _resolve_token(item.inbox_id, item.token)
+                if request.fields == "summary":
+                    messages = await mail_service.list_messages(token)
+                else:
+                    messages = await mail_service.get_messages(token)
+            messages = _messages_since(messages, item.since)
+            return BatchMessagesResult(inbox_id=item.inbox_id, messages=messages, message_count=len(messages))
+        except Exception as e:
+            return BatchMessagesResult(inbox_id=item.inbox_id, error=_batch_error(index, e))
+    
+    results = await asyncio.gather(*(fetch(index, item) for index, item in enumerate(request.items)))
+    return BatchMessagesResponse(results=results)
+
+@app.get("/api/inbox/{inbox_id}/messages/{message_id}", response_model=EmailMessage)
+async def get_inbox_message(inbox_id: str, message_id: str, token: str):
+    """
+    Получить одно сообщение целиком (тело и HTML)
+    """
+    try:
+        token = await _resolve_token(inbox_id, token)
+        message = await mail_service.get_message(token, message_id)
+        return FastJSONResponse(content=message.json_bytes())
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Unexpected error retrieving message %s: %s", message_id, e)
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@app.get("/api/inbox/{inbox_id}/messages/{message_id}/attachments/{attachment_id}")
+async def download_attachment(inbox_id: str, message_id: str, attachment_id: str, token: str,
+                              request: Request):
+    """
+    Скачать вложение (потоково, с поддержкой Range)
+    """
+    token = await _resolve_token(inbox_id, token)
+    message = await mail_service.get_message(token, message_id)
+    attachment = next((item for item in message.attachments if str(item.get('id')) == attachment_id), None)
+    if attachment is None:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    if attachment.get('size', 0) > ATTACHMENT_MAX_SIZE:
+        raise HTTPException(status_code=413, detail="Attachment too large")
+    
+    range_header = request.headers.get("range")
+    media_type = attachment.get('contentType') or "application/octet-stream"
+    if attachment_cache is not None:
+        cached_path = attachment_cache.lookup(message_id, attachment_id)
+        if cached_path is not None:
+            try:
+                stream = attachment_cache.open(cached_path, attachment, range_header)
+            except FileNotFoundError:
+                # Evicted right after the lookup; fetch it from upstream again
+                pass
+            else:
+                return StreamingResponse(stream.chunks, status_code=stream.status_code,
+                                         headers=stream.headers, media_type=media_type)
+    
+    stream = await mail_service.open_attachment(token, message_id, attachment, range_header)
+    chunks = stream.chunks
+    if attachment_cache is not None and stream.status_code == 200:
+        chunks = attachment_cache.tee(message_id, attachment_id, chunks)
+    return StreamingResponse(chunks, status_code=stream.status_code, headers=stream.headers, media_type=media_type)
+
+@app.get("/api/inbox/{inbox_id}/wait", response_model=WaitResponse)
+async def wait_for_message(
+    inbox_id: str,
+    token: str,
+    timeout: float = Query(WAIT_DEFAULT_TIMEOUT, gt=0),
+    sender: Optional[str] = Query(None, alias="from"),
+    subject_regex: Optional[str] = None,
+    body_regex: Optional[str] = None,
+    since: Optional[str] = None,
+    extract: bool = True,
+):
+    """
+    Дождаться сообщения, подходящего под фильтры (long polling).
+    Уже полученные сообщения тоже учитываются; since - только сообщения новее указанного.
+    extract - вернуть найденный код подтверждения и ссылку;
+    timeout больше WAIT_MAX_TIMEOUT сокращается до него
+    """
+    matcher = MessageMatcher(sender, subject_regex, body_regex)
+    timeout = min(timeout, WAIT_MAX_TIMEOUT)
+    deadline = time.monotonic() + timeout
+    token, queue, pending = await _open_inbox_stream(inbox_id, token, timeout)
+    try:
+        while True:
+            if pending is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return WaitResponse(matched=False)
+                try:
+                    pending = await asyncio.wait_for(queue.get(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    return WaitResponse(matched=False)
+            (event, data), pending = pending, None
+            if event == "error":
+                raise HTTPException(status_code=data["status"], detail=data["detail"])
+            if event == "close":
+                return WaitResponse(matched=False)
+            # Anything pushed after the snapshot is newer than the cursor already
+            messages = _messages_since(data, since) if event == "snapshot" else data
+            for message in messages:
+                if matcher.matches(message):
+                    if not extract:
+                        return WaitResponse(matched=True, message=message)
+                    return WaitResponse(matched=True, message=message,
+                                        code=matcher.extract_code(message),
+                                        link=matcher.extract_link(message))
+    finally:
+        _unwatch_inbox(inbox_id, token, queue)
+
+@app.get("/api/inbox/{inbox_id}/stream")
+async def stream_inbox_messages(inbox_id: str, token: str):
+    """
+    Поток новых сообщений (Server-Sent Events).
+    Недействительный токен или удаленный адрес - ошибка 401/403/404 до начала потока
+    """
+    token, queue, first = await _open_inbox_stream(inbox_id, token)
+    
+    async def event_stream():
+        try:
+            if first is not None:
+                yield f"event: {first[0]}\ndata: {_event_payload(first[1])}\n\n"
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(queue.get(), timeout=STREAM_KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if event == "close":
+                    return
+                yield f"event: {event}\ndata: {_event_payload(data)}\n\n"
+        finally:
+            _unwatch_inbox(inbox_id, token, queue)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.websocket("/api/inbox/{inbox_id}/stream")
+async def websocket_inbox_messages(websocket: WebSocket, inbox_id: str, token: str):
+    """
+    Поток новых сообщений (WebSocket)
+    """
+    await websocket.accept()
+    try:
+        token, queue, first = await _open_inbox_stream(inbox_id, token)
+    except HTTPException as e:
+        # Refused after the handshake: the close code carries the HTTP status (4401, 4403, 4404...)
+        await websocket.close(code=4000 + e.status_code, reason=str(e.detail).encode()[:120].decode(errors="ignore"))
+        return
+    
+    async def forward():
+        pending = first
+        while True:
+            event, data = pending if pending is not None else await queue.get()
+            pending = None
+            if event == "close":
+                await websocket.close()
+                return
+            await websocket.send_text(f'{{"type":{json.dumps(event)},"data":{_event_payload(data)}}}')
+    
+    forwarder = asyncio.create_task(forward())
+    try:
+        # Drain client frames until it disconnects or the forwarder finishes
+        while not forwarder.done():
+            receiver = asyncio.create_task(websocket.receive())
+            done, _ = await asyncio.wait({receiver, forwarder}, return_when=asyncio.FIRST_COMPLETED)
+            if receiver not in done:
+                receiver.cancel()
+                break
+            if receiver.result()["type"] == "websocket.disconnect":
+                break
+    finally:
+        forwarder.cancel()
+        _unwatch_inbox(inbox_id, token, queue)
+
 @app.get("/api/domains", response_model=List[str])
-async def get_available_domains():
-    """Получить список доступных доменов"""
+async def get_available_domains(response: Response, if_none_match: Optional[str] = Header(None)):
+    """Получить список доступных доменов (с ETag, при совпадении If-None-Match - 304)"""
     try:
         domains = await mail_service.get_domains()
+        headers = {"ETag": _etag([domain.encode() for domain in domains]), "Cache-Control": "no-cache"}
+        if mail_service.domains_stale:
+            headers["X-Domains-Stale"] = "true"
+        if _etag_matches(if_none_match, headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+        response.headers.update(headers)
         return domains
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error getting domains: {e}")
+        logger.error("Error getting domains: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error")
 
 @app.get("/api/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy", "timestamp": datetime.now().isoformat()}
+    health = {"status": "healthy", "timestamp": datetime.now().isoformat()}
+    health.update(mail_service.health_info())
+    health["token_refresh"] = {"refreshed": token_refresher.refreshed, "failed": token_refresher.failed}
+    health["inbox_expiry"] = {"deleted": inbox_reaper.deleted, "failed": inbox_reaper.failed}
+    return health
+
+if METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        """Prometheus metrics"""
+        return Response(content=generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+"""
+Offline load benchmark for the Temporary Email Service backend
+
+Starts the fake mail.tm (backend/fake_mailtm.py) and the backend as
+subprocesses, drives /api/inbox/create and /api/inbox/{id}/messages at the
+target concurrency and reports latency percentiles, throughput and the
+number of upstream calls (per created inbox, and per polled inbox and
+second, since request coalescing is time-based).
+
+Absolute numbers only mean something on the machine that produced them, so
+regressions are checked against a run on the same machine: either a git ref
+benchmarked back-to-back with the working tree, or a stored baseline that
+was recorded on this machine.
+
+    python backend_benchmark.py --against HEAD~1 --rounds 3
+    python backend_benchmark.py --latency 0.1 --error-rate 0.02 --rate-limit 20
+    python backend_benchmark.py --update-baseline      # store a local baseline
+
+Results are written to --output as JSON; the run exits with status 1 if any
+scenario regressed beyond --tolerance.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.join(ROOT, "backend")
+DEFAULT_BASELINE = os.path.join(ROOT, "benchmark_baseline.json")
+
+# Settings that must match for two runs to be comparable
+COMPARABLE_SETTINGS = ("concurrency", "creates", "latency", "jitter", "error_rate", "rate_limit", "inbox_size")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def machine_id() -> str:
+    """Identifies the host a baseline was recorded on"""
+    return f"{platform.node()}/{platform.machine()}/{os.cpu_count()} cpus/Python {platform.python_version()}"
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile of already sorted samples"""
+    if not samples:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(samples)))
+    return samples[rank - 1]
+
+
+class ScenarioStats:
+    """Latencies and status codes of one scenario"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies: List[float] = []
+        self.statuses: Dict[str, int] = {}
+        self.started = time.perf_counter()
+        self.finished = self.started
+        self.polled_inboxes = 0
+
+    def record(self, status: str, latency: float):
+        self.latencies.append(latency)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def summary(self, upstream_calls: Dict[str, int]) -> Dict[str, Any]:
+        latencies = sorted(self.latencies)
+        duration = self.finished - self.started
+        requests = len(latencies)
+        errors = sum(count for status, count in self.statuses.items() if not status.startswith("2"))
+        upstream_total = sum(upstream_calls.values())
+        inbox_seconds = self.polled_inboxes * duration
+        return {
+            "requests": requests,
+            "errors": errors,
+            "error_rate": errors / requests if requests else 0.0,
+            "statuses": self.statuses,
+            "duration_s": round(duration, 3),
+            "throughput_rps": round(requests / duration, 2) if duration > 0 else 0.0,
+            "latency_ms": {
+                "mean": round(sum(latencies) / requests * 1000, 2) if requests else 0.0,
+                "p50": round(percentile(latencies, 50) * 1000, 2),
+                "p95": round(percentile(latencies, 95) * 1000, 2),
+                "p99": round(percentile(latencies, 99) * 1000, 2),
+                "max": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+            },
+            "upstream_calls": upstream_calls,
+            "upstream_calls_per_request": round(upstream_total / requests, 3) if requests else 0.0,
+            "polled_inboxes": self.polled_inboxes,
+            # Polls are coalesced per inbox and time window, so this stays comparable across throughputs
+            "upstream_calls_per_inbox_s": round(upstream_total / inbox_seconds, 3) if inbox_seconds else None,
+        }
+
+
+class BenchmarkRunner:
+    def __init__(self, args: argparse.Namespace, backend_dir: str = BACKEND_DIR):
+        self.args = args
+        self.backend_dir = backend_dir
+        self.fake_url = f"http://127.0.0.1:{free_port()}"
+        self.api_url = f"http://127.0.0.1:{free_port()}"
+        self.processes: List[subprocess.Popen] = []
+        self.inboxes: List[Dict[str, Any]] = []
+        self.session: Optional[aiohttp.ClientSession] = None
+        self._store_dir = tempfile.TemporaryDirectory()
+
+    def start_processes(self):
+        args = self.args
+        fake_port = self.fake_url.rsplit(":", 1)[1]
+        self.processes.append(subprocess.Popen([
+            sys.executable, "fake_mailtm.py", "--port", fake_port,
+            "--latency", str(args.latency), "--jitter", str(args.jitter),
+            "--error-rate", str(args.error_rate), "--rate-limit", str(args.rate_limit),
+            "--inbox-size", str(args.inbox_size),
+        ], cwd=self.backend_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+
+        env = dict(os.environ)
+        env.update({
+            "MAILTM_BASE_URL": self.fake_url,
+            "MERCURE_HUB_URL": f"{self.fake_url}/.well-known/mercure",
+            "INBOX_STORE_PATH": os.path.join(self._store_dir.name, "inboxes.db"),
+            "LOG_LEVEL": "WARNING",
+            # The fake is local; measure the backend rather than mail.tm's request quota
+            "UPSTREAM_RATE_LIMIT": "0",
+        })
+        for item in args.server_env:
+            key, _, value = item.partition("=")
+            env[key] = value
+        api_port = self.api_url.rsplit(":", 1)[1]
+        self.processes.append(subprocess.Popen([
+            sys.executable, "-m", "uvicorn", "server:app", "--port", api_port, "--log-level", "warning",
+        ], cwd=self.backend_dir, env=env, stdout=subprocess.DEVNULL, stderr=None if args.verbose else subprocess.DEVNULL))
+
+    def stop_processes(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self._store_dir.cleanup()
+
+    async def wait_ready(self, timeout: float = 30):
+        deadline = time.monotonic() + timeout
+        for url in (f"{self.fake_url}/_fake/stats", f"{self.api_url}/api/health"):
+            while True:
+                try:
+                    async with self.session.get(url) as response:
+                        if response.status == 200:
+                            break
+                except aiohttp.ClientError:
+                    pass
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"{url} did not become ready")
+                await asyncio.sleep(0.2)
+        if self.args.warmup > 0:
+            # Let background work such as the inbox pool settle before measuring
+            await asyncio.sleep(self.args.warmup)
+
+    async def upstream_calls(self) -> Dict[str, int]:
+        async with self.session.get(f"{self.fake_url}/_fake/stats") as response:
+            return await response.json()
+
+    async def reset_upstream_calls(self):
+        async with self.session.delete(f"{self.fake_url}/_fake/stats"):
+            pass
+
+    async def timed(self, stats: ScenarioStats, method: str, url: str, **kwargs) -> Optional[Any]:
+        started = time.perf_counter()
+        try:
+            async with self.session.request(method, url, **kwargs) as response:
+                body = await response.read()
+                stats.record(str(response.status), time.perf_counter() - started)
+                return json.loads(body) if response.status == 200 else None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            stats.record(type(e).__name__, time.perf_counter() - started)
+            return None
+
+    async def bench_create(self) -> ScenarioStats:
+        stats = ScenarioStats("create_inbox")
+        remaining = iter(range(self.args.creates))
+
+        async def worker():
+            for _ in remaining:
+                data = await self.timed(stats, "POST", f"{self.api_url}/api/inbox/create", json={})
+                if data and data.get("inbox"):
+                    self.inboxes.append(data["inbox"])
+
+        await asyncio.gather(*(worker() for _ in range(self.args.concurrency)))
+        stats.finished = time.perf_counter()
+        return stats
+
+    async def bench_messages(self) -> ScenarioStats:
+        stats = ScenarioStats("get_messages")
+        if not self.inboxes:
+            return stats
+        stats.polled_inboxes = len(self.inboxes)
+        deadline = time.monotonic() + self.args.duration
+
+        async def worker(offset: int):
+            index = offset
+            while time.monotonic() < deadline:
+                inbox = self.inboxes[index % len(self.inboxes)]
+                index += self.args.concurrency
+                await self.timed(stats, "GET", f"{self.api_url}/api/inbox/{inbox['id']}/messages",
+                                 params={"token": inbox["token"]})
+
+        await asyncio.gather(*(worker(offset) for offset in range(self.args.concurrency)))
+        stats.finished = time.perf_counter()
+        return stats
+
+    async def run(self) -> Dict[str, Any]:
+        connector = aiohttp.TCPConnector(limit=0)
+        timeout = aiohttp.ClientTimeout(total=60)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            self.session = session
+            await self.wait_ready()
+            scenarios = {}
+            for scenario in (self.bench_create, self.bench_messages):
+                await self.reset_upstream_calls()
+                stats = await scenario()
+                scenarios[stats.name] = stats.summary(await self.upstream_calls())
+        return scenarios
+
+
+def upstream_check(current: Dict[str, Any], base: Dict[str, Any]):
+    """The upstream-cost check of a scenario: per polled inbox and second when it polls, else per request"""
+    if current.get("upstream_calls_per_inbox_s") is not None and base.get("upstream_calls_per_inbox_s") is not None:
+        return ("upstream calls per inbox-second", current["upstream_calls_per_inbox_s"],
+                base["upstream_calls_per_inbox_s"], True)
+    return ("upstream calls per request", current["upstream_calls_per_request"],
+            base["upstream_calls_per_request"], True)
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Regressions of the current run against the baseline, as readable lines"""
+    regressions = []
+    for name, base in baseline["scenarios"].items():
+        current = results["scenarios"].get(name)
+        if current is None:
+            regressions.append(f"{name}: scenario missing")
+            continue
+        checks = [
+            ("p95 latency", current["latency_ms"]["p95"], base["latency_ms"]["p95"], True),
+            ("p99 latency", current["latency_ms"]["p99"], base["latency_ms"]["p99"], True),
+            ("throughput", current["throughput_rps"], base["throughput_rps"], False),
+            upstream_check(current, base),
+        ]
+        for label, value, reference, lower_is_better in checks:
+            if lower_is_better and value > reference * (1 + tolerance) and value - reference > 1e-9:
+                regressions.append(f"{name}: {label} {value} vs baseline {reference}")
+            if not lower_is_better and value < reference * (1 - tolerance):
+                regressions.append(f"{name}: {label} {value} vs baseline {reference}")
+        if current["error_rate"] > base["error_rate"] + 0.01:
+            regressions.append(f"{name}: error rate {current['error_rate']:.3f} vs baseline {base['error_rate']:.3f}")
+    return regressions
+
+
+def median_scenarios(runs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Per-metric medians over several runs of the same scenarios"""
+    merged = {}
+    for name, first in runs[0].items():
+        samples = [run[name] for run in runs if name in run]
+        scenario = dict(first, latency_ms=dict(first["latency_ms"]))
+        for key in ("throughput_rps", "error_rate", "upstream_calls_per_request", "upstream_calls_per_inbox_s"):
+            values = [sample[key] for sample in samples if sample.get(key) is not None]
+            scenario[key] = round(statistics.median(values), 3) if values else first.get(key)
+        for key in scenario["latency_ms"]:
+            scenario["latency_ms"][key] = round(statistics.median(sample["latency_ms"][key] for sample in samples), 2)
+        scenario["rounds"] = len(samples)
+        merged[name] = scenario
+    return merged
+
+
+def export_tree(ref: str, destination: str) -> str:
+    """Extract the backend of a git ref; returns its backend directory"""
+    archive = subprocess.run(["git", "archive", ref, "backend"], cwd=ROOT, check=True, capture_output=True).stdout
+    subprocess.run(["tar", "-x", "-C", destination], input=archive, check=True)
+    return os.path.join(destination, "backend")
+
+
+def run_rounds(args: argparse.Namespace, backend_dirs: List[str]) -> List[Dict[str, Any]]:
+    """Benchmark each backend `args.rounds` times, interleaved so drift affects all of them alike"""
+    runs: List[List[Dict[str, Any]]] = [[] for _ in backend_dirs]
+    for round_index in range(args.rounds):
+        for runs_of_tree, backend_dir in zip(runs, backend_dirs):
+            runner = BenchmarkRunner(args, backend_dir)
+            runner.start_processes()
+            try:
+                runs_of_tree.append(asyncio.run(runner.run()))
+            finally:
+                runner.stop_processes()
+    return [median_scenarios(tree_runs) for tree_runs in runs]
+
+
+def print_report(results: Dict[str, Any], title: Optional[str] = None):
+    if title:
+        print(title)
+    print(f"{'scenario':<14} {'reqs':>6} {'err':>5} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+          f"{'upstream/req':>13} {'upstream/inbox/s':>17}")
+    for name, scenario in results["scenarios"].items():
+        latency = scenario["latency_ms"]
+        per_inbox = scenario.get("upstream_calls_per_inbox_s")
+        print(f"{name:<14} {scenario['requests']:>6} {scenario['errors']:>5} {scenario['throughput_rps']:>9} "
+              f"{latency['p50']:>9} {latency['p95']:>9} {latency['p99']:>9} {scenario['upstream_calls_per_request']:>13} "
+              f"{per_inbox if per_inbox is not None else '-':>17}")
+
+
+def report_regressions(regressions: List[str], reference: str, tolerance: float) -> int:
+    if regressions:
+        print(f"\n❌ REGRESSIONS against {reference}:")
+        for line in regressions:
+            print(f"  - {line}")
+        return 1
+    print(f"\n✅ No regressions against {reference} (tolerance {tolerance:.0%})")
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Offline load benchmark for the backend")
+    parser.add_argument("--concurrency", type=int, default=50, help="concurrent client connections")
+    parser.add_argument("--creates", type=int, default=200, help="inboxes created in the create scenario")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of message polling")
+    parser.add_argument("--warmup", type=float, default=2, help="seconds to wait after startup")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake mail.tm delay per request")
+    parser.add_argument("--jitter", type=float, default=0.02, help="fake mail.tm random extra delay")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of fake mail.tm requests failing with 500")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="fake mail.tm requests per second before 429s")
+    parser.add_argument("--inbox-size", type=int, default=5, help="messages seeded into every new inbox")
+    parser.add_argument("--server-env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra environment for the backend, e.g. INBOX_POOL_ENABLED=false")
+    parser.add_argument("--rounds", type=int, default=1, help="runs per tree; medians are reported")
+    parser.add_argument("--against", metavar="GIT_REF",
+                        help="benchmark this git ref back-to-back with the working tree and compare")
+    parser.add_argument("--output", default="benchmark_results.json", help="where to write the results")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE,
+                        help="local baseline to compare against when --against is not given")
+    parser.add_argument("--update-baseline", action="store_true", help="store this run as the local baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative regression")
+    parser.add_argument("--verbose", action="store_true", help="show backend logs")
+    args = parser.parse_args()
+
+    args.rounds = max(1, args.rounds)
+
+    with tempfile.TemporaryDirectory() as reference_dir:
+        backend_dirs = [BACKEND_DIR]
+        if args.against:
+            backend_dirs.append(export_tree(args.against, reference_dir))
+        scenario_runs = run_rounds(args, backend_dirs)
+
+    def make_results(scenarios: Dict[str, Any], tree: str) -> Dict[str, Any]:
+        return {
+            "timestamp": datetime.now().isoformat(),
+            "machine": machine_id(),
+            "tree": tree,
+            "settings": {name: getattr(args, name) for name in COMPARABLE_SETTINGS + ("duration", "rounds")},
+            "server_env": args.server_env,
+            "scenarios": scenarios,
+        }
+
+    results = make_results(scenario_runs[0], "working tree")
+    reference = make_results(scenario_runs[1], args.against) if args.against else None
+    with open(args.output, "w") as f:
+        json.dump({**results, "reference": reference} if reference else results, f, indent=2)
+    if reference:
+        print_report(reference, f"{args.against}:")
+        print()
+    print_report(results, "working tree:" if reference else None)
+    print(f"\nResults written to {args.output}")
+
+    if reference:
+        return report_regressions(compare(results, reference, args.tolerance), args.against, args.tolerance)
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline updated: {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print("No baseline to compare against (use --against or --update-baseline)")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("machine") != results["machine"]:
+        print(f"⚠️  Baseline was recorded on another machine ({baseline.get('machine', 'unknown')}); "
+              f"skipping comparison (use --against or --update-baseline)")
+        return 0
+    mismatched = [name for name in COMPARABLE_SETTINGS
+                  if baseline.get("settings", {}).get(name) != results["settings"][name]]
+    if mismatched or baseline.get("server_env") != results["server_env"]:
+        print(f"⚠️  Baseline was recorded with different settings ({', '.join(mismatched) or 'server_env'}); "
+              f"skipping comparison")
+        return 0
+    return report_regressions(compare(results, baseline, args.tolerance), "baseline", args.tolerance)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
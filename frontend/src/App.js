@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import './App.css';
 
 function App() {
@@ -9,21 +9,74 @@ function App() {
   const [autoRefresh, setAutoRefresh] = useState(false);
   const [copySuccess, setCopySuccess] = useState(false);
   const [selectedMessage, setSelectedMessage] = useState(null);
+  const [showRemoteImages, setShowRemoteImages] = useState(false);
+  const [hasRemoteImages, setHasRemoteImages] = useState(false);
+  const messagesEtag = useRef(null);
+  const messageBody = useRef(null);
 
   const backendUrl = process.env.REACT_APP_BACKEND_URL || 'http://localhost:8001';
 
   useEffect(() => {
     let interval;
+    let source;
+
+    const startPolling = () => {
+      if (!interval) {
+        interval = setInterval(() => {
+          fetchMessages();
+        }, 5000); // Refresh every 5 seconds
+      }
+    };
+
     if (autoRefresh && inbox) {
-      interval = setInterval(() => {
-        fetchMessages();
-      }, 5000); // Refresh every 5 seconds
+      if (window.EventSource && inbox.token) {
+        // Server pushes new messages; polling is only the fallback
+        source = new EventSource(
+          `${backendUrl}/api/inbox/${inbox.id}/stream?token=${inbox.token}`
+        );
+        source.addEventListener('snapshot', (event) => {
+          setMessages(JSON.parse(event.data));
+        });
+        source.addEventListener('messages', (event) => {
+          const incoming = JSON.parse(event.data);
+          setMessages((current) => {
+            const known = new Set(current.map((message) => message.id));
+            return [...incoming.filter((message) => !known.has(message.id)), ...current];
+          });
+        });
+        source.onerror = (event) => {
+          // EventSource reconnects by itself unless the stream was refused; an
+          // `error` event sent by the server ends the stream for good
+          if (event.data !== undefined || source.readyState === EventSource.CLOSED) {
+            source.close();
+            startPolling();
+          }
+        };
+      } else {
+        startPolling();
+      }
     }
     return () => {
+      if (source) source.close();
       if (interval) clearInterval(interval);
     };
   }, [autoRefresh, inbox]);
 
+  useEffect(() => {
+    // The backend sanitizes the HTML and parks remote images in data-remote-src.
+    // They are swapped in on the DOM: string edits would re-parse sanitized markup
+    const container = messageBody.current;
+    const images = container ? container.querySelectorAll('img[data-remote-src]') : [];
+    if (showRemoteImages) {
+      images.forEach((image) => {
+        image.referrerPolicy = 'no-referrer';
+        image.src = image.dataset.remoteSrc;
+        image.removeAttribute('data-remote-src');
+      });
+    }
+    setHasRemoteImages(!showRemoteImages && images.length > 0);
+  }, [selectedMessage, showRemoteImages]);
+
   const createInbox = async () => {
     setLoading(true);
     try {
@@ -57,16 +110,36 @@ function App() {
     if (!inbox || !inbox.token) return;
 
     try {
-      const response = await fetch(
-        `${backendUrl}/api/inbox/${inbox.id}/messages?token=${inbox.token}`
-      );
+      const url = `${backendUrl}/api/inbox/${inbox.id}/messages?token=${inbox.token}&fields=summary`;
+      const validator = messagesEtag.current;
+      // Send the last ETag: an unchanged list comes back as an empty 304
+      const response = await fetch(url, {
+        cache: 'no-store',
+        headers: validator && validator.url === url ? { 'If-None-Match': validator.etag } : {},
+      });
 
+      if (response.status === 304) {
+        return;
+      }
+      if ([401, 403, 404].includes(response.status)) {
+        // The inbox expired or was deleted: stop refreshing it
+        setAutoRefresh(false);
+        return;
+      }
       if (!response.ok) {
         throw new Error('Failed to fetch messages');
       }
 
+      const etag = response.headers.get('ETag');
+      messagesEtag.current = etag ? { url, etag } : null;
       const data = await response.json();
-      setMessages(data);
+      // Keep bodies that were already loaded for opened messages
+      setMessages((current) => {
+        const loaded = new Map(
+          current.filter((message) => message.body !== undefined).map((message) => [message.id, message])
+        );
+        return data.map((message) => loaded.get(message.id) || message);
+      });
     } catch (error) {
       console.error('Error fetching messages:', error);
     }
@@ -91,8 +164,29 @@ function App() {
     });
   };
 
-  const openMessage = (message) => {
+  const openMessage = async (message) => {
     setSelectedMessage(message);
+    setShowRemoteImages(false);
+    if (message.body !== undefined) return;
+
+    // The list only carries headers; load the full body on demand
+    try {
+      const response = await fetch(
+        `${backendUrl}/api/inbox/${inbox.id}/messages/${message.id}?token=${inbox.token}`
+      );
+
+      if (!response.ok) {
+        throw new Error('Failed to fetch message');
+      }
+
+      const fullMessage = await response.json();
+      setMessages((current) =>
+        current.map((item) => (item.id === fullMessage.id ? fullMessage : item))
+      );
+      setSelectedMessage((current) => (current && current.id === fullMessage.id ? fullMessage : current));
+    } catch (error) {
+      console.error('Error fetching message:', error);
+    }
   };
 
   const closeMessage = () => {
@@ -163,6 +257,9 @@ function App() {
                 <h2 className="text-2xl font-semibold text-gray-800">Ваш временный email</h2>
                 <button
                   onClick={() => {
+                    // Release the account right away instead of waiting for it to expire
+                    fetch(`${backendUrl}/api/inbox/${inbox.id}?token=${inbox.token}`, { method: 'DELETE' })
+                      .catch((error) => console.error('Error deleting inbox:', error));
                     setInbox(null);
                     setMessages([]);
                     setAutoRefresh(false);
@@ -259,7 +356,7 @@ function App() {
                             {message.subject || 'Без темы'}
                           </h4>
                           <p className="text-gray-600 line-clamp-2">
-                            {message.body.substring(0, 150)}...
+                            {message.snippet}
                           </p>
                         </div>
                         <div className="ml-4 text-right">
@@ -313,13 +410,42 @@ function App() {
                     <span className="font-semibold text-gray-700">Дата:</span>
                     <span className="ml-2 text-gray-600">{formatDate(selectedMessage.received_at)}</span>
                   </div>
+                  {selectedMessage.attachments && selectedMessage.attachments.length > 0 && (
+                    <div className="md:col-span-2">
+                      <span className="font-semibold text-gray-700">Вложения:</span>
+                      {selectedMessage.attachments.map((attachment) => (
+                        <a
+                          key={attachment.id}
+                          href={`${backendUrl}/api/inbox/${inbox.id}/messages/${selectedMessage.id}/attachments/${attachment.id}?token=${inbox.token}`}
+                          className="ml-2 text-blue-600 hover:underline"
+                        >
+                          📎 {attachment.filename} ({Math.ceil(attachment.size / 1024)} KB)
+                        </a>
+                      ))}
+                    </div>
+                  )}
                 </div>
               </div>
 
               <div className="p-6 overflow-y-auto max-h-[60vh]">
                 <div className="prose prose-sm max-w-none">
-                  {selectedMessage.html_body && selectedMessage.html_body.length > 0 ? (
-                    <div dangerouslySetInnerHTML={{ __html: selectedMessage.html_body[0] }} />
+                  {selectedMessage.body === undefined ? (
+                    <p className="text-gray-500">Загрузка...</p>
+                  ) : selectedMessage.html_body && selectedMessage.html_body.length > 0 ? (
+                    <>
+                      {hasRemoteImages && (
+                        <button
+                          onClick={() => setShowRemoteImages(true)}
+                          className="mb-4 text-sm text-blue-600 hover:underline"
+                        >
+                          🖼️ Показать изображения
+                        </button>
+                      )}
+                      <div
+                        ref={messageBody}
+                        dangerouslySetInnerHTML={{ __html: selectedMessage.html_body }}
+                      />
+                    </>
                   ) : (
                     <pre className="whitespace-pre-wrap font-sans text-gray-700 leading-relaxed">
                       {selectedMessage.body}
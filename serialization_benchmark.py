@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark of the per-message CPU cost of serializing message lists
+
+Compares the generic FastAPI path (response_model validation, jsonable
+encoding and json.dumps) with the path used by the messages endpoints
+(cached per-message JSON spliced into one array):
+
+    python serialization_benchmark.py --messages 200 --rounds 50
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Callable, List, Union
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from fastapi.responses import JSONResponse  # noqa: E402
+from fastapi.routing import serialize_response  # noqa: E402
+from fastapi.utils import create_response_field  # noqa: E402
+
+import server  # noqa: E402
+from server import EmailMessage, EmailMessageSummary, FastJSONResponse, MailTmAdapter, _json_list  # noqa: E402
+
+
+def raw_message(index: int) -> dict:
+    """A mail.tm message payload of typical size"""
+    text = f"Hello, this is message {index}. Your verification code is {100000 + index}. " * 8
+    return {
+        "id": f"{index:024x}",
+        "from": {"address": "no-reply@example.com", "name": "Example"},
+        "to": [{"address": "user@example.test", "name": ""}],
+        "subject": f"Message {index}",
+        "intro": text[:120],
+        "text": text,
+        "html": [f"<div><p>{text}</p><a href=\"https://example.com/verify?code={index}\">Verify</a></div>"],
+        "hasAttachments": False,
+        "attachments": [],
+        "createdAt": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+    }
+
+
+def per_message_us(fn: Callable[[], object], rounds: int, count: int) -> float:
+    fn()  # warm-up
+    started = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - started) / rounds / count * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-message serialization cost")
+    parser.add_argument("--messages", type=int, default=200, help="messages per response")
+    parser.add_argument("--rounds", type=int, default=50, help="responses serialized per measurement")
+    args = parser.parse_args()
+
+    raw = [raw_message(index) for index in range(args.messages)]
+    messages = [MailTmAdapter._parse_message(item) for item in raw]
+    field = create_response_field("Response_messages", List[Union[EmailMessage, EmailMessageSummary]])
+    loop = asyncio.new_event_loop()
+
+    def fastapi_path(response_class=JSONResponse) -> bytes:
+        content = loop.run_until_complete(serialize_response(field=field, response_content=messages))
+        return response_class(content).body
+
+    def cold_cache() -> bytes:
+        # First poll after parsing: every message is serialized once
+        for message in messages:
+            message.__pydantic_private__["_json"] = None
+        return FastJSONResponse(_json_list(messages)).body
+
+    def warm_cache() -> bytes:
+        return FastJSONResponse(_json_list(messages)).body
+
+    def parse_uncached() -> list:
+        server.message_renderer = server.MessageRenderer()
+        return [MailTmAdapter._parse_message(item) for item in raw]
+
+    assert json.loads(fastapi_path()) == json.loads(warm_cache()), "serialization paths disagree"
+
+    results = [
+        ("parse + render (per poll before caching)", per_message_us(parse_uncached, args.rounds, args.messages)),
+        ("response_model + json.dumps (before)", per_message_us(fastapi_path, args.rounds, args.messages)),
+        ("response_model + orjson", per_message_us(lambda: fastapi_path(FastJSONResponse), args.rounds, args.messages)),
+        ("cached JSON, first serialization", per_message_us(cold_cache, args.rounds, args.messages)),
+        ("cached JSON, reused (after)", per_message_us(warm_cache, args.rounds, args.messages)),
+    ]
+    print(f"{args.messages} messages per response, orjson {'enabled' if server.orjson else 'not installed'}")
+    before = results[1][1]
+    for label, cost in results:
+        print(f"  {label:<42} {cost:9.2f} µs/message  ({before / cost:6.1f}x vs before)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+# The backend is a single module, not an installed package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+os.environ.setdefault("INBOX_STORE_PATH", os.path.join(tempfile.mkdtemp(prefix="tempmail-tests-"), "inboxes.db"))
+os.environ.setdefault("MERCURE_ENABLED", "false")
+os.environ.setdefault("INBOX_POOL_LOW_WATERMARK", "0")
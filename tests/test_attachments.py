@@ -0,0 +1,112 @@
+import asyncio
+import os
+
+import pytest
+from fastapi import HTTPException
+
+from server import AttachmentCache, _parse_range
+
+ATTACHMENT = {"id": "a1", "filename": "file.bin"}
+
+
+async def _chunks(*parts):
+    for part in parts:
+        await asyncio.sleep(0)
+        yield part
+
+
+async def _drain(stream):
+    return b"".join([chunk async for chunk in stream])
+
+
+def _store(cache, message_id, *parts):
+    return asyncio.run(_drain(cache.tee(message_id, "a1", _chunks(*parts))))
+
+
+def test_parse_range():
+    assert _parse_range("bytes=2-4", 10) == (2, 4)
+    assert _parse_range("bytes=5-", 10) == (5, 9)
+    assert _parse_range("bytes=-3", 10) == (7, 9)
+    assert _parse_range("bytes=5-100", 10) == (5, 9)
+    assert _parse_range("bytes=0-1,4-5", 10) is None
+    assert _parse_range("items=0-1", 10) is None
+
+
+def test_parse_range_ignores_reversed_range():
+    assert _parse_range("bytes=5-2", 10) is None
+
+
+def test_parse_range_rejects_unsatisfiable_range():
+    with pytest.raises(HTTPException) as rejected:
+        _parse_range("bytes=10-", 10)
+    assert rejected.value.status_code == 416
+    assert rejected.value.headers["Content-Range"] == "bytes */10"
+
+
+def test_tee_publishes_complete_bodies(tmp_path):
+    cache = AttachmentCache(str(tmp_path), max_bytes=100)
+    assert _store(cache, "m1", b"hello ", b"world") == b"hello world"
+
+    path = cache.lookup("m1", "a1")
+    stream = cache.open(path, ATTACHMENT, "bytes=6-")
+    assert stream.status_code == 206
+    assert asyncio.run(_drain(stream.chunks)) == b"world"
+    assert cache.size == 11
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".part")]
+
+
+def test_tee_discards_interrupted_bodies(tmp_path):
+    cache = AttachmentCache(str(tmp_path), max_bytes=100)
+
+    async def failing():
+        yield b"partial"
+        raise ConnectionError("upstream went away")
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(_drain(cache.tee("m1", "a1", failing())))
+    assert cache.lookup("m1", "a1") is None
+    assert cache.size == 0
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".part")]
+
+
+def test_least_recently_used_blobs_are_evicted(tmp_path):
+    cache = AttachmentCache(str(tmp_path), max_bytes=25)
+    _store(cache, "m1", b"a" * 10)
+    _store(cache, "m2", b"b" * 10)
+    assert cache.lookup("m1", "a1") is not None
+    _store(cache, "m3", b"c" * 10)
+
+    assert cache.lookup("m2", "a1") is None
+    assert cache.lookup("m1", "a1") is not None
+    assert cache.lookup("m3", "a1") is not None
+    assert cache.size == 20
+    assert cache.evictions == 1
+    assert len(os.listdir(tmp_path / "blobs")) == 2
+
+
+def test_bodies_larger_than_the_cache_stream_uncached(tmp_path):
+    cache = AttachmentCache(str(tmp_path), max_bytes=25)
+    _store(cache, "m1", b"a" * 10)
+    assert _store(cache, "m2", b"b" * 20, b"b" * 20) == b"b" * 40
+
+    assert cache.lookup("m2", "a1") is None
+    assert cache.lookup("m1", "a1") is not None
+    assert cache.size == 10
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".part")]
+
+
+def test_eviction_order_survives_restart(tmp_path):
+    cache = AttachmentCache(str(tmp_path), max_bytes=25)
+    _store(cache, "m1", b"a" * 10)
+    _store(cache, "m2", b"b" * 10)
+    blobs = tmp_path / "blobs"
+    first, second = sorted(blobs.iterdir(), key=lambda path: path.stat().st_mtime)
+    os.utime(first, (0, 0))
+    os.utime(second, (1, 1))
+    cache.lookup("m1", "a1")
+
+    restarted = AttachmentCache(str(tmp_path), max_bytes=25)
+    assert restarted.size == 20
+    _store(restarted, "m3", b"c" * 10)
+    assert restarted.lookup("m2", "a1") is None
+    assert restarted.lookup("m1", "a1") is not None
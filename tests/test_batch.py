@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import server
+from server import SQLiteInboxStore
+
+from .upstream import run_api_with_fake
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SQLiteInboxStore(str(tmp_path / "inboxes.db"))
+
+
+class ConcurrencyProbe:
+    """Wraps a provider method, recording the peak number of calls in flight"""
+
+    def __init__(self, call, fail=lambda *args, **kwargs: False):
+        self.call = call
+        self.fail = fail
+        self.active = 0
+        self.peak = 0
+
+    async def __call__(self, *args, **kwargs):
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(0.02)
+            if self.fail(*args, **kwargs):
+                raise HTTPException(status_code=422, detail="Address already used")
+            return await self.call(*args, **kwargs)
+        finally:
+            self.active -= 1
+
+
+def test_batch_create_is_bounded_and_reports_failed_items(store, monkeypatch):
+    monkeypatch.setattr(server, "BATCH_CREATE_CONCURRENCY", 2)
+
+    async def scenario(fake, adapter, client):
+        probe = ConcurrencyProbe(adapter.create_inbox, fail=lambda name=None: name == "bulk3")
+        adapter.create_inbox = probe
+        response = await client.post("/api/inbox/batch-create", json={"count": 5, "name_prefix": "bulk"})
+        assert response.status_code == 200
+        body = response.json()
+        assert probe.peak == 2
+        assert body["errors"] == [{"index": 3, "status_code": 422, "detail": "Address already used"}]
+        assert sorted(inbox["email"][:5] for inbox in body["inboxes"]) == ["bulk0", "bulk1", "bulk2", "bulk4"]
+        for inbox in body["inboxes"]:
+            assert inbox["id"] in fake.accounts
+            assert await store.get(inbox["id"]) is not None
+
+        too_many = await client.post("/api/inbox/batch-create", json={"count": server.BATCH_MAX_INBOXES + 1})
+        assert too_many.status_code == 422
+
+    run_api_with_fake(scenario, store)
+
+
+def test_batch_messages_filters_each_item_and_isolates_failures(store, monkeypatch):
+    monkeypatch.setattr(server, "BATCH_MESSAGES_CONCURRENCY", 2)
+
+    async def scenario(fake, adapter, client):
+        inboxes = [(await client.post("/api/inbox/create", json={})).json()["inbox"] for _ in range(2)]
+        first = [fake.add_message(inboxes[0]["id"], subject=f"First {index}", text=f"Body {index}")
+                 for index in range(3)]
+        fake.add_message(inboxes[1]["id"], subject="Second", text="Other body")
+        probe = ConcurrencyProbe(adapter.list_messages)
+        adapter.list_messages = probe
+
+        response = await client.post("/api/inbox/batch-messages", json={"fields": "summary", "items": [
+            {"inbox_id": inboxes[0]["id"], "token": inboxes[0]["token"], "since": first[0]["id"]},
+            {"inbox_id": inboxes[1]["id"], "token": inboxes[1]["token"]},
+            {"inbox_id": inboxes[1]["id"], "token": "not-a-token"},
+            {"inbox_id": inboxes[0]["id"], "token": inboxes[0]["token"], "since": "0123456789abcdef01234567"},
+        ]})
+        assert response.status_code == 200
+        results = response.json()["results"]
+        assert probe.peak == 2
+
+        assert [message["subject"] for message in results[0]["messages"]] == ["First 2", "First 1"]
+        assert results[0]["message_count"] == 2
+        assert "body" not in results[0]["messages"][0]
+        assert [message["subject"] for message in results[1]["messages"]] == ["Second"]
+        assert results[1]["error"] is None
+        assert results[2]["messages"] == []
+        assert results[2]["error"]["index"] == 2 and results[2]["error"]["status_code"] == 401
+        assert results[3]["error"]["index"] == 3 and results[3]["error"]["status_code"] == 410
+
+        full = await client.post("/api/inbox/batch-messages", json={"items": [
+            {"inbox_id": inboxes[1]["id"], "token": inboxes[1]["token"]}]})
+        assert full.json()["results"][0]["messages"][0]["body"] == "Other body"
+
+    run_api_with_fake(scenario, store)
@@ -0,0 +1,64 @@
+import asyncio
+
+from fastapi import HTTPException
+
+from server import DomainCache
+
+
+class FlakyDomains:
+    def __init__(self):
+        self.calls = 0
+        self.down = False
+
+    async def __call__(self):
+        self.calls += 1
+        if self.down:
+            raise HTTPException(status_code=503, detail="Mail.tm is temporarily unavailable")
+        return ["example.test"]
+
+
+async def settle(cache):
+    while cache._inflight is not None:
+        await asyncio.sleep(0)
+
+
+def test_expired_list_is_refreshed_in_the_background_without_being_flagged():
+    fetch = FlakyDomains()
+
+    async def scenario():
+        cache = DomainCache(fetch, ttl=0.01, retry_interval=60)
+        assert await cache.get() == ["example.test"]
+        await asyncio.sleep(0.02)
+        assert cache.expired and not cache.refresh_failed
+        assert await cache.get() == ["example.test"]
+        await settle(cache)
+        return cache
+
+    cache = asyncio.run(scenario())
+    assert fetch.calls == 2
+    assert not cache.expired and not cache.refresh_failed
+
+
+def test_failed_refresh_is_flagged_and_backs_off():
+    fetch = FlakyDomains()
+
+    async def scenario():
+        cache = DomainCache(fetch, ttl=0.01, retry_interval=0.1)
+        await cache.get()
+        await asyncio.sleep(0.02)
+        fetch.down = True
+        for _ in range(5):
+            assert await cache.get() == ["example.test"]
+            await settle(cache)
+        assert cache.refresh_failed
+        assert fetch.calls == 2
+
+        fetch.down = False
+        await asyncio.sleep(0.1)
+        await cache.get()
+        await settle(cache)
+        return cache
+
+    cache = asyncio.run(scenario())
+    assert fetch.calls == 3
+    assert not cache.refresh_failed
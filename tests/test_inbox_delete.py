@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+
+import server
+from server import SQLiteInboxStore
+
+from .upstream import run_api_with_fake
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SQLiteInboxStore(str(tmp_path / "inboxes.db"))
+
+
+def test_delete_checks_the_token_and_drops_the_inbox(store):
+    async def scenario(fake, adapter, client):
+        created = (await client.post("/api/inbox/create", json={"custom_name": "gone"})).json()["inbox"]
+        inbox_id, token = created["id"], created["token"]
+        listed = await client.get(f"/api/inbox/{inbox_id}/messages", params={"token": token})
+        assert listed.status_code == 200
+        assert token in adapter.message_cache
+        queue = server.watchers.subscribe(token)
+        assert (await asyncio.wait_for(queue.get(), timeout=1))[0] == "snapshot"
+
+        missing = await client.delete("/api/inbox/unknown", params={"token": token})
+        assert missing.status_code == 404
+        for wrong in ("not-the-token", "é"):
+            refused = await client.delete(f"/api/inbox/{inbox_id}", params={"token": wrong})
+            assert refused.status_code == 403
+        assert await store.get(inbox_id) is not None
+
+        deleted = await client.delete(f"/api/inbox/{inbox_id}", params={"token": token})
+        assert deleted.status_code == 204
+        assert inbox_id not in fake.accounts
+        assert await store.get(inbox_id) is None
+        assert token not in adapter.message_cache
+        assert await asyncio.wait_for(queue.get(), timeout=1) == ("close", None)
+        assert len(server.watchers) == 0
+
+        again = await client.delete(f"/api/inbox/{inbox_id}", params={"token": token})
+        assert again.status_code == 404
+
+    run_api_with_fake(scenario, store)
@@ -0,0 +1,50 @@
+import asyncio
+
+import server
+from server import InboxPool, InboxReaper, SQLiteInboxStore
+
+from .upstream import run_with_fake
+
+
+def make_pool(adapter, size=2):
+    adapter.inbox_pool = InboxPool(adapter._provision_pooled_account, low=size, high=size, max_age=0.1,
+                                   discard=adapter._delete_pooled_account)
+    return adapter.inbox_pool
+
+
+def test_pool_entries_of_a_dead_worker_are_reaped(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "INBOX_REAPER_INTERVAL", 0)
+    store = SQLiteInboxStore(str(tmp_path / "inboxes.db"))
+
+    async def scenario(fake, adapter):
+        assert await make_pool(adapter)._fill()
+        assert len(fake.accounts) == 2
+        for account_id in fake.accounts:
+            record = await store.get(account_id)
+            assert record is not None and record.expires_at is not None
+
+        # The worker dies without draining its pool; the reaper finds the accounts
+        async def release(record):
+            await adapter.delete_inbox(record)
+            await store.delete(record.id)
+
+        await asyncio.sleep(0.2)
+        assert await InboxReaper(store, release).sweep() == 2
+        assert fake.accounts == {}
+
+    run_with_fake(scenario, store=store)
+
+
+def test_drained_pool_entries_leave_the_store(tmp_path):
+    store = SQLiteInboxStore(str(tmp_path / "inboxes.db"))
+
+    async def scenario(fake, adapter):
+        pool = make_pool(adapter)
+        assert await pool._fill()
+        account_ids = list(fake.accounts)
+        await pool.drain()
+        assert fake.accounts == {}
+        for account_id in account_ids:
+            assert await store.get(account_id) is None
+
+    run_with_fake(scenario, store=store)
@@ -0,0 +1,32 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from server import LocalMailProvider, _messages_since
+
+MESSAGE = b"""From: Sender <sender@example.com>
+Subject: Your code
+Content-Type: text/plain
+
+Code: 123456
+"""
+
+
+def test_received_messages_carry_utc_timestamps():
+    async def scenario():
+        provider = LocalMailProvider(domains=["local.test"])
+        address = await provider.create_inbox("alice")
+        envelope = SimpleNamespace(rcpt_tos=[], mail_from="sender@example.com", content=MESSAGE)
+        assert await provider.handle_RCPT(None, None, envelope, address.email, []) == "250 OK"
+        await provider.handle_DATA(None, None, envelope)
+        return address, await provider.get_messages(address.token)
+
+    before = datetime.now(timezone.utc)
+    address, messages = asyncio.run(scenario())
+    message, = messages
+
+    assert address.created_at.tzinfo is not None
+    assert message.received_at.tzinfo is not None
+    assert before <= message.received_at <= datetime.now(timezone.utc)
+    assert _messages_since(messages, (before - timedelta(seconds=1)).isoformat()) == messages
+    assert _messages_since(messages, (before + timedelta(minutes=5)).isoformat()) == []
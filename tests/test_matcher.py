@@ -0,0 +1,45 @@
+import time
+from datetime import datetime, timezone
+
+import pytest
+from fastapi import HTTPException
+
+import server
+from server import EmailMessage, MessageMatcher
+
+
+def message(subject="Your code", body="Code: 123456"):
+    return EmailMessage(id="m1", from_address="no-reply@service.test", to_address="me@example.test",
+                        subject=subject, body=body, received_at=datetime.now(timezone.utc))
+
+
+def test_filters_and_code_group():
+    matcher = MessageMatcher(sender="service.test", subject_regex="code", body_regex=r"code: (\d+)")
+    assert matcher.matches(message())
+    assert matcher.extract_code(message()) == "123456"
+    assert not MessageMatcher(sender="other.test").matches(message())
+    assert not MessageMatcher(subject_regex="^welcome").matches(message())
+
+
+@pytest.mark.parametrize("pattern", ["(", "a" * (server.WAIT_REGEX_MAX_LENGTH + 1)])
+def test_invalid_or_long_patterns_are_rejected(pattern):
+    with pytest.raises(HTTPException) as rejected:
+        MessageMatcher(body_regex=pattern)
+    assert rejected.value.status_code == 422
+
+
+def test_only_the_start_of_long_bodies_is_searched(monkeypatch):
+    monkeypatch.setattr(server, "WAIT_REGEX_MAX_TEXT", 100)
+    body = "x" * 200 + "Code: 123456"
+    assert not MessageMatcher(body_regex="123456").matches(message(body=body))
+
+
+@pytest.mark.skipif(server.regex is None, reason="needs the regex package")
+def test_catastrophic_backtracking_is_cut_off(monkeypatch):
+    monkeypatch.setattr(server, "WAIT_REGEX_TIMEOUT", 0.05)
+    matcher = MessageMatcher(body_regex="(a+)+$")
+    started = time.monotonic()
+    with pytest.raises(HTTPException) as rejected:
+        matcher.matches(message(body="a" * 5000 + "!"))
+    assert rejected.value.status_code == 422
+    assert time.monotonic() - started < 2
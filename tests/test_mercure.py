@@ -0,0 +1,51 @@
+import asyncio
+import time
+
+import server
+
+from .upstream import eventually, run_with_fake
+
+
+def test_events_feed_the_message_cache():
+    async def scenario(fake, adapter):
+        inbox = await adapter._create_account()
+        adapter.ingestor.watch(inbox.id, inbox.token)
+        await eventually(lambda: adapter.ingestor.is_live(inbox.token))
+        message = fake.add_message(inbox.id, subject="Pushed", text="Your code is 4321")
+        await eventually(lambda: message["id"] in adapter.message_cache.get_inbox(inbox.token))
+        listed = fake.calls.get("/messages", 0)
+        summaries = await adapter.list_messages(inbox.token)
+        assert [summary.subject for summary in summaries] == ["Pushed"]
+        assert fake.calls.get("/messages", 0) == listed
+
+    run_with_fake(scenario)
+
+
+def test_streams_do_not_hold_api_connections(monkeypatch):
+    monkeypatch.setattr(server, "HTTP_POOL_LIMIT", 2)
+    monkeypatch.setattr(server, "HTTP_POOL_LIMIT_PER_HOST", 2)
+
+    async def scenario(fake, adapter):
+        inboxes = [await adapter._create_account() for _ in range(3)]
+        for inbox in inboxes:
+            adapter.ingestor.watch(inbox.id, inbox.token)
+        await eventually(lambda: all(adapter.ingestor.is_live(inbox.token) for inbox in inboxes))
+        # Every stream is open, yet the API pool still serves requests right away
+        await asyncio.wait_for(adapter._fetch_listing(inboxes[0].token), timeout=2)
+
+    run_with_fake(scenario)
+
+
+def test_rejected_subscription_can_resubscribe():
+    async def scenario(fake, adapter):
+        inbox = await adapter._create_account()
+        token = "not-issued-yet"
+        adapter.ingestor.watch(inbox.id, token)
+        subscription = adapter.ingestor._subscriptions[inbox.id]
+        await eventually(lambda: subscription.rejected)
+        fake.tokens[token] = (inbox.id, time.time() + 3600)
+        adapter.ingestor.watch(inbox.id, token)
+        await eventually(lambda: adapter.ingestor.is_live(token))
+        assert adapter.ingestor._subscriptions[inbox.id].refs == 2
+
+    run_with_fake(scenario)
@@ -0,0 +1,73 @@
+import asyncio
+
+from server import EmailMessageSummary, MailTmAdapter, MessageCache, _etag, _etag_matches
+
+
+def listing(count):
+    return [{
+        "id": f"{index:024x}",
+        "from": {"address": "no-reply@example.com"},
+        "to": [{"address": "user@example.test"}],
+        "subject": f"Message {index}",
+        "intro": f"Your code is {100000 + index}",
+        "createdAt": "2026-01-01T00:00:00Z",
+    } for index in range(count)]
+
+
+def make_adapter(summaries):
+    adapter = MailTmAdapter(base_url="http://upstream.invalid")
+
+    async def fetch_listing(token):
+        return summaries
+
+    adapter._fetch_listing = fetch_listing
+    return adapter
+
+
+def test_unchanged_polls_reuse_serialized_summaries(monkeypatch):
+    serialized = []
+    dump = EmailMessageSummary.model_dump_json
+    monkeypatch.setattr(EmailMessageSummary, "model_dump_json",
+                        lambda self, **kwargs: serialized.append(self.id) or dump(self, **kwargs))
+    adapter = make_adapter(listing(25))
+
+    async def poll():
+        messages = await adapter.list_messages("token")
+        return messages, _etag([str(len(messages)).encode()] + [message.digest() for message in messages])
+
+    async def scenario():
+        return [await poll() for _ in range(3)]
+
+    (first, first_tag), (second, second_tag), (third, third_tag) = asyncio.run(scenario())
+    assert len(serialized) == 25
+    assert first_tag == second_tag == third_tag
+    assert all(a is b for a, b in zip(first, third))
+
+
+def test_summaries_of_removed_messages_are_forgotten():
+    summaries = listing(3)
+    adapter = make_adapter(summaries)
+    asyncio.run(adapter.list_messages("token"))
+    del summaries[0]
+    asyncio.run(adapter.list_messages("token"))
+    assert set(adapter.message_cache.get_summaries("token")) == {item["id"] for item in summaries}
+
+
+def test_summary_cache_is_bounded_and_dropped_with_the_inbox():
+    cache = MessageCache(max_inboxes=2)
+    for token in ("a", "b", "c"):
+        cache.update_summaries(token, {"id": MailTmAdapter._parse_summary(listing(1)[0])})
+    assert cache.get_summaries("a") == {}
+    assert cache.get_summaries("c")
+    cache.drop_inbox("c")
+    assert cache.get_summaries("c") == {}
+
+
+def test_etag_matching_ignores_weakness_and_coding_suffix():
+    tag = _etag([b"a", b"b"])
+    assert _etag_matches(tag, tag)
+    assert _etag_matches(f'W/{tag}', tag)
+    assert _etag_matches(f'"other", {tag[:-1]}-gzip"', tag)
+    assert _etag_matches("*", tag)
+    assert not _etag_matches('"other"', tag)
+    assert not _etag_matches(None, tag)
@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from server import SQLiteInboxStore
+
+from .upstream import run_api_with_fake
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SQLiteInboxStore(str(tmp_path / "inboxes.db"))
+
+
+async def inbox_with_messages(fake, client, count=5):
+    inbox = (await client.post("/api/inbox/create", json={})).json()["inbox"]
+    messages = []
+    for index in range(count):
+        messages.insert(0, fake.add_message(inbox["id"], subject=f"Message {index}", text=f"Body {index}"))
+        await asyncio.sleep(0.002)
+
+    async def get(**params):
+        return await client.get(f"/api/inbox/{inbox['id']}/messages", params={"token": inbox["token"], **params})
+
+    return messages, get
+
+
+def ids(response):
+    return [message["id"] for message in response.json()]
+
+
+def test_pages_and_limits(store):
+    async def scenario(fake, adapter, client):
+        messages, get = await inbox_with_messages(fake, client)
+        everything = await get()
+        assert ids(everything) == [message["id"] for message in messages]
+        assert everything.headers["X-Total-Count"] == "5"
+
+        second_page = await get(page=2, limit=2)
+        assert ids(second_page) == [message["id"] for message in messages[2:4]]
+        assert second_page.headers["X-Total-Count"] == "5"
+        assert ids(await get(page=4, limit=2)) == []
+        assert (await get(limit=0)).status_code == 422
+        assert (await get(page=0)).status_code == 422
+
+    run_api_with_fake(scenario, store)
+
+
+def test_since_cursors(store):
+    async def scenario(fake, adapter, client):
+        messages, get = await inbox_with_messages(fake, client)
+        newer = [message["id"] for message in messages[:2]]
+        by_id = await get(since=messages[2]["id"])
+        assert ids(by_id) == newer
+        assert by_id.headers["X-Total-Count"] == "2"
+        assert ids(await get(since=messages[2]["createdAt"])) == newer
+        assert ids(await get(since=messages[0]["id"])) == []
+
+        gone = await get(since="0123456789abcdef01234567")
+        assert gone.status_code == 410
+        assert (await get(since="not a cursor!")).status_code == 422
+
+    run_api_with_fake(scenario, store)
+
+
+def test_summary_fields(store):
+    async def scenario(fake, adapter, client):
+        messages, get = await inbox_with_messages(fake, client, count=2)
+        summaries = (await get(fields="summary")).json()
+        assert [summary["id"] for summary in summaries] == [message["id"] for message in messages]
+        assert summaries[0]["subject"] == "Message 1"
+        assert "body" not in summaries[0] and "html_body" not in summaries[0]
+        full = (await get()).json()
+        assert full[0]["body"] == "Body 1"
+        assert (await get(fields="everything")).status_code == 422
+
+    run_api_with_fake(scenario, store)
@@ -0,0 +1,69 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+from prometheus_client import REGISTRY
+
+import server
+from server import MetricsMiddleware, SQLiteInboxStore
+
+from .upstream import run_api_with_fake
+
+
+def requests_total(method, route, status):
+    return REGISTRY.get_sample_value("tempmail_http_requests_total",
+                                     {"method": method, "route": route, "status": status}) or 0.0
+
+
+def latency_count(method, route):
+    return REGISTRY.get_sample_value("tempmail_http_request_duration_seconds_count",
+                                     {"method": method, "route": route}) or 0.0
+
+
+def test_failure_after_the_response_started_is_counted_once():
+    app = FastAPI()
+
+    @app.get("/test/broken-stream")
+    async def broken_stream():
+        async def body():
+            yield b"partial"
+            raise HTTPException(status_code=413, detail="Attachment too large")
+        return StreamingResponse(body())
+
+    app.add_middleware(MetricsMiddleware, timing_header=False)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url="http://api.test") as client:
+            await client.get("/test/broken-stream")
+
+    before = requests_total("GET", "/test/broken-stream", "200"), latency_count("GET", "/test/broken-stream")
+    asyncio.run(scenario())
+    after = requests_total("GET", "/test/broken-stream", "200"), latency_count("GET", "/test/broken-stream")
+    assert (after[0] - before[0], after[1] - before[1]) == (1, 1)
+
+
+@pytest.mark.skipif(not server.METRICS_ENABLED, reason="metrics disabled")
+def test_metrics_are_labelled_by_route_template(tmp_path):
+    store = SQLiteInboxStore(str(tmp_path / "inboxes.db"))
+    route = "/api/inbox/{inbox_id}"
+
+    async def scenario(fake, adapter, client):
+        inbox = (await client.post("/api/inbox/create", json={})).json()["inbox"]
+        before = requests_total("DELETE", route, "403"), requests_total("DELETE", route, "204")
+        assert (await client.delete(f"/api/inbox/{inbox['id']}", params={"token": "wrong"})).status_code == 403
+        assert (await client.delete(f"/api/inbox/{inbox['id']}", params={"token": inbox["token"]})).status_code == 204
+        assert (requests_total("DELETE", route, "403") - before[0],
+                requests_total("DELETE", route, "204") - before[1]) == (1, 1)
+
+        unmatched = requests_total("GET", "unmatched", "404")
+        assert (await client.get("/api/no-such-route")).status_code == 404
+        assert requests_total("GET", "unmatched", "404") == unmatched + 1
+
+        exposition = (await client.get("/metrics")).text
+        assert f'tempmail_http_requests_total{{method="DELETE",route="{route}",status="204"}}' in exposition
+        assert inbox["id"] not in exposition
+
+    run_api_with_fake(scenario, store)
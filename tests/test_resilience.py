@@ -0,0 +1,214 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from server import CircuitBreaker, MailTmAdapter, TokenBucket
+
+from .upstream import run_with_fake
+
+
+def make_adapter(send, failure_threshold=2, reset_timeout=0.05):
+    adapter = MailTmAdapter(base_url="http://upstream.invalid")
+    adapter.rate_limiter = TokenBucket(rate=0)
+    adapter.breaker = CircuitBreaker(failure_threshold=failure_threshold, reset_timeout=reset_timeout)
+    adapter._send_request = send
+    return adapter
+
+
+def open_breaker(breaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_breaker_opens_after_threshold_and_fails_fast():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+
+def test_breaker_success_resets_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_breaker_half_open_lets_a_single_probe_through():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+    open_breaker(breaker)
+    time.sleep(0.02)
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+
+def test_breaker_failed_probe_reopens():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+    open_breaker(breaker)
+    time.sleep(0.02)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+
+def test_breaker_release_allows_another_probe():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+    open_breaker(breaker)
+    time.sleep(0.02)
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
+
+
+@pytest.mark.parametrize("error", [ValueError("invalid JSON"), KeyError("token")])
+def test_unexpected_probe_error_does_not_wedge_the_breaker(error):
+    calls = []
+
+    async def send(method, endpoint, token=None, **kwargs):
+        calls.append(endpoint)
+        if len(calls) == 1:
+            raise error
+        return {"ok": True}
+
+    async def scenario():
+        adapter = make_adapter(send)
+        open_breaker(adapter.breaker)
+        await asyncio.sleep(0.06)
+        with pytest.raises(type(error)):
+            await adapter._make_request("POST", "/token")
+        assert adapter.breaker.state == CircuitBreaker.OPEN
+        await asyncio.sleep(0.06)
+        assert await adapter._make_request("POST", "/token") == {"ok": True}
+        assert adapter.breaker.state == CircuitBreaker.CLOSED
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_probe_releases_the_breaker():
+    async def scenario():
+        entered = asyncio.Event()
+
+        async def send(method, endpoint, token=None, **kwargs):
+            entered.set()
+            await asyncio.sleep(10)
+
+        adapter = make_adapter(send)
+        open_breaker(adapter.breaker)
+        await asyncio.sleep(0.06)
+        probe = asyncio.create_task(adapter._make_request("GET", "/messages"))
+        await entered.wait()
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        assert adapter.breaker.allow()
+
+    asyncio.run(scenario())
+
+
+def test_client_errors_close_the_breaker_and_server_errors_count():
+    async def send(method, endpoint, token=None, **kwargs):
+        raise HTTPException(status_code=503 if endpoint == "/down" else 404)
+
+    async def scenario():
+        adapter = make_adapter(send, failure_threshold=2, reset_timeout=60)
+        for _ in range(2):
+            with pytest.raises(HTTPException):
+                await adapter._make_request("POST", "/down")
+        assert adapter.breaker.state == CircuitBreaker.OPEN
+        with pytest.raises(HTTPException) as failed_fast:
+            await adapter._make_request("POST", "/missing")
+        assert failed_fast.value.status_code == 503
+
+    asyncio.run(scenario())
+
+
+def test_token_bucket_allows_a_burst_then_paces():
+    async def scenario():
+        bucket = TokenBucket(rate=50, burst=3)
+        started = time.monotonic()
+        for _ in range(3):
+            await bucket.acquire()
+        assert time.monotonic() - started < 0.02
+        for _ in range(5):
+            await bucket.acquire()
+        return time.monotonic() - started
+
+    # Five tokens beyond the burst at 50/s need about 0.1s
+    assert 0.08 <= asyncio.run(scenario()) < 0.5
+
+
+def test_token_bucket_penalize_blocks_callers():
+    async def scenario():
+        bucket = TokenBucket(rate=1000, burst=10)
+        bucket.penalize(0.1)
+        started = time.monotonic()
+        await bucket.acquire()
+        return time.monotonic() - started
+
+    assert asyncio.run(scenario()) >= 0.09
+
+
+def test_token_bucket_without_rate_only_honours_penalties():
+    async def scenario():
+        bucket = TokenBucket(rate=0, burst=1)
+        started = time.monotonic()
+        for _ in range(100):
+            await bucket.acquire()
+        unlimited = time.monotonic() - started
+        bucket.penalize(0.05)
+        started = time.monotonic()
+        await bucket.acquire()
+        return unlimited, time.monotonic() - started
+
+    unlimited, penalized = asyncio.run(scenario())
+    assert unlimited < 0.05
+    assert penalized >= 0.04
+
+
+def test_attachment_probe_with_client_error_does_not_wedge_the_breaker():
+    async def scenario(fake, adapter):
+        address = await adapter.create_inbox("probe")
+        message = fake.add_message(address.id, attachments=[
+            {"filename": "a.txt", "contentType": "text/plain", "content": "aGVsbG8="}])
+        attachment = {"id": message["attachments"][0]["id"], "filename": "a.txt",
+                      "downloadUrl": message["attachments"][0]["downloadUrl"]}
+        adapter.breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+        open_breaker(adapter.breaker)
+        await asyncio.sleep(0.06)
+        with pytest.raises(HTTPException) as refused:
+            await adapter.open_attachment("not-a-token", message["id"], attachment)
+        assert refused.value.status_code == 401
+        assert adapter.breaker.state == CircuitBreaker.CLOSED
+        assert await adapter.get_domains() == [fake.domain]
+
+    run_with_fake(scenario)
+
+
+def test_cancelled_attachment_probe_releases_the_breaker():
+    async def scenario(fake, adapter):
+        adapter.breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+        open_breaker(adapter.breaker)
+        await asyncio.sleep(0.06)
+        adapter.rate_limiter.penalize(10)
+        attachment = {"id": "a1", "filename": "a.txt", "downloadUrl": "/messages/m1/attachment/a1"}
+        probe = asyncio.create_task(adapter.open_attachment("token", "m1", attachment))
+        await asyncio.sleep(0.02)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        assert adapter.breaker.allow()
+
+    run_with_fake(scenario)
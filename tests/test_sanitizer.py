@@ -0,0 +1,127 @@
+from datetime import datetime, timezone
+from html.parser import HTMLParser
+
+import pytest
+
+from server import EmailMessage, HTMLSanitizer, MessageMatcher, MessageRenderer
+
+
+def sanitize(body, remote_images="block"):
+    sanitizer = HTMLSanitizer(remote_images)
+    sanitizer.feed(body)
+    return sanitizer.result()
+
+
+@pytest.mark.parametrize("body", [
+    '<script>alert(1)</script>',
+    '<style>p { color: red }</style>',
+    '<iframe src="https://evil.test/"></iframe>',
+    '<svg><circle onload="alert(1)"/></svg>',
+])
+def test_dangerous_elements_are_dropped_with_their_content(body):
+    html, text = sanitize(f"<p>before</p>{body}<p>after</p>")
+    assert html == "<p>before</p><p>after</p>"
+    assert "alert" not in text
+
+
+@pytest.mark.parametrize("tag", ["embed", "frame", "source", "link", "meta"])
+def test_void_dropped_tags_keep_the_rest_of_the_body(tag):
+    html, text = sanitize(f'<p>Hello<{tag} src="x.swf"></p><p>Your code: 4321</p>')
+    assert html == "<p>Hello</p><p>Your code: 4321</p>"
+    assert "4321" in text
+
+
+def test_code_extraction_survives_embeds():
+    rendered = MessageRenderer().render("m1", "", '<p>Hello<embed src="x.swf"></p><p>Your code: 4321</p>')
+    message = EmailMessage(id="m1", from_address="a@example.com", to_address="b@example.com", subject="Hi",
+                           body=rendered.text, html_body=rendered.html, snippet=rendered.snippet,
+                           received_at=datetime.now(timezone.utc))
+    assert "4321" in message.snippet
+    assert MessageMatcher().extract_code(message) == "4321"
+
+
+def test_event_handlers_and_script_links_are_removed():
+    html, _ = sanitize('<a href="javascript:alert(1)" onclick="x()">link</a><p onmouseover="x()">p</p>')
+    assert html == "<a>link</a><p>p</p>"
+
+
+def test_links_open_without_referrer():
+    html, _ = sanitize('<a href="https://example.com/">go</a>')
+    assert html == ('<a href="https://example.com/" target="_blank" '
+                    'rel="noopener noreferrer nofollow">go</a>')
+
+
+def test_unclosed_tags_are_closed():
+    html, _ = sanitize("<div><b>bold")
+    assert html == "<div><b>bold</b></div>"
+
+
+@pytest.mark.parametrize("style", [
+    "background:url(http://tracker/p.gif)",
+    r"background:u\72l(http://tracker/p.gif)",
+    r"background:\75rl(http://tracker/p.gif)",
+    "background:ur/**/l(http://tracker/p.gif)",
+    "background-image:image-set('http://tracker/p.gif' 1x)",
+    "width:expression(alert(1))",
+    r"posit\69on:fixed",
+    "position:fixed",
+])
+def test_unsafe_styles_are_removed(style):
+    html, _ = sanitize(f'<p style="{style}; color: red">x</p>')
+    assert html == '<p style="color: red">x</p>'
+
+
+def test_remote_images_are_parked_unless_allowed():
+    blocked, _ = sanitize('<img src="https://example.com/logo.png" alt="logo">')
+    assert blocked == '<img alt="logo" data-remote-src="https://example.com/logo.png">'
+    allowed, _ = sanitize('<img src="https://example.com/logo.png">', remote_images="allow")
+    assert 'src="https://example.com/logo.png"' in allowed
+    assert 'referrerpolicy="no-referrer"' in allowed
+
+
+class _Elements(HTMLParser):
+    """Parse markup the way the browser does and keep each element's attributes"""
+
+    def __init__(self, markup):
+        super().__init__()
+        self.elements = []
+        self.feed(markup)
+        self.close()
+
+    def handle_starttag(self, tag, attrs):
+        self.elements.append((tag, dict(attrs)))
+
+
+def test_marker_text_in_attributes_stays_inert():
+    # The frontend used to string-replace data-remote-src= in this output,
+    # which turned the title text into a live onmouseover handler
+    title = "data-remote-src=x onmouseover=alert(1) x"
+    html = MessageRenderer().render("m1", "", f'<span title="{title}">hi</span>'
+                                              '<img src="https://example.com/a.png" alt="a">').html
+    elements = _Elements(html).elements
+    assert elements == [("span", {"title": title}),
+                        ("img", {"alt": "a", "data-remote-src": "https://example.com/a.png"})]
+    # What the "show images" button does: swap the attribute on the parsed element
+    image = elements[1][1]
+    image["src"] = image.pop("data-remote-src")
+    assert not [name for _, attrs in elements for name in attrs if name.startswith("on")]
+
+
+@pytest.mark.parametrize("img", [
+    '<img src="https://t.test/p.gif" width="1" height="1">',
+    '<img src="https://t.test/p.gif" width="0px">',
+    '<img src="https://t.test/p.gif" style="width:1px;height:1px">',
+    '<img src="https://t.test/p.gif" style="max-height: 0 !important">',
+    '<img src="https://t.test/p.gif" style="display: none">',
+])
+def test_tracking_pixels_are_removed(img):
+    html, _ = sanitize(f"<p>hi{img}</p>")
+    assert html == "<p>hi</p>"
+
+
+def test_sanitizing_is_idempotent():
+    body = ('<div style="color: red"><img src="https://example.com/a.png" alt="a">'
+            '<a href="https://example.com/">go</a><embed src="x"><p>text</div>')
+    once, _ = sanitize(body)
+    twice, _ = sanitize(once)
+    assert once == twice
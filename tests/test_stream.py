@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+import server
+from server import WatcherRegistry
+
+
+class RecordingIngestor:
+    def __init__(self):
+        self.watched = []
+        self.unwatched = []
+
+    def watch(self, inbox_id, token):
+        self.watched.append(inbox_id)
+
+    def unwatch(self, inbox_id):
+        self.unwatched.append(inbox_id)
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    async def resolve(inbox_id, token):
+        return token
+
+    async def fetch(token):
+        if token == "expired":
+            raise HTTPException(status_code=401, detail="Invalid JWT Token")
+        return []
+
+    registry = WatcherRegistry(fetch)
+    monkeypatch.setattr(server, "watchers", registry)
+    monkeypatch.setattr(server, "_resolve_token", resolve)
+    monkeypatch.setattr(server.mail_service, "ingestor", None)
+    return registry
+
+
+def test_invalid_token_is_refused_before_streaming(registry):
+    async def scenario():
+        with pytest.raises(HTTPException) as refused:
+            await server._open_inbox_stream("inbox", "expired")
+        return refused.value.status_code
+
+    assert asyncio.run(scenario()) == 401
+    assert len(registry) == 0
+
+
+def test_valid_token_starts_with_the_snapshot(registry):
+    async def scenario():
+        token, queue, first = await server._open_inbox_stream("inbox", "valid")
+        server._unwatch_inbox("inbox", token, queue)
+        return first
+
+    assert asyncio.run(scenario()) == ("snapshot", [])
+    assert len(registry) == 0
+
+
+def test_wait_clamps_timeout_to_the_maximum(registry, monkeypatch):
+    monkeypatch.setattr(server, "WAIT_MAX_TIMEOUT", 0.05)
+
+    async def scenario():
+        return await asyncio.wait_for(
+            server.wait_for_message("inbox", "valid", timeout=3600, sender=None, subject_regex=None,
+                                    body_regex=None, since=None, extract=True),
+            timeout=5,
+        )
+
+    assert asyncio.run(scenario()).matched is False
+    assert len(registry) == 0
+
+
+def wait(**params):
+    query = {"timeout": 5, "sender": None, "subject_regex": None, "body_regex": None, "since": None,
+             "extract": True, **params}
+    return server.wait_for_message(query.pop("inbox_id", "inbox"), query.pop("token"), **query)
+
+
+def test_wait_refuses_invalid_tokens_without_subscribing_upstream(registry, monkeypatch):
+    ingestor = RecordingIngestor()
+    monkeypatch.setattr(server.mail_service, "ingestor", ingestor)
+
+    async def scenario():
+        with pytest.raises(HTTPException) as refused:
+            await wait(token="expired")
+        return refused.value.status_code
+
+    assert asyncio.run(scenario()) == 401
+    assert ingestor.watched == []
+    assert len(registry) == 0
+
+
+def test_websocket_refuses_invalid_tokens_with_a_close_code(registry, monkeypatch):
+    ingestor = RecordingIngestor()
+    monkeypatch.setattr(server.mail_service, "ingestor", ingestor)
+    client = TestClient(server.app)
+
+    with client.websocket_connect("/api/inbox/inbox/stream?token=expired") as websocket:
+        with pytest.raises(WebSocketDisconnect) as refused:
+            websocket.receive_text()
+    assert refused.value.code == 4401
+    assert ingestor.watched == []
+
+    with client.websocket_connect("/api/inbox/inbox/stream?token=valid") as websocket:
+        assert websocket.receive_json() == {"type": "snapshot", "data": []}
+        assert ingestor.watched == ["inbox"]
@@ -0,0 +1,93 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+
+import server
+from server import InboxRecord, SQLiteInboxStore, TokenRefresher
+
+
+def record(inbox_id, expires_in):
+    now = datetime.now(timezone.utc)
+    return InboxRecord(id=inbox_id, email=f"{inbox_id}@example.test", domain="example.test", password="secret",
+                       created_at=now, access_token=f"access-{inbox_id}", token=f"upstream-{inbox_id}",
+                       token_expires_at=now + timedelta(seconds=expires_in))
+
+
+class CountingProvider:
+    def __init__(self):
+        self.renewed = []
+
+    async def renew_token(self, record):
+        self.renewed.append(record.id)
+        return f"renewed-{record.id}"
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SQLiteInboxStore(str(tmp_path / "inboxes.db"), touch_interval=60)
+    asyncio.run(store.init())
+    yield store
+    asyncio.run(store.close())
+
+
+def test_only_recently_used_inboxes_are_renewed_ahead(store):
+    provider = CountingProvider()
+
+    async def scenario():
+        for inbox_id in ("active", "idle"):
+            await store.save(record(inbox_id, expires_in=60))
+        await store.touch("active")
+        await TokenRefresher(store, provider, interval=1, margin=600, active_window=300).refresh_due()
+        return await store.get("active"), await store.get("idle")
+
+    active, idle = asyncio.run(scenario())
+    assert provider.renewed == ["active"]
+    assert active.token == "renewed-active"
+    assert idle.token == "upstream-idle"
+
+
+def test_touch_writes_at_most_once_per_interval(store):
+    async def scenario():
+        await store.save(record("inbox", expires_in=3600))
+        await store.touch("inbox")
+        first = await store._run(lambda conn: conn.execute("SELECT last_seen FROM inboxes").fetchone()[0])
+        await asyncio.sleep(0.01)
+        await store.touch("inbox")
+        second = await store._run(lambda conn: conn.execute("SELECT last_seen FROM inboxes").fetchone()[0])
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first is not None and first == second
+
+
+def test_idle_inbox_is_renewed_on_its_next_request(store, monkeypatch):
+    provider = CountingProvider()
+    monkeypatch.setattr(server, "inbox_store", store)
+    monkeypatch.setattr(server.mail_service, "renew_token", provider.renew_token)
+
+    async def scenario():
+        await store.save(record("lapsed", expires_in=-10))
+        await store.save(record("fresh", expires_in=3600))
+        lapsed = await asyncio.gather(*(server._resolve_token("lapsed", "access-lapsed") for _ in range(3)))
+        fresh = await server._resolve_token("fresh", "access-fresh")
+        return lapsed, fresh, await store.get("lapsed")
+
+    lapsed, fresh, stored = asyncio.run(scenario())
+    assert lapsed == ["renewed-lapsed"] * 3
+    assert provider.renewed == ["lapsed"]
+    assert stored.token == "renewed-lapsed"
+    assert fresh == "upstream-fresh"
+
+
+def test_non_ascii_tokens_are_refused(store, monkeypatch):
+    monkeypatch.setattr(server, "inbox_store", store)
+
+    async def scenario():
+        await store.save(record("inbox", expires_in=3600))
+        with pytest.raises(HTTPException) as refused:
+            await server._resolve_token("inbox", "accèss-inbox")
+        return refused.value.status_code
+
+    assert asyncio.run(scenario()) == 401
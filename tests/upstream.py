@@ -0,0 +1,57 @@
+"""Helpers running the mail.tm adapter against the in-process fake API"""
+
+import asyncio
+import time
+
+import httpx
+from aiohttp.test_utils import TestServer
+
+import server
+from fake_mailtm import FakeMailTm, create_app
+from server import MailTmAdapter, MercureIngestor
+
+
+async def eventually(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not met in time"
+        await asyncio.sleep(0.02)
+
+
+def run_with_fake(scenario, store=None):
+    """Run `scenario(fake, adapter)` with an adapter talking to a fresh fake"""
+    async def main():
+        fake = FakeMailTm()
+        async with TestServer(create_app(fake)) as upstream:
+            base_url = str(upstream.make_url("")).rstrip("/")
+            adapter = MailTmAdapter(base_url=base_url)
+            adapter.inbox_pool = None
+            adapter.ingestor = MercureIngestor(adapter, hub_url=f"{base_url}/.well-known/mercure")
+            adapter.inbox_store = store
+            if store is not None:
+                await store.init()
+            await adapter.start()
+            try:
+                await scenario(fake, adapter)
+            finally:
+                await adapter.ingestor.close()
+                await adapter.close()
+                if store is not None:
+                    await store.close()
+
+    asyncio.run(main())
+
+
+def run_api_with_fake(scenario, store):
+    """Run `scenario(fake, adapter, client)`, `client` calling the API routes served by that adapter"""
+    async def with_client(fake, adapter):
+        saved = server.mail_service, server.inbox_store
+        server.mail_service, server.inbox_store = adapter, store
+        try:
+            transport = httpx.ASGITransport(app=server.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://api.test") as client:
+                await scenario(fake, adapter, client)
+        finally:
+            server.mail_service, server.inbox_store = saved
+
+    run_with_fake(with_client, store)